@@ -1,9 +1,19 @@
-from datareader import read_data
+from docstore import load_documents
 from indexer import build_index
-from search import search
+from search import search, is_operator, write_docids, write_documents
+from server import serve, PORT
 from tkinter import *
 import os
+import re
 import sys
+import queue
+import threading
+
+# number of top documents retrieved in ranked mode
+TOP_K = 20
+# milliseconds between checks for results of the search running in the background
+POLL_INTERVAL = 20
+
 
 class GUI:
     def __init__(self):
@@ -32,12 +42,16 @@ class GUI:
                                           onvalue=True, offvalue=False)
         self.show_docids_btn = Button(self.tools_frame, text="Show all results", command=self.open_docidsfile,
                                       font=(None, 13, "bold"))
-        self.prev_res_btn = Button(self.tools_frame, text="Prev page")
-        self.next_res_btn = Button(self.tools_frame, text="Next page")
+        self.prev_res_btn = Button(self.tools_frame, text="Prev page",
+                                   command=lambda: self.show_results(None, self.page - 1))
+        self.next_res_btn = Button(self.tools_frame, text="Next page",
+                                   command=lambda: self.show_results(None, self.page + 1))
         self.show_docs_btn = Button(self.tools_frame, text="Show all documents", command=self.open_docsfile,
                                     font=(None, 13, "bold"))
-        self.prev_doc_btn = Button(self.tools_frame, text="Prev doc")
-        self.next_doc_btn = Button(self.tools_frame, text="Next doc")
+        self.prev_doc_btn = Button(self.tools_frame, text="Prev doc",
+                                   command=lambda: self.show_doc(None, self.current_docid_index - 1))
+        self.next_doc_btn = Button(self.tools_frame, text="Next doc",
+                                   command=lambda: self.show_doc(None, self.current_docid_index + 1))
         self.tip = Message(self.tools_frame, text="*click on the number in the results list to display the document")
 
         # defining positions and sizes of frames
@@ -59,7 +73,23 @@ class GUI:
         self.current_docid_index = -1
         self.current_docid = -1
         self.links = {}
-        self.query = ''
+        # query and mode of the shown results, used to highlight and export them
+        self.results_query = ''
+        self.results_rankedmode = True
+        self.page = 0
+
+        # labels of results created once and reused on every page
+        self.link_labels = []
+        self.page_start = 0
+
+        # searches run in a worker thread, results are passed to the main loop through the queue
+        self.search_results = queue.Queue()
+        self.search_id = 0
+        self.polling = False
+
+        # pattern of query terms and offsets of their matches in shown documents
+        self.highlight_pattern = None
+        self.highlights = {}
 
         # running main window
         self.root.mainloop()
@@ -68,9 +98,9 @@ class GUI:
         """
         Cleaning up the window from previous results
         """
-        lst = self.results_frame.grid_slaves()
-        for l in lst:
-            l.destroy()
+        for link in self.link_labels:
+            link.grid_remove()
+        self.links = {}
         self.tools_label.grid_remove()
         self.rankedmode_che.grid_remove()
         self.show_docids_btn.grid_remove()
@@ -84,31 +114,76 @@ class GUI:
 
     def process_input(self, event):
         """
-        Processing input query
+        Processing input query: search is run in a worker thread, so the window stays responsive
         """
         # getting input from user
         query = self.search_input.get()
-        self.query = query
+        rankedmode = self.rankedmode.get()
 
         # cleaning any previous results
         self.clean_env()
+        self.status.set("Searching...")
 
-        # searching results for the query
-        result = search(docs, index, query, rankedmode=self.rankedmode.get())
+        # results of previous searches still running are ignored
+        self.search_id += 1
+        worker = threading.Thread(target=self.run_search, args=(self.search_id, query, rankedmode), daemon=True)
+        worker.start()
+        if not self.polling:
+            self.polling = True
+            self.root.after(POLL_INTERVAL, self.poll_results)
 
+    def run_search(self, search_id, query, rankedmode):
+        """
+        Searching results for the query in the worker thread
+        :param search_id: number of the search
+        :param query: string value of the query
+        :param rankedmode: ranked or boolean retrieval
+        """
+        try:
+            result = search(docs, index, query, rankedmode=rankedmode, k=TOP_K)
+        except Exception as e:
+            result = {'error_message': "Search failed: %s" % e}
+        self.search_results.put((search_id, query, rankedmode, result))
+
+    def poll_results(self):
+        """
+        Checking for results of the worker thread in the main loop, Tk widgets are updated only here
+        """
+        try:
+            search_id, query, rankedmode, result = self.search_results.get_nowait()
+        except queue.Empty:
+            self.root.after(POLL_INTERVAL, self.poll_results)
+            return
+
+        if search_id != self.search_id:
+            # results of an outdated search, waiting for the latest one
+            self.root.after(POLL_INTERVAL, self.poll_results)
+            return
+
+        self.polling = False
+        self.show_search_results(result, query, rankedmode)
+
+    def show_search_results(self, result, query, rankedmode):
+        """
+        Displaying results of the search
+        :param result: dictionary with results or an error message
+        :param query: string value of the query
+        :param rankedmode: ranked or boolean retrieval
+        """
         if 'error_message' in result:
             self.status.set(result['error_message'])
         elif 'results' in result:
             if len(result['results']) > 0:
                 # working with results
-                if self.rankedmode.get():
-                    self.status.set("Results found: %d. Showing TOP %d:"
-                                    % (len(result['results']), len(result['results'][:20])))
-                    self.retrieved_docs = result['results'][:20]
+                self.results_query = query
+                self.results_rankedmode = rankedmode
+                if rankedmode:
+                    self.status.set("Showing TOP %d results:" % len(result['results']))
                 else:
                     self.status.set("Results found: %d" % len(result['results']))
-                    self.retrieved_docs = result['results']
+                self.retrieved_docs = result['results']
                 self.current_docid_index = 0
+                self.prepare_highlighting()
 
                 # turning all necessary elements on
                 self.tools_label.grid(row=0, column=0, columnspan=2, sticky="we")
@@ -123,8 +198,26 @@ class GUI:
 
                 # displaying results
                 self.show_results(None, 0)
+            elif 'suggestions' in result:
+                self.status.set("Nothing found. Did you mean: %s?"
+                                % ', '.join(terms[0] for terms in result['suggestions'].values()))
             else:
                 self.status.set("Nothing found. Try another query")
+        else:
+            self.status.set("")
+
+    def link_label(self, i):
+        """
+        Label of the i-th result on the page, created on first use
+        :param i: position of the result on the page
+        :return: label widget
+        """
+        while len(self.link_labels) <= i:
+            position = len(self.link_labels)
+            link = Label(self.results_frame, fg="blue", cursor="hand2", font=(None, 13))
+            link.bind("<Button-1>", lambda event, position_=position: self.show_doc(event, self.page_start + position_))
+            self.link_labels.append(link)
+        return self.link_labels[i]
 
     def show_results(self, event, page):
         """
@@ -133,39 +226,35 @@ class GUI:
         """
         docs = self.retrieved_docs
 
-        # cleaning up previous results
-        elems = self.results_frame.grid_slaves()
-        for e in elems:
-            e.destroy()
-        self.links = {}
-
-        # removing highlighting
-        if self.links and int(self.current_docid) > 0:
-            self.links[self.current_docid].config(bg="white")
-
         # showing docids for the current results page
-        if self.rankedmode.get():
+        if self.results_rankedmode:
             row, rows, column, columns = 1, 5, 1, 4
         else:
             row, rows, column, columns = 1, 8, 1, 15
         items_number = rows * columns
+        if page < 0 or page * items_number >= len(docs):
+            return
+        self.page = page
+        self.page_start = page * items_number
+        self.links = {}
 
         rank = page * items_number + 1
-        for doc in docs[page * items_number: min((page + 1) * items_number, len(self.retrieved_docs))]:
+        page_docs = docs[page * items_number: min((page + 1) * items_number, len(docs))]
+        for i, doc in enumerate(page_docs):
             docid = doc[0]
             score = doc[1]
             link_text = " " * (4 - len(docid))
             link_text += "%4d" % int(docid)
-            if self.rankedmode.get():
+            if self.results_rankedmode:
                 link_text = "%4d. " % rank + link_text
                 rank += 1
                 link_text += " (%.5s)" % score
-            link = Label(self.results_frame, text=link_text, fg="blue", cursor="hand2", font=(None, 13))
+            link = self.link_label(i)
+            link.config(text=link_text, bg="white")
             link.grid(row=row, column=column, sticky="e")
-            link.bind("<Button-1>", lambda event, doc_=doc: self.show_doc(event, doc_))
             self.links[docid] = link
 
-            if self.rankedmode.get():
+            if self.results_rankedmode:
                 if row == rows:
                     column += 1
                     row = 1
@@ -178,91 +267,84 @@ class GUI:
                 else:
                     column += 1
 
-        self.current_docid_index = page * items_number
+        # hiding labels left from a longer page
+        for link in self.link_labels[len(page_docs):]:
+            link.grid_remove()
 
         # configuring results navigation buttons
-        if page > 0:
-            self.prev_res_btn.config(state="normal")
-            self.prev_res_btn.bind("<Button-1>", lambda event: self.show_results(event, page - 1))
-        else:
-            self.prev_res_btn.config(state="disabled")
-            self.prev_res_btn.unbind("<Button-1>")
+        self.prev_res_btn.config(state="normal" if page > 0 else "disabled")
+        self.next_res_btn.config(state="normal" if (page + 1) < len(docs) / items_number else "disabled")
 
-        if (page + 1) < len(self.retrieved_docs) / items_number:
-            self.next_res_btn.config(state="normal")
-            self.next_res_btn.bind("<Button-1>", lambda event: self.show_results(event, page + 1))
-        else:
-            self.next_res_btn.config(state="disabled")
-            self.next_res_btn.unbind("<Button-1>")
+        self.show_doc(None, self.page_start)
 
-        self.show_doc(None, docs[self.current_docid_index])
+    def prepare_highlighting(self):
+        """
+        Compiling a single pattern matching all query terms, matches are found once per shown document
+        """
+        query = self.results_query.replace('"', ' ').replace('(', ' ').replace(')', ' ')
+        tokens = {token.upper() for token in query.split() if not is_operator(token)}
+        if tokens:
+            # longer terms first, so that a term is not matched by its prefix
+            alternatives = '|'.join(re.escape(token) for token in sorted(tokens, key=len, reverse=True))
+            self.highlight_pattern = re.compile(r'\b(?:%s)\b' % alternatives)
+        else:
+            self.highlight_pattern = None
+        self.highlights = {}
 
-    def show_doc(self, event, doc):
+    def show_doc(self, event, position):
         """
         Showing content of the document
-        :param docid: id of the document
+        :param position: position of the document in the results
         """
+        if not 0 <= position < len(self.retrieved_docs):
+            return
+        doc = self.retrieved_docs[position]
 
         # removing highlighting
         if self.current_docid in self.links:
             self.links[self.current_docid].config(bg="white")
 
-        try:
-            self.current_docid_index = self.retrieved_docs.index(doc)
-        except ValueError:
-            return
+        self.current_docid_index = position
 
         # highlighting current document id
         self.current_docid = doc[0]
-        self.links[self.current_docid].config(bg="red")
+        if self.current_docid in self.links:
+            self.links[self.current_docid].config(bg="red")
 
         # configuring documents navigation buttons
-        if self.current_docid_index > 0:
-            self.prev_doc_btn.config(state="normal")
-            self.prev_doc_btn.bind("<Button-1>",
-                            lambda event: self.show_doc(event, self.retrieved_docs[self.current_docid_index - 1]))
-        else:
-            self.prev_doc_btn.config(state="disabled")
-            self.prev_doc_btn.unbind("<Button-1>")
-
-        if self.current_docid_index < len(self.retrieved_docs) - 1:
-            self.next_doc_btn.config(state="normal")
-            self.next_doc_btn.bind("<Button-1>",
-                            lambda event: self.show_doc(event, self.retrieved_docs[self.current_docid_index + 1]))
-        else:
-            self.next_doc_btn.config(state="disabled")
-            self.next_doc_btn.unbind("<Button-1>")
+        self.prev_doc_btn.config(state="normal" if position > 0 else "disabled")
+        self.next_doc_btn.config(state="normal" if position < len(self.retrieved_docs) - 1 else "disabled")
 
         txt = "Document %s" % doc[0]
-        if self.rankedmode.get():
+        if self.results_rankedmode:
             txt += " (%.5s)" % doc[1]
         txt += "\n" + docs[doc[0]]['title'] + "\n" + docs[doc[0]]['content']
         self.document.delete(1.0, END)
         self.document.insert(END, txt)
 
-        # highlighting search query terms in the document
+        # highlighting search query terms in the document by offsets of their matches
         self.document.tag_config('query', background='yellow')
-        query_tokens = self.query.split()
-        for token in query_tokens:
-            pos = '1.0'
-            while True:
-                keyword = '\y' + token.upper() + '\y'
-                idx = self.document.search(keyword, pos, END, regexp=True)
-                if not idx:
-                    break
-                pos = '{}+{}c'.format(idx, len(token))
-                self.document.tag_add('query', idx, pos)
+        if self.highlight_pattern is not None:
+            if doc[0] not in self.highlights:
+                self.highlights[doc[0]] = [match.span() for match in self.highlight_pattern.finditer(txt)]
+            for start, end in self.highlights[doc[0]]:
+                self.document.tag_add('query', '1.0+%dc' % start, '1.0+%dc' % end)
 
     def open_docsfile(self):
-        os.system("open " + '../results/lastquery.txt')
+        # results are exported only when they are requested
+        path = write_documents(docs, self.results_query, self.retrieved_docs, self.results_rankedmode, k=TOP_K)
+        os.system("open " + path)
 
     def open_docidsfile(self):
-        os.system("open " + '../results/lastqueryids.txt')
+        path = write_docids(self.results_query, self.retrieved_docs, self.results_rankedmode, k=TOP_K)
+        os.system("open " + path)
 
 
 if __name__ == '__main__':
     guimode = None
+    servermode = False
     rankedmode = True
+    port = PORT
 
     if len(sys.argv) == 1:
         guimode = True
@@ -272,16 +354,23 @@ if __name__ == '__main__':
         guimode = False
         if len(sys.argv) == 3 and sys.argv[2] == 'bool':
             rankedmode = False
+    elif sys.argv[1] == 'serve' and (len(sys.argv) == 2 or len(sys.argv) == 3 and sys.argv[2].isdigit()):
+        servermode = True
+        if len(sys.argv) == 3:
+            port = int(sys.argv[2])
     else:
         print("ERROR: Incorrect arguments supplied")
-        print("Run either 'app.py', 'app.py console' or 'app.py console bool'")
+        print("Run either 'app.py', 'app.py console', 'app.py console bool' or 'app.py serve [port]'")
         sys.exit(2)
 
-    docs = read_data()
-    index = build_index(docs, from_dump=True)
+    # documents are read from the document store on demand instead of parsing the dataset
+    docs = load_documents()
+    index = build_index(docs, from_dump=True, positional=True, workers=os.cpu_count() or 1)
     query = ''
 
-    if guimode:
+    if servermode:
+        serve(docs, index, port=port, workers=os.cpu_count() or 1)
+    elif guimode:
         gui = GUI()
     else:
         # console mode logic
@@ -296,23 +385,26 @@ if __name__ == '__main__':
 
             last_query = query
 
-            result = search(docs, index, query, rankedmode=rankedmode)
+            result = search(docs, index, query, rankedmode=rankedmode, k=TOP_K)
+            last_stats = result['stats']
 
             if 'error_message' in result:
                 print("ERROR: %s" % result['error_message'])
             elif 'results' in result:
+                if 'suggestions' in result:
+                    print("Unknown words are skipped. Did you mean: %s?"
+                          % ', '.join(terms[0] for terms in result['suggestions'].values()))
                 if len(result['results']) > 0:
                     # working with results
                     if rankedmode:
-                        outresults = result['results'][:20]
-                        print("Found: %d documents" % len(result['results']))
+                        outresults = result['results']
                         print("Top %d documents with scores: \n" % len(outresults))
                     else:
                         outresults = result['results'][:20]
                         print("Results found: %d" % len(result['results']))
 
                     command = '\ids'
-                    while command in ['\ids', '\docs', '\docsfile']:
+                    while command in ['\ids', '\docs', '\docsfile', '\stats']:
                         if command == '\ids':
                             print('Document ids:')
                             rank = 1
@@ -337,11 +429,18 @@ if __name__ == '__main__':
                                 print("********************************************")
                             print()
                         elif command == '\docsfile':
-                            os.system("open " + '../results/lastquery.txt')
+                            # results are exported only when they are requested
+                            path = write_documents(docs, last_query, result['results'], rankedmode, k=TOP_K,
+                                                   stats=last_stats)
+                            os.system("open " + path)
+                        elif command == '\stats':
+                            print(last_stats.report())
+                            print()
 
                         print(">to display all document ids type '\ids'")
                         print(">to display all documents type '\docs'")
                         print(">to display all documents in a file type '\docsfile'")
+                        print(">to display timings of the query stages type '\stats'")
                         print(">to write another query type anything else")
                         print(">to finish execution type '\q")
 
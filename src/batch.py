@@ -0,0 +1,215 @@
+import heapq
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from scoring import COSINE
+from storage import DiskIndex
+from vectorized import np, numpy_scorer
+from instrumentation import stage, count
+from search import tokenize_query, find_unknown_terms, is_operator, parse_boolean_query, \
+    query_term_frequencies, evaluate_boolean_query, expand_wildcards, suggest_terms, unknown_terms_error
+
+# number of queries sharing fetched postings, bounds memory used by a batch
+BATCH_SIZE = 1024
+
+# index opened by each worker process
+worker_index = None
+
+
+class SharedPostings:
+    """
+    View of the index for a batch of queries: each posting (with positions and term weights)
+    is fetched and decoded once, and then served to all queries of the batch containing the term
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.docids = index.docids
+        self.positional = index.positional
+        self.postings = {}
+        self.term_positions = {}
+        self.weights = {}
+
+    def __contains__(self, term):
+        return term in self.index
+
+    def df(self, term):
+        return self.index.df(term)
+
+    def __getitem__(self, term):
+        posting = self.postings.get(term)
+        if posting is None:
+            with stage('fetch'):
+                posting = self.postings[term] = self.index[term]
+        return posting
+
+    def positions(self, term):
+        positions = self.term_positions.get(term)
+        if positions is None:
+            with stage('fetch'):
+                positions = self.term_positions[term] = self.index.positions(term)
+        return positions
+
+    def term_weights(self, term, scorer):
+        """
+        Weights of the term in documents of its posting, computed once per batch
+        :param term: term of the index
+        :param scorer: prepared scoring model
+        :return: sorted array of document ids and array of term weights aligned with it
+        """
+        weights = self.weights.get(term)
+        if weights is None:
+            posting = self[term]
+            tf_weight = scorer.tf_weight
+            weights = (posting.docids, array('d', (tf_weight(tf, docid) for docid, tf in posting.items())))
+            self.weights[term] = weights
+        return weights
+
+
+def score_query(shared, query_weights, k, scorer):
+    """
+    Exhaustive term-at-a-time scoring of the query over postings shared by the batch
+    :param shared: postings of the batch
+    :param query_weights: weights of the query terms
+    :param k: number of top documents to retrieve (all matching documents if None)
+    :param scorer: prepared scoring model
+    :return: list of (docid, score) sorted by score, ties are broken by document id
+    """
+    scores = {}
+    get = scores.get
+    for term, w in query_weights.items():
+        docids, weights = shared.term_weights(term, scorer)
+        for docid, weight in zip(docids, weights):
+            scores[docid] = get(docid, 0.0) + w * weight
+    count('documents_scored', len(scores))
+
+    normalize = scorer.normalize
+    scores = [(docid, normalize(score, docid)) for docid, score in scores.items()]
+    with stage('sort'):
+        if k is None:
+            scores.sort(key=lambda score: (-score[1], score[0]))
+        else:
+            scores = heapq.nsmallest(k, scores, key=lambda score: (-score[1], score[0]))
+    return scores
+
+
+def parse_query(index, query, rankedmode):
+    """
+    Tokenizes and parses the query the same way as 'search.search'
+    :param index: index built for the documents collection
+    :param query: string value of the query
+    :param rankedmode: ranked or boolean retrieval
+    :return: dictionary of query terms with frequencies (ranked mode), query in RPN (boolean mode),
+    None for an empty query or an error message
+    """
+    query = tokenize_query(query, rankedmode)
+    if not query:
+        return None
+
+    unknown_terms = find_unknown_terms(index, query)
+    if rankedmode:
+        return query_term_frequencies(expand_wildcards(index, [token for token in query
+                                                               if token not in unknown_terms
+                                                               and not is_operator(token)]))
+
+    if unknown_terms:
+        return unknown_terms_error(unknown_terms, suggest_terms(index, unknown_terms))
+    query = parse_boolean_query(query)
+    if 'error_message' in query:
+        return query
+    return expand_wildcards(index, query, rankedmode=False)
+
+
+def process_batch(index, queries, k=None, mode='ranked', scorer=COSINE, backend='python'):
+    """
+    Searches documents for a batch of distinct queries fetching each posting once
+    :param index: index built for the documents collection
+    :param queries: list of queries
+    :param k: number of top documents retrieved in ranked mode (all matching documents if None)
+    :param mode: 'ranked' or 'boolean'
+    :param scorer: scoring model of ranked retrieval
+    :param backend: scoring backend of ranked retrieval: 'python' or 'numpy'
+    :return: list of dictionaries with results or error messages aligned with queries
+    """
+    rankedmode = mode == 'ranked'
+    shared = SharedPostings(index)
+    if rankedmode:
+        scorer.prepare(index)
+
+    answers = []
+    # positions of ranked queries in answers and weights of their terms
+    ranked, queries_weights = [], []
+    for query in queries:
+        parsed = parse_query(index, query, rankedmode)
+        if parsed is None:
+            answers.append({})
+        elif 'error_message' in parsed:
+            answers.append(parsed)
+        elif rankedmode:
+            ranked.append(len(answers))
+            queries_weights.append(scorer.query_weights(index, parsed))
+            answers.append(None)
+        else:
+            results = evaluate_boolean_query(shared, parsed)
+            answers.append(results if 'error_message' in results else {'results': results})
+
+    if backend == 'numpy':
+        # all queries are scored together in a matrix
+        scores = numpy_scorer(index).score_batch(queries_weights, k, scorer)
+    else:
+        scores = [score_query(shared, query_weights, k, scorer) for query_weights in queries_weights]
+
+    for i, query_scores in zip(ranked, scores):
+        answers[i] = {'results': [(str(docid), score) for docid, score in query_scores]}
+    return answers
+
+
+def init_worker(dictpath, postpath):
+    global worker_index
+    worker_index = DiskIndex(dictpath, postpath)
+
+
+def process_worker_batch(queries, k, mode, scorer, backend):
+    return process_batch(worker_index, queries, k, mode, scorer, backend)
+
+
+def search_batch(docs, index, queries, k=None, mode='ranked', scorer=COSINE, backend=None,
+                 workers=1, batch_size=BATCH_SIZE):
+    """
+    Searches documents for many queries at once. Repeated queries are evaluated once, terms are
+    deduplicated across each batch of queries and their postings are fetched, decoded and weighted
+    once per batch. Ranked results are exact scores of all matching documents, as in 'search.search'
+    without pruning. Batches can be evaluated by a pool of processes, each opening the index files
+    :param docs: dictionary of documents on which search is being applied
+    :param index: index built for the documents collection
+    :param queries: list of queries
+    :param k: number of top documents retrieved in ranked mode (all matching documents if None)
+    :param mode: 'ranked' or 'boolean'
+    :param scorer: scoring model of ranked retrieval
+    :param backend: scoring backend of ranked retrieval: 'python' or 'numpy' (used if installed by default)
+    :param workers: number of processes, used only for an index stored on disk
+    :param batch_size: number of queries sharing fetched postings
+    :return: list of dictionaries with results or error messages aligned with queries
+    """
+    if mode not in ('ranked', 'boolean'):
+        raise ValueError("unknown search mode '%s'" % mode)
+    if backend is None:
+        backend = 'python' if np is None else 'numpy'
+
+    # identical queries are evaluated once
+    unique = list(dict.fromkeys(queries))
+    batches = [unique[i:i + batch_size] for i in range(0, len(unique), batch_size)]
+
+    answers = []
+    if workers > 1 and len(batches) > 1 and isinstance(index, DiskIndex):
+        with ProcessPoolExecutor(workers, initializer=init_worker,
+                                 initargs=(index.dictpath, index.postpath)) as executor:
+            for batch_answers in executor.map(process_worker_batch, batches, [k] * len(batches),
+                                              [mode] * len(batches), [scorer] * len(batches),
+                                              [backend] * len(batches)):
+                answers += batch_answers
+    else:
+        for batch in batches:
+            answers += process_batch(index, batch, k, mode, scorer, backend)
+
+    answers = dict(zip(unique, answers))
+    return [dict(answers[query]) for query in queries]
@@ -0,0 +1,283 @@
+import os
+import re
+import sys
+import json
+import math
+import random
+import argparse
+import resource
+from contextlib import redirect_stdout
+from time import time, perf_counter
+from datareader import read_data
+from indexer import build_index
+from search import search
+from batch import search_batch
+from scoring import SCORERS
+from storage import INDEX_DICT, INDEX_POSTINGS
+from instrumentation import percentile
+
+# query with relevant documents shipped with the collection
+TEST_QUERIES = '../dataset/testquery.txt'
+# query and relevance judgments files of LISA collection, used if present
+LISA_QUERIES = '../dataset/LISA.QUE'
+LISA_RELEVANCE = '../dataset/LISA.REL'
+
+# cutoffs of precision and nDCG
+CUTOFFS = (5, 10, 20)
+
+
+def read_test_queries(path=TEST_QUERIES):
+    """
+    Reads queries in the format of 'testquery.txt': 'Query: ...' line followed by 'Rel. docs: ...' line
+    :param path: path of the file
+    :return: list of (query, set of relevant docids)
+    """
+    queries, query = [], None
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('Query:'):
+                query = line[len('Query:'):].strip()
+            elif line.startswith('Rel. docs:') and query is not None:
+                queries.append((query, set(line[len('Rel. docs:'):].split())))
+                query = None
+    return queries
+
+
+def read_lisa_queries(querypath=LISA_QUERIES, relpath=LISA_RELEVANCE):
+    """
+    Reads LISA queries and relevance judgments. Queries are numbered blocks ending with '#',
+    judgments are 'Query N' blocks listing relevant docids terminated by -1
+    :param querypath: path of the file with queries
+    :param relpath: path of the file with relevance judgments
+    :return: list of (query, set of relevant docids)
+    """
+    queries = {}
+    with open(querypath, 'r') as f:
+        for block in f.read().split('#'):
+            lines = block.split()
+            if lines and lines[0].isdigit():
+                queries[lines[0]] = ' '.join(lines[1:])
+
+    relevant = {}
+    with open(relpath, 'r') as f:
+        for block in re.split(r'-1\b', f.read()):
+            # block: 'Query N', 'M Relevant Refs:' and ids of relevant documents
+            match = re.search(r'Query\s+(\d+)\s+\d+\s+Relevant\s+Refs:(.*)', block, re.S)
+            if match:
+                relevant[match.group(1)] = set(match.group(2).split())
+
+    return [(queries[qid], relevant[qid]) for qid in sorted(queries, key=int) if relevant.get(qid)]
+
+
+def judged_queries():
+    """
+    Collects all available queries with relevance judgments
+    :return: list of (query, set of relevant docids)
+    """
+    queries = []
+    if os.path.exists(TEST_QUERIES):
+        queries += read_test_queries()
+    if os.path.exists(LISA_QUERIES) and os.path.exists(LISA_RELEVANCE):
+        queries += read_lisa_queries()
+    return queries
+
+
+def generate_queries(index, n, min_terms=1, max_terms=5, seed=0):
+    """
+    Generates workload of random queries from terms of the index
+    :param index: index built for the documents collection
+    :param n: number of queries
+    :param min_terms: minimal number of terms in a query
+    :param max_terms: maximal number of terms in a query
+    :param seed: seed of the random generator
+    :return: list of queries
+    """
+    rng = random.Random(seed)
+    terms = sorted(term for term in index if term.isalpha() and index.df(term) > 1)
+    return [' '.join(rng.sample(terms, rng.randint(min_terms, max_terms))) for _ in range(n)]
+
+
+def precision_at(ranking, relevant, k):
+    return sum(1 for docid in ranking[:k] if docid in relevant) / k
+
+
+def average_precision(ranking, relevant):
+    hits, total = 0, 0.0
+    for rank, docid in enumerate(ranking, 1):
+        if docid in relevant:
+            hits += 1
+            total += hits / rank
+    return total / len(relevant) if relevant else 0.0
+
+
+def ndcg_at(ranking, relevant, k):
+    dcg = sum(1 / math.log2(rank + 1) for rank, docid in enumerate(ranking[:k], 1) if docid in relevant)
+    ideal = sum(1 / math.log2(rank + 1) for rank in range(1, min(k, len(relevant)) + 1))
+    return dcg / ideal if ideal else 0.0
+
+
+def run_queries(docs, index, queries, rankedmode=True, k=20, scorer=None):
+    """
+    Runs queries through 'search.search' without the result cache and measures their latency
+    :param docs: dictionary of documents
+    :param index: index built for the documents collection
+    :param queries: list of queries
+    :param rankedmode: ranked or boolean retrieval
+    :param k: number of top documents retrieved in ranked mode
+    :param scorer: scoring model of ranked retrieval
+    :return: list of rankings (lists of docids) and latency statistics
+    """
+    rankings, latencies = [], []
+    kwargs = {'scorer': scorer} if scorer is not None else {}
+    start = perf_counter()
+    for query in queries:
+        t = perf_counter()
+        result = search(docs, index, query, rankedmode=rankedmode, k=k if rankedmode else None,
+                        cache=None, **kwargs)
+        latencies.append(perf_counter() - t)
+        rankings.append([docid for docid, _ in result.get('results', [])])
+    elapsed = perf_counter() - start
+
+    latencies.sort()
+    stats = {
+        'queries': len(queries),
+        'latency_ms': {
+            'mean': 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+            'p50': 1000 * percentile(latencies, 50),
+            'p95': 1000 * percentile(latencies, 95),
+            'p99': 1000 * percentile(latencies, 99),
+            'max': 1000 * latencies[-1] if latencies else 0.0,
+        },
+        'throughput_qps': len(queries) / elapsed if elapsed else 0.0,
+    }
+    return rankings, stats
+
+
+def run_batch(docs, index, queries, rankedmode=True, k=20, scorer=None, workers=1):
+    """
+    Runs queries through 'batch.search_batch' and measures throughput
+    :param docs: dictionary of documents
+    :param index: index built for the documents collection
+    :param queries: list of queries
+    :param rankedmode: ranked or boolean retrieval
+    :param k: number of top documents retrieved in ranked mode
+    :param scorer: scoring model of ranked retrieval
+    :param workers: number of processes evaluating queries
+    :return: throughput statistics
+    """
+    kwargs = {'scorer': scorer} if scorer is not None else {}
+    start = perf_counter()
+    search_batch(docs, index, queries, k=k if rankedmode else None, mode='ranked' if rankedmode else 'boolean',
+                 workers=workers, **kwargs)
+    elapsed = perf_counter() - start
+    return {
+        'queries': len(queries),
+        'elapsed_s': elapsed,
+        'throughput_qps': len(queries) / elapsed if elapsed else 0.0,
+    }
+
+
+def quality(rankings, judgments):
+    """
+    Effectiveness of rankings against relevance judgments,
+    average precision is computed over the retrieved top k documents
+    :param rankings: list of rankings (lists of docids)
+    :param judgments: list of sets of relevant docids aligned with rankings
+    :return: dictionary of mean metrics
+    """
+    n = len(rankings)
+    if not n:
+        return {}
+    metrics = {}
+    for k in CUTOFFS:
+        metrics['P@%d' % k] = sum(precision_at(r, rel, k) for r, rel in zip(rankings, judgments)) / n
+    metrics['MAP'] = sum(average_precision(r, rel) for r, rel in zip(rankings, judgments)) / n
+    for k in CUTOFFS:
+        metrics['nDCG@%d' % k] = sum(ndcg_at(r, rel, k) for r, rel in zip(rankings, judgments)) / n
+    return metrics
+
+
+def peak_rss_mb():
+    # maximal resident set size is reported in kilobytes on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def benchmark(rebuild=False, positional=True, workers=1, generated=200, k=20, scorer='cosine', seed=0):
+    """
+    Runs the benchmark: index build, judged queries in ranked mode,
+    generated workloads in ranked and boolean modes
+    :param rebuild: building index from scratch to measure build time
+    :param positional: type of index
+    :param workers: number of processes building the index and evaluating batches of queries
+    :param generated: number of generated queries in each workload
+    :param k: number of top documents retrieved in ranked mode
+    :param scorer: name of the scoring model
+    :param seed: seed of generated workloads
+    :return: dictionary with results
+    """
+    # progress messages are kept out of the JSON report
+    with redirect_stdout(sys.stderr):
+        docs = read_data()
+        starttime = time()
+        index = build_index(docs, from_dump=not rebuild, positional=positional, workers=workers)
+        build_time = time() - starttime
+
+    report = {
+        'index': {
+            'rebuilt': rebuild,
+            'build_time_s': build_time,
+            'documents': index.ndocs,
+            'terms': len(index),
+            'size_bytes': {'dictionary': os.path.getsize(INDEX_DICT),
+                           'postings': os.path.getsize(INDEX_POSTINGS)},
+        },
+        'scorer': scorer,
+        'k': k,
+        'runs': {},
+    }
+    model = SCORERS[scorer]
+
+    # effectiveness and latency on judged queries
+    judged = judged_queries()
+    if judged:
+        rankings, stats = run_queries(docs, index, [q for q, _ in judged], k=k, scorer=model)
+        stats['quality'] = quality(rankings, [rel for _, rel in judged])
+        report['runs']['judged_ranked'] = stats
+
+    # latency on generated workloads
+    if generated:
+        for name, (lo, hi) in (('short', (1, 2)), ('long', (3, 8))):
+            queries = generate_queries(index, generated, lo, hi, seed)
+            _, report['runs']['%s_ranked' % name] = run_queries(docs, index, queries, k=k, scorer=model)
+            report['runs']['%s_ranked_batch' % name] = run_batch(docs, index, queries, k=k, scorer=model,
+                                                                 workers=workers)
+            boolean = [' AND '.join(q.split()) for q in queries]
+            _, report['runs']['%s_boolean' % name] = run_queries(docs, index, boolean, rankedmode=False)
+            report['runs']['%s_boolean_batch' % name] = run_batch(docs, index, boolean, rankedmode=False,
+                                                                  workers=workers)
+
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of retrieval quality and speed')
+    parser.add_argument('--rebuild', action='store_true', help='build index from scratch')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes building the index and evaluating batches')
+    parser.add_argument('--queries', type=int, default=200, help='number of queries in generated workloads')
+    parser.add_argument('--k', type=int, default=20, help='number of top documents in ranked mode')
+    parser.add_argument('--scorer', choices=sorted(SCORERS), default='cosine', help='scoring model')
+    parser.add_argument('--seed', type=int, default=0, help='seed of generated workloads')
+    parser.add_argument('--output', help='file to write JSON report to (stdout by default)')
+    args = parser.parse_args()
+
+    report = benchmark(rebuild=args.rebuild, workers=args.workers, generated=args.queries,
+                       k=args.k, scorer=args.scorer, seed=args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,84 @@
+import threading
+from collections import OrderedDict
+
+# maximal number of cached query results
+CACHE_SIZE = 1024
+
+
+class ResultCache:
+    """
+    Cache of query results with least recently used eviction. Results are bound to the index
+    they were computed on and dropped as soon as the index changes
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        # index and its generation for which results are cached
+        self.index = None
+        self.generation = None
+
+        self.lock = threading.Lock()
+
+    def _validate(self, index):
+        """
+        Drops cached results if they were computed on another index or before its update
+        :param index: index on which search is being applied
+        """
+        generation = getattr(index, 'generation', 0)
+        if self.index is not index or self.generation != generation:
+            self.entries.clear()
+            self.index = index
+            self.generation = generation
+
+    def get(self, index, key):
+        """
+        Looks up results of the query
+        :param index: index on which search is being applied
+        :param key: normalized query
+        :return: cached results or None
+        """
+        with self.lock:
+            self._validate(index)
+            results = self.entries.get(key)
+            if results is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return results
+
+    def put(self, index, key, results):
+        """
+        Stores results of the query evicting the least recently used ones
+        :param index: index on which search has been applied
+        :param key: normalized query
+        :param results: results of the query
+        """
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self._validate(index)
+            self.entries[key] = results
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Statistics of the cache usage
+        :return: dictionary with number of hits, misses, cached queries and hit ratio
+        """
+        with self.lock:
+            requests = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries),
+                    'hit_ratio': self.hits / requests if requests else 0.0}
@@ -0,0 +1,432 @@
+import sys
+import json
+import random
+import argparse
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from time import perf_counter
+
+# number of postings in a block of the bit-packing codec
+BLOCK_SIZE = 128
+
+
+def encode_varint(value, out):
+    """
+    Appends variable-byte encoding of the non-negative integer to the buffer
+    :param value: integer to be encoded
+    :param out: bytearray to which encoded bytes are appended
+    """
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varints(buf, pos, count):
+    """
+    Decodes a sequence of variable-byte encoded integers
+    :param buf: bytes-like object with encoded integers
+    :param pos: offset of the first encoded integer
+    :param count: number of integers to decode
+    :return: list of decoded integers and offset right after them
+    """
+    values = []
+    append = values.append
+    for _ in range(count):
+        byte = buf[pos]
+        pos += 1
+        value = byte & 0x7f
+        shift = 7
+        while byte & 0x80:
+            byte = buf[pos]
+            pos += 1
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        append(value)
+    return values, pos
+
+
+def intersect_sorted(docids, values):
+    """
+    Documents of the given ones present in the sorted values, each document is searched
+    by binary search from the position of the previous one
+    :param docids: sorted document ids
+    :param values: sorted document ids of a posting
+    :return: sorted array of document ids present in both
+    """
+    answer = array('I')
+    j, n = 0, len(values)
+    for docid in docids:
+        j = bisect_left(values, docid, j)
+        if j == n:
+            break
+        if values[j] == docid:
+            answer.append(docid)
+    return answer
+
+
+class Codec:
+    """
+    Interface of postings codecs: sorted document ids with term frequencies are encoded
+    into bytes, decoding is given the number of postings stored in the term dictionary
+    """
+    name = None
+    # identifier stored in the flags of index files
+    id = None
+    # postings can be searched without decoding them entirely
+    skips = False
+
+    def encode(self, docids, tfs):
+        """
+        Encodes posting
+        :param docids: sorted document ids
+        :param tfs: term frequencies of the documents
+        :return: encoded posting
+        """
+        raise NotImplementedError
+
+    def decode(self, buf, df):
+        """
+        Decodes posting
+        :param buf: encoded posting
+        :param df: number of documents in the posting
+        :return: arrays of document ids and term frequencies
+        """
+        raise NotImplementedError
+
+    def seek(self, buf, df, docid):
+        """
+        Finds the first document of the posting with id not less than given,
+        as done when postings are intersected
+        :param buf: encoded posting
+        :param df: number of documents in the posting
+        :param docid: document id to seek
+        :return: (docid, tf) of the found document or None if all documents are before docid
+        """
+        docids, tfs = self.decode(buf, df)
+        i = bisect_left(docids, docid)
+        return (docids[i], tfs[i]) if i < len(docids) else None
+
+    def intersect(self, buf, df, docids):
+        """
+        Documents of the given ones present in the posting
+        :param buf: encoded posting
+        :param df: number of documents in the posting
+        :param docids: sorted document ids
+        :return: sorted array of document ids present in the posting
+        """
+        return intersect_sorted(docids, self.decode(buf, df)[0])
+
+    def __repr__(self):
+        return '%s()' % type(self).__name__
+
+
+class VByteCodec(Codec):
+    """
+    Variable-byte codes of document id gaps followed by codes of term frequencies.
+    Each byte holds 7 bits of the value, the high bit marks continuation
+    """
+    name = 'vbyte'
+    id = 0
+
+    def encode(self, docids, tfs):
+        out = bytearray()
+        last = 0
+        for docid in docids:
+            encode_varint(docid - last, out)
+            last = docid
+        for tf in tfs:
+            encode_varint(tf, out)
+        return out
+
+    def decode(self, buf, df):
+        gaps, pos = decode_varints(buf, 0, df)
+        tfs, _ = decode_varints(buf, pos, df)
+        # restoring document ids from gaps
+        return array('I', accumulate(gaps)), array('I', tfs)
+
+
+def pack_bits(values, width, out):
+    """
+    Appends values packed into the given number of bits each, least significant bits first
+    :param values: list of integers less than 2 ** width
+    :param width: number of bits per value
+    :param out: bytearray to which packed bytes are appended
+    """
+    if width == 0:
+        return
+    packed = 0
+    for i, value in enumerate(values):
+        packed |= value << (i * width)
+    out += packed.to_bytes((len(values) * width + 7) // 8, 'little')
+
+
+def unpack_bits(buf, pos, count, width):
+    """
+    Unpacks values packed by 'pack_bits'
+    :param buf: bytes-like object with packed values
+    :param pos: offset of packed values
+    :param count: number of values
+    :param width: number of bits per value
+    :return: list of values and offset right after them
+    """
+    if width == 0:
+        return [0] * count, pos
+    size = (count * width + 7) // 8
+    if width == 8:
+        return list(buf[pos:pos + size]), pos + size
+    packed = int.from_bytes(buf[pos:pos + size], 'little')
+    mask = (1 << width) - 1
+    return [(packed >> shift) & mask for shift in range(0, count * width, width)], pos + size
+
+
+def varint_size(value):
+    return max(1, (value.bit_length() + 6) // 7)
+
+
+def encode_pfor(values, out):
+    """
+    Patched frame of reference: values are packed with the bit width minimizing the size of the block,
+    values not fitting into the width are exceptions whose high bits are stored separately as variable-byte codes.
+    Indices of exceptions and their number are stored in single bytes, so the block holds at most 256 values
+    :param values: list of at most 256 non-negative integers of any size
+    :param out: bytearray to which the encoded block is appended
+    """
+    lengths = sorted((value.bit_length() for value in values), reverse=True)
+    n = len(values)
+
+    # size of the block for each candidate width: packed low bits and exceptions
+    best, best_size = lengths[0] if lengths else 0, None
+    for width in range(best, -1, -1):
+        exceptions = [length for length in lengths if length > width]
+        if len(exceptions) > 255:
+            break
+        size = (n * width + 7) // 8 + sum(1 + varint_size((1 << (length - width)) - 1) for length in exceptions)
+        if best_size is None or size < best_size:
+            best, best_size = width, size
+
+    mask = (1 << best) - 1
+    exceptions = [(i, value >> best) for i, value in enumerate(values) if value >> best]
+    out.append(best)
+    out.append(len(exceptions))
+    pack_bits([value & mask for value in values], best, out)
+    for i, high in exceptions:
+        out.append(i)
+        encode_varint(high, out)
+
+
+def decode_pfor(buf, pos, count):
+    """
+    Decodes the block encoded by 'encode_pfor'
+    :param buf: bytes-like object with the block
+    :param pos: offset of the block
+    :param count: number of values in the block
+    :return: list of values and offset right after the block
+    """
+    width, nexceptions = buf[pos], buf[pos + 1]
+    values, pos = unpack_bits(buf, pos + 2, count, width)
+    for _ in range(nexceptions):
+        i = buf[pos]
+        (high,), pos = decode_varints(buf, pos + 1, 1)
+        values[i] |= high << width
+    return values, pos
+
+
+class BitPackCodec(Codec):
+    """
+    Blocks of BLOCK_SIZE postings, document id gaps and term frequencies minus one of each block
+    are bit-packed with the patched frame of reference (PFor). A skip table in front of the blocks
+    holds the last document id and the size of each block, so decoding can start from any block
+    """
+    name = 'bitpack'
+    id = 1
+    skips = True
+
+    def encode(self, docids, tfs):
+        skips, blocks = bytearray(), bytearray()
+        last = 0
+        for start in range(0, len(docids), BLOCK_SIZE):
+            block_docids = docids[start:start + BLOCK_SIZE]
+            gaps = [docid - prev for docid, prev in zip(block_docids, [last] + list(block_docids[:-1]))]
+            block = bytearray()
+            encode_pfor(gaps, block)
+            encode_pfor([tf - 1 for tf in tfs[start:start + BLOCK_SIZE]], block)
+
+            encode_varint(block_docids[-1] - last, skips)
+            encode_varint(len(block), skips)
+            blocks += block
+            last = block_docids[-1]
+        return skips + blocks
+
+    def skip_table(self, buf, df):
+        """
+        Reads the skip table of the posting
+        :param buf: encoded posting
+        :param df: number of documents in the posting
+        :return: last document ids of blocks, offsets of blocks
+        """
+        nblocks = (df + BLOCK_SIZE - 1) // BLOCK_SIZE
+        values, pos = decode_varints(buf, 0, 2 * nblocks)
+        lasts = list(accumulate(values[0::2]))
+        offsets = list(accumulate([pos] + values[1::2]))[:-1]
+        return lasts, offsets
+
+    def decode_block(self, buf, pos, count, base):
+        """
+        Decodes the block of postings
+        :param buf: encoded posting
+        :param pos: offset of the block
+        :param count: number of documents in the block
+        :param base: last document id of the previous block
+        :return: lists of document ids and term frequencies, offset right after the block
+        """
+        gaps, pos = decode_pfor(buf, pos, count)
+        tfs, pos = decode_pfor(buf, pos, count)
+        gaps[0] += base
+        return list(accumulate(gaps)), [tf + 1 for tf in tfs], pos
+
+    def decode(self, buf, df):
+        nblocks = (df + BLOCK_SIZE - 1) // BLOCK_SIZE
+        _, pos = decode_varints(buf, 0, 2 * nblocks)
+        docids, tfs = array('I'), array('I')
+        base = 0
+        for start in range(0, df, BLOCK_SIZE):
+            block_docids, block_tfs, pos = self.decode_block(buf, pos, min(BLOCK_SIZE, df - start), base)
+            docids.extend(block_docids)
+            tfs.extend(block_tfs)
+            base = block_docids[-1]
+        return docids, tfs
+
+    def seek(self, buf, df, docid):
+        # only the block that may contain the document is decoded
+        lasts, offsets = self.skip_table(buf, df)
+        block = bisect_left(lasts, docid)
+        if block == len(lasts):
+            return None
+        count = min(BLOCK_SIZE, df - block * BLOCK_SIZE)
+        docids, tfs, _ = self.decode_block(buf, offsets[block], count, lasts[block - 1] if block else 0)
+        i = bisect_left(docids, docid)
+        return docids[i], tfs[i]
+
+    def intersect(self, buf, df, docids):
+        # blocks without any of the documents are skipped, only document ids of the other blocks are decoded
+        lasts, offsets = self.skip_table(buf, df)
+        answer = array('I')
+        i, n, block = 0, len(docids), 0
+        while i < n:
+            block = bisect_left(lasts, docids[i], block)
+            if block == len(lasts):
+                break
+            gaps, _ = decode_pfor(buf, offsets[block], min(BLOCK_SIZE, df - block * BLOCK_SIZE))
+            gaps[0] += lasts[block - 1] if block else 0
+            # documents falling into the block
+            j = bisect_right(docids, lasts[block], i)
+            answer += intersect_sorted(docids[i:j], list(accumulate(gaps)))
+            i, block = j, block + 1
+        return answer
+
+
+VBYTE = VByteCodec()
+BITPACK = BitPackCodec()
+CODECS = {codec.name: codec for codec in (VBYTE, BITPACK)}
+CODEC_IDS = {codec.id: codec for codec in (VBYTE, BITPACK)}
+
+
+def index_postings(index):
+    """
+    All postings of the index
+    :param index: index built for the documents collection
+    :return: list of (docids, tfs)
+    """
+    postings = []
+    for term in index:
+        posting = index[term]
+        postings.append((posting.docids, posting.tfs))
+    return postings
+
+
+def synthetic_postings(ndocs, nterms, seed=0):
+    """
+    Postings of a synthetic collection: document frequencies follow Zipf's law,
+    documents of a term are chosen uniformly, term frequencies are geometric
+    :param ndocs: number of documents
+    :param nterms: number of terms
+    :param seed: seed of the random generator
+    :return: list of (docids, tfs)
+    """
+    rng = random.Random(seed)
+    postings = []
+    for rank in range(1, nterms + 1):
+        df = max(1, min(ndocs, int(ndocs / (2 * rank))))
+        docids = array('I', sorted(rng.sample(range(ndocs), df)))
+        tfs = array('I', (1 + int(rng.expovariate(1.0)) for _ in range(df)))
+        postings.append((docids, tfs))
+    return postings
+
+
+def benchmark_codecs(postings, codecs=None, seeks=1000, seed=0):
+    """
+    Measures size, encoding and decoding speed of codecs on the postings, and speed of seeking
+    a random document id of a posting, as done when postings are intersected
+    :param postings: list of (docids, tfs)
+    :param codecs: list of codecs (all codecs by default)
+    :param seeks: number of seeks
+    :param seed: seed of the random generator
+    :return: dictionary of codec name -> statistics
+    """
+    total = sum(len(docids) for docids, _ in postings)
+    rng = random.Random(seed)
+    probes = [rng.randrange(len(postings)) for _ in range(seeks)] if postings else []
+    probes = [(i, rng.choice(postings[i][0])) for i in probes]
+
+    report = {}
+    for codec in codecs or CODECS.values():
+        start = perf_counter()
+        encoded = [codec.encode(docids, tfs) for docids, tfs in postings]
+        encode_time = perf_counter() - start
+
+        start = perf_counter()
+        for buf, (docids, _) in zip(encoded, postings):
+            codec.decode(buf, len(docids))
+        decode_time = perf_counter() - start
+
+        # decoded postings are checked once to catch broken codecs
+        for buf, (docids, tfs) in zip(encoded, postings):
+            if codec.decode(buf, len(docids)) != (array('I', docids), array('I', tfs)):
+                raise ValueError("codec %s does not restore postings" % codec.name)
+
+        start = perf_counter()
+        for i, docid in probes:
+            codec.seek(encoded[i], len(postings[i][0]), docid)
+        seek_time = perf_counter() - start
+
+        size = sum(len(buf) for buf in encoded)
+        report[codec.name] = {
+            'bytes': size,
+            'bytes_per_posting': size / total if total else 0.0,
+            'encode_postings_per_s': total / encode_time if encode_time else 0.0,
+            'decode_postings_per_s': total / decode_time if decode_time else 0.0,
+            'seeks_per_s': len(probes) / seek_time if seek_time else 0.0,
+        }
+    return {'postings': len(postings), 'entries': total, 'codecs': report}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of postings codecs')
+    parser.add_argument('--docs', type=int, default=1000000, help='number of documents of the synthetic index')
+    parser.add_argument('--terms', type=int, default=2000, help='number of terms of the synthetic index')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic index')
+    args = parser.parse_args()
+
+    from storage import DiskIndex
+    report = {}
+    try:
+        index = DiskIndex()
+        report['lisa'] = benchmark_codecs(index_postings(index))
+        index.close()
+    except (FileNotFoundError, ValueError) as e:
+        print("index files are not available: %s" % e, file=sys.stderr)
+    if args.docs and args.terms:
+        report['synthetic'] = benchmark_codecs(synthetic_postings(args.docs, args.terms, args.seed))
+    print(json.dumps(report, indent=2))
@@ -1,97 +1,50 @@
 import re
-import math
-import nltk
-import json
-from preprocess import text2tokens
-from time import time
 
 DATA_FILES = ["../dataset/LISA{}.{}01".format(*[i, j]) for i in range(6) for j in [0, 5]] \
              + ["../dataset/LISA5.627", "../dataset/LISA5.850"]
 
+# lines starting a document, separating its title and ending it
+DOCUMENT_LINE = re.compile(r'Document[ ]+(\d+)')
+BLANK_LINE = re.compile(r'[ ]*[\n]')
+END_LINE = re.compile(r'[*]{3,}')
 
-def read_data():
+
+def iter_documents(files=DATA_FILES):
     """
-    Opens all files with documents and processes content in them
-    :return: dictionary of all read documents
+    Reads documents from the files in LISA format one at a time
+    :param files: list of paths of the files with documents
+    :return: generator of (docid, document) pairs
     """
-
-    docs = {}
-    nltk.data.path.append("../nltk_data")
-    try:
-        for file in DATA_FILES:
-            with open(file, "r") as f:
-                doc, content, docid = {}, '', 0
-                for line in f:
-                    if re.match(r'Document[ ]+\d+', line):
-                        docid = re.search(r'\d+', line).group(0)
-                    elif re.match(r'[ ]*[\n]', line):
-                        doc['title'] = content
-                        content = ''
-                    elif re.match(r'[*]{3,}', line):
-                        doc['content'] = content
-                        content = ''
-                        docs[docid] = doc
-                        doc = {}
-                    else:
-                        content += line
-    except FileNotFoundError:
-        print("ERROR: Document collection is not found. Make sure that it's located in the directory 'dataset'")
-
-    docs = load_stats(docs)
-
-    return docs
+    for file in files:
+        with open(file, "r") as f:
+            doc, lines, docid = {}, [], 0
+            for line in f:
+                match = DOCUMENT_LINE.match(line)
+                if match:
+                    docid = match.group(1)
+                elif BLANK_LINE.match(line):
+                    doc['title'] = ''.join(lines)
+                    lines = []
+                elif END_LINE.match(line):
+                    doc['content'] = ''.join(lines)
+                    lines = []
+                    yield docid, doc
+                    doc = {}
+                else:
+                    lines.append(line)
 
 
-def load_stats(docs, from_dump=True):
+def read_data():
     """
     Opens all files with documents and processes content in them
     :return: dictionary of all read documents
     """
 
-    # checking existence of 'datastats' file
+    docs = {}
     try:
-        open('../results/datastats', 'r')
+        for docid, doc in iter_documents():
+            docs[docid] = doc
     except FileNotFoundError:
-        print("'datastats' file is not found")
-        from_dump = False
-
-    stats = {}
-
-    if from_dump:
-        with open('../results/datastats', 'r') as datastats:
-            stats = json.loads(datastats.read())
-    else:
-        # loading data stats
-        print('collecting data stats...')
-        starttime = time()
-        for docid in docs:
-            doc = docs[docid]
-            length = 0.0
-
-            tokens = text2tokens(doc['title'] + " " + doc['content'], stem=False)
-            tokens.sort()
-
-            lasttoken = ''
-            tf = 1
-            for token in tokens:
-                if token != lasttoken:
-                    if lasttoken != '':
-                        length += 1.0 + math.log10(tf)
-                    tf = 1
-                    lasttoken = token
-                else:
-                    tf += 1
-
-            length = math.sqrt(length)
-            stats[docid] = length
-
-        # dumping index
-        with open('../results/datastats', 'w+') as datastats:
-            datastats.write(json.dumps(stats))
-
-        print('stats are successfully computed in %.3f ms' % (time() - starttime))
-
-    for docid in docs:
-        docs[docid]['length'] = stats[docid]
+        print("ERROR: Document collection is not found. Make sure that it's located in the directory 'dataset'")
 
     return docs
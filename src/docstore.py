@@ -0,0 +1,225 @@
+import os
+import mmap
+import zlib
+import struct
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from collections.abc import Mapping
+from datareader import iter_documents
+
+DOCSTORE = '../results/docstore'
+
+# binary format of the document store: magic bytes and current version of the layout
+MAGIC = b'SEDS'
+VERSION = 1
+
+# header: magic, version, flags, number of documents, offset of the table of documents
+HEADER = struct.Struct('<4sHHIQ')
+# record of a document: length of the title in bytes followed by the title and the content
+TITLE_LENGTH = struct.Struct('<I')
+
+# records are compressed with zlib
+FLAG_COMPRESSED = 1
+
+# number of recently viewed documents kept decoded
+DOC_CACHE_SIZE = 256
+
+
+class DocStoreWriter:
+    """
+    Writes documents one at a time into the packed document store. Records follow each other
+    in the order of writing, the table of document ids with offsets of their records is written
+    at the end of the file. The file replaces the previous store only when it is complete
+    """
+
+    def __init__(self, path=DOCSTORE, compress=False):
+        self.path = path
+        self.compress = compress
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.file = open(path + '.tmp', 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+        self.records = {}
+
+    def add(self, docid, doc):
+        """
+        Appends the document, repeated document ids are skipped
+        :param docid: id of the document
+        :param doc: dictionary with title and content of the document
+        """
+        docid = int(docid)
+        if docid in self.records:
+            return
+        title = doc.get('title', '').encode('utf-8')
+        record = TITLE_LENGTH.pack(len(title)) + title + doc.get('content', '').encode('utf-8')
+        if self.compress:
+            record = zlib.compress(record)
+        self.records[docid] = (self.file.tell(), len(record))
+        self.file.write(record)
+
+    def close(self):
+        # table of documents sorted by id: ids, offsets and sizes of records
+        docids = array('I', sorted(self.records))
+        offsets = array('Q', (self.records[docid][0] for docid in docids))
+        sizes = array('I', (self.records[docid][1] for docid in docids))
+
+        table = self.file.tell()
+        self.file.write(docids.tobytes())
+        self.file.write(offsets.tobytes())
+        self.file.write(sizes.tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, FLAG_COMPRESSED if self.compress else 0, len(docids), table))
+        self.file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.path + '.tmp')
+
+
+def write_docstore(docs, path=DOCSTORE, compress=False):
+    """
+    Writes documents into the document store
+    :param docs: dictionary of documents or iterable of (docid, document) pairs
+    :param path: path of the file
+    :param compress: compressing records with zlib
+    """
+    if isinstance(docs, Mapping):
+        docs = docs.items()
+    writer = DocStoreWriter(path, compress)
+    try:
+        for docid, doc in docs:
+            writer.add(docid, doc)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+
+class DocStore(Mapping):
+    """
+    Read-only dictionary of documents stored in the packed file. Only the table of document ids
+    and offsets is held in memory, records are read through 'mmap' and decoded on access,
+    recently viewed documents are cached
+    """
+
+    def __init__(self, path=DOCSTORE, cache_size=DOC_CACHE_SIZE):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file can't be mapped
+            self.file.close()
+            raise ValueError("'%s' is not a document store" % path)
+
+        if len(self.data) < HEADER.size:
+            self.close()
+            raise ValueError("'%s' is not a document store" % path)
+        magic, version, flags, ndocs, table = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("'%s' is not a document store" % path)
+        if version != VERSION:
+            self.close()
+            raise ValueError("'%s' has document store version %d, expected %d" % (path, version, VERSION))
+        self.compressed = bool(flags & FLAG_COMPRESSED)
+
+        self.docids = array('I')
+        self.docids.frombytes(self.data[table:table + 4 * ndocs])
+        self.offsets = array('Q')
+        self.offsets.frombytes(self.data[table + 4 * ndocs:table + 12 * ndocs])
+        self.sizes = array('I')
+        self.sizes.frombytes(self.data[table + 12 * ndocs:table + 16 * ndocs])
+
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _position(self, docid):
+        """
+        Position of the document in the table
+        :param docid: id of the document as a string or an integer
+        :return: position or -1 if the document is absent
+        """
+        try:
+            docid = int(docid)
+        except (TypeError, ValueError):
+            return -1
+        i = bisect_left(self.docids, docid)
+        if i < len(self.docids) and self.docids[i] == docid:
+            return i
+        return -1
+
+    def _read(self, i):
+        """
+        Reads and decodes the record
+        :param i: position of the document in the table
+        :return: dictionary with title and content of the document
+        """
+        offset = self.offsets[i]
+        record = self.data[offset:offset + self.sizes[i]]
+        if self.compressed:
+            record = zlib.decompress(record)
+        length, = TITLE_LENGTH.unpack_from(record, 0)
+        start = TITLE_LENGTH.size
+        return {'title': record[start:start + length].decode('utf-8'),
+                'content': record[start + length:].decode('utf-8')}
+
+    def __getitem__(self, docid):
+        key = str(docid)
+        with self.lock:
+            doc = self.cache.get(key)
+            if doc is not None:
+                self.cache.move_to_end(key)
+                return doc
+
+        i = self._position(docid)
+        if i < 0:
+            raise KeyError(docid)
+        doc = self._read(i)
+
+        if self.cache_size > 0:
+            with self.lock:
+                self.cache[key] = doc
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return doc
+
+    def __contains__(self, docid):
+        return self._position(docid) >= 0
+
+    def __iter__(self):
+        return (str(docid) for docid in self.docids)
+
+    def __len__(self):
+        return len(self.docids)
+
+    def items(self):
+        # iteration over all documents bypasses the cache of viewed documents
+        return ((str(docid), self._read(i)) for i, docid in enumerate(self.docids))
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def load_documents(path=DOCSTORE, compress=False):
+    """
+    Opens the document store. The store is usually written along with the index,
+    if it is missing or outdated it is built by streaming the dataset files
+    :param path: path of the document store
+    :param compress: compressing records with zlib when the store is built
+    :return: instance of 'DocStore'
+    """
+    try:
+        return DocStore(path)
+    except FileNotFoundError:
+        print("document store is not found")
+    except ValueError as e:
+        print("document store is outdated: %s" % e)
+
+    print('building a document store...')
+    write_docstore(iter_documents(), path, compress)
+    return DocStore(path)
@@ -0,0 +1,435 @@
+import os
+import math
+import threading
+from array import array
+from bisect import bisect_left
+from datareader import iter_documents
+from indexer import document_terms, document_stats
+from storage import DiskIndex, Posting, write_index, quantize_impact
+
+
+class MemorySegment:
+    """
+    Small in-memory segment of the index holding recently added documents
+    """
+
+    def __init__(self, positional=False):
+        self.positional = positional
+        # term -> {docid: term frequency (or positions)}
+        self.postings = {}
+        # docid -> terms of the document
+        self.documents = {}
+
+    def add(self, docid, terms):
+        """
+        Adds document to the segment
+        :param docid: id of the document
+        :param terms: dictionary of document terms with their frequencies (or positions)
+        """
+        for term, value in terms.items():
+            if term not in self.postings:
+                self.postings[term] = {docid: value}
+            else:
+                self.postings[term][docid] = value
+        self.documents[docid] = list(terms)
+
+    def remove(self, docid):
+        """
+        Removes document from the segment
+        :param docid: id of the document
+        """
+        for term in self.documents.pop(docid):
+            posting = self.postings[term]
+            del posting[docid]
+            if not posting:
+                del self.postings[term]
+
+    def posting(self, term, excluded=()):
+        """
+        Posting of the term in the segment
+        :param term: term of the index
+        :param excluded: ids of deleted documents
+        :return: sorted docids, aligned term frequencies and positions (None for non-positional segment)
+        """
+        posting = self.postings.get(term, {})
+        docids = sorted(docid for docid in posting if docid not in excluded)
+        if self.positional:
+            positions = [posting[docid] for docid in docids]
+            return docids, [len(p) for p in positions], positions
+        return docids, [posting[docid] for docid in docids], None
+
+
+class IncrementalIndex:
+    """
+    Index supporting updates without a full rebuild. Documents are added to an in-memory
+    delta segment searched together with the main on-disk index. Deleted and re-indexed
+    documents of older segments are hidden by tombstones. Merging rewrites the main index
+    from its live documents and the delta segment, on demand or in a background thread.
+    Provides the same interface as 'DiskIndex'
+    """
+
+    def __init__(self, main, dictpath=None, postpath=None):
+        self.main = main
+        # merges rewrite the files of the main index unless other paths are given
+        self.dictpath = dictpath if dictpath is not None else main.dictpath
+        self.postpath = postpath if postpath is not None else main.postpath
+        self.positional = main.positional
+        self.impact_ordered = main.impact_ordered
+        self.impact_scale = main.impact_scale
+
+        # segment being merged into the main index and segment receiving new documents
+        self.frozen = None
+        self.active = MemorySegment(self.positional)
+
+        # ids of deleted documents of the main and frozen segments
+        self.main_tombstones = set()
+        self.frozen_tombstones = set()
+
+        # collection statistics kept consistent with all segments
+        self.ndocs = main.ndocs
+        self.total_tokens = main.total_tokens
+        self.lengths = array('d', main.lengths)
+        self.ntokens = array('I', main.ntokens)
+
+        # number of changes applied to the index
+        self.generation = 0
+        self.term_stats = {}
+        self.live_docids = None
+
+        self.lock = threading.RLock()
+        self.merge_lock = threading.Lock()
+
+    def add_documents(self, docs):
+        """
+        Adds documents to the index. Documents with ids already present in the index are re-indexed
+        :param docs: dictionary of documents or iterable of (docid, document) pairs
+        :return: number of added documents
+        """
+        if isinstance(docs, dict):
+            docs = docs.items()
+
+        added = 0
+        with self.lock:
+            for docid, doc in docs:
+                docid = int(docid)
+                self._delete(docid)
+
+                text = doc.get('title', '') + " " + doc.get('content', '')
+                terms, ntokens = document_terms(text, self.positional)
+                _, length, _ = document_stats(docid, terms, ntokens, self.positional)
+                self.active.add(docid, terms)
+
+                if docid >= len(self.lengths):
+                    self.lengths.extend([0.0] * (docid + 1 - len(self.lengths)))
+                    self.ntokens.extend([0] * (docid + 1 - len(self.ntokens)))
+                self.lengths[docid] = length
+                self.ntokens[docid] = ntokens
+                self.ndocs += 1
+                self.total_tokens += ntokens
+                added += 1
+
+            self._changed()
+        return added
+
+    def add_file(self, path):
+        """
+        Adds documents from the file in LISA format
+        :param path: path of the file
+        :return: number of added documents
+        """
+        return self.add_documents(iter_documents([path]))
+
+    def reindex_document(self, docid, doc):
+        """
+        Replaces indexed version of the document
+        :param docid: id of the document
+        :param doc: new version of the document
+        """
+        self.add_documents([(docid, doc)])
+
+    def delete_documents(self, docids):
+        """
+        Deletes documents from the index
+        :param docids: ids of the documents
+        :return: number of deleted documents
+        """
+        with self.lock:
+            deleted = 0
+            for docid in docids:
+                deleted += self._delete(int(docid))
+            self._changed()
+        return deleted
+
+    def _delete(self, docid):
+        """
+        Deletes document from the segment holding its live version
+        :param docid: id of the document
+        :return: whether the document was found
+        """
+        if docid in self.active.documents:
+            self.active.remove(docid)
+        elif self.frozen is not None and docid in self.frozen.documents \
+                and docid not in self.frozen_tombstones:
+            self.frozen_tombstones.add(docid)
+        elif self._in_main(docid) and docid not in self.main_tombstones:
+            self.main_tombstones.add(docid)
+        else:
+            return False
+
+        self.ndocs -= 1
+        self.total_tokens -= self.ntokens[docid]
+        return True
+
+    def _in_main(self, docid):
+        docids = self.main.docids
+        i = bisect_left(docids, docid)
+        return i < len(docids) and docids[i] == docid
+
+    def _changed(self):
+        self.generation += 1
+        self.term_stats = {}
+        self.live_docids = None
+
+    def _posting(self, term, positions=False):
+        """
+        Collects live posting of the term from all segments
+        :param term: term of the index
+        :param positions: whether positions are collected
+        :return: sorted docids, aligned term frequencies and positions
+        """
+        with self.lock:
+            parts = []
+            if term in self.main:
+                posting = self.main[term]
+                docids, tfs = list(posting.docids), list(posting.tfs)
+                pos = self.main.positions(term) if positions else None
+                if self.main_tombstones:
+                    keep = [i for i, docid in enumerate(docids) if docid not in self.main_tombstones]
+                    docids, tfs = [docids[i] for i in keep], [tfs[i] for i in keep]
+                    pos = [pos[i] for i in keep] if positions else None
+                parts.append((docids, tfs, pos))
+            if self.frozen is not None and term in self.frozen.postings:
+                parts.append(self.frozen.posting(term, self.frozen_tombstones))
+            if term in self.active.postings:
+                parts.append(self.active.posting(term))
+
+        if len(parts) == 1:
+            return parts[0]
+
+        # segments hold disjoint documents, so their postings are only reordered
+        docids, tfs, pos = [], [], []
+        for part in parts:
+            docids += part[0]
+            tfs += part[1]
+            pos += part[2] or []
+        order = sorted(range(len(docids)), key=docids.__getitem__)
+        return [docids[i] for i in order], [tfs[i] for i in order], \
+            [pos[i] for i in order] if positions else None
+
+    def _stats(self, term):
+        """
+        Document frequency and upper bounds of the term statistics over all segments
+        :param term: term of the index
+        :return: tuple of df, max score, max tf and min number of tokens of documents
+        """
+        stats = self.term_stats.get(term)
+        if stats is None:
+            with self.lock:
+                df, max_score, max_tf, min_dl = 0, 0.0, 0, 2 ** 32 - 1
+                if term in self.main:
+                    # bounds of the main segment stay valid after deletions
+                    max_score = self.main.max_score(term)
+                    max_tf = self.main.max_tf(term)
+                    min_dl = self.main.min_dl(term)
+                    if self.main_tombstones:
+                        df += sum(1 for docid in self.main[term] if docid not in self.main_tombstones)
+                    else:
+                        df += self.main.df(term)
+                for segment, excluded in ((self.frozen, self.frozen_tombstones), (self.active, ())):
+                    if segment is not None and term in segment.postings:
+                        docids, tfs, _ = segment.posting(term, excluded)
+                        df += len(docids)
+                        for docid, tf in zip(docids, tfs):
+                            max_score = max(max_score, (1 + math.log10(tf)) / self.lengths[docid])
+                            max_tf = max(max_tf, tf)
+                            min_dl = min(min_dl, self.ntokens[docid])
+                stats = self.term_stats[term] = (df, max_score, max_tf, min_dl)
+        return stats
+
+    def __contains__(self, term):
+        return self._stats(term)[0] > 0
+
+    def __iter__(self):
+        with self.lock:
+            terms = set(self.main) | set(self.active.postings)
+            if self.frozen is not None:
+                terms |= set(self.frozen.postings)
+        return iter(sorted(terms))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __getitem__(self, term):
+        docids, tfs, _ = self._posting(term)
+        return Posting(array('I', docids), array('I', tfs))
+
+    def df(self, term):
+        """
+        Document frequency of the term
+        :param term: term of the index
+        :return: number of live documents containing the term
+        """
+        return self._stats(term)[0]
+
+    def max_score(self, term):
+        """
+        Upper bound of the term weight in documents: maximum of log tf divided by document length
+        :param term: term of the index
+        :return: maximal normalized weight of the term over its posting
+        """
+        return self._stats(term)[1]
+
+    def max_tf(self, term):
+        """
+        Maximal frequency of the term in documents
+        :param term: term of the index
+        :return: upper bound of the term frequency over live documents
+        """
+        return self._stats(term)[2]
+
+    def min_dl(self, term):
+        """
+        Minimal length of documents containing the term
+        :param term: term of the index
+        :return: lower bound of the number of tokens of live documents containing the term
+        """
+        return self._stats(term)[3]
+
+    def idf(self, term):
+        """
+        Inverse document frequency of the term: natural logarithm of N / df
+        :param term: term of the index
+        :return: idf of the term over live documents
+        """
+        return math.log(self.ndocs / self._stats(term)[0])
+
+    def impacts(self, term):
+        """
+        Impact-ordered posting of the term, quantized with the scale of the main index
+        :param term: term of the index
+        :return: list of (impact, sorted document ids) in the order of decreasing impact
+        """
+        docids, tfs, _ = self._posting(term)
+        groups = {}
+        for docid, tf in zip(docids, tfs):
+            impact = quantize_impact((1 + math.log10(tf)) / self.lengths[docid], self.impact_scale)
+            if impact not in groups:
+                groups[impact] = [docid]
+            else:
+                groups[impact].append(docid)
+        return [(impact, groups[impact]) for impact in sorted(groups, reverse=True)]
+
+    def positions(self, term):
+        """
+        Positions of the term in each document of its posting
+        :param term: term of the index
+        :return: list of sorted position lists aligned with the posting
+        """
+        if not self.positional:
+            raise ValueError("index is built without positions")
+        return self._posting(term, positions=True)[2]
+
+    @property
+    def docids(self):
+        """
+        Sorted ids of all live documents
+        """
+        docids = self.live_docids
+        if docids is None:
+            with self.lock:
+                live = [docid for docid in self.main.docids if docid not in self.main_tombstones]
+                if self.frozen is not None:
+                    live += [docid for docid in self.frozen.documents if docid not in self.frozen_tombstones]
+                live += list(self.active.documents)
+                docids = self.live_docids = array('I', sorted(live))
+        return docids
+
+    def merge(self, background=False):
+        """
+        Merges delta segment and deletions into the main index files
+        :param background: run merge in a background thread
+        :return: thread running the merge if it's in background
+        """
+        if background:
+            thread = threading.Thread(target=self.merge, daemon=True)
+            thread.start()
+            return thread
+
+        with self.merge_lock:
+            # freezing current delta segment, new documents go to a fresh one
+            with self.lock:
+                if not self.active.documents and not self.main_tombstones:
+                    return
+                self.frozen = self.active
+                self.active = MemorySegment(self.positional)
+                main, frozen = self.main, self.frozen
+                main_tombstones = set(self.main_tombstones)
+
+                # live documents of the main and frozen segments written to the new main index,
+                # deletions made during the merge are kept as tombstones of the new main index.
+                # Statistics are copied under the lock, re-indexing during the merge changes them
+                live = [docid for docid in main.docids if docid not in main_tombstones]
+                live += list(frozen.documents)
+                doc_stats = [(docid, self.lengths[docid], self.ntokens[docid]) for docid in sorted(live)]
+
+            lengths = {docid: length for docid, length, _ in doc_stats}
+            write_index(self._merged_postings(main, main_tombstones, frozen, lengths),
+                        doc_stats, positional=self.positional, impacts=self.impact_ordered,
+                        dictpath=self.dictpath + '.merge', postpath=self.postpath + '.merge',
+                        codec=main.codec.name)
+            os.replace(self.postpath + '.merge', self.postpath)
+            os.replace(self.dictpath + '.merge', self.dictpath)
+
+            with self.lock:
+                self.main = DiskIndex(self.dictpath, self.postpath)
+                self.impact_scale = self.main.impact_scale
+                self.frozen = None
+                self.main_tombstones = (self.main_tombstones - main_tombstones) | self.frozen_tombstones
+                self.frozen_tombstones = set()
+                self.term_stats = {}
+            main.close()
+
+    def _merged_postings(self, main, main_tombstones, frozen, lengths):
+        """
+        Stream of postings of the main and frozen segments accepted by 'write_index'
+        :param main: main segment
+        :param main_tombstones: ids of deleted documents of the main segment
+        :param frozen: frozen delta segment
+        :param lengths: lengths of the merged documents
+        :return: generator of (term, docids, tfs, positions, max_score) tuples
+        """
+        for term in sorted(set(main) | set(frozen.postings)):
+            docids, tfs, positions = [], [], []
+            if term in main:
+                posting = main[term]
+                pos = main.positions(term) if self.positional else None
+                for i, docid in enumerate(posting.docids):
+                    if docid not in main_tombstones:
+                        docids.append(docid)
+                        tfs.append(posting.tfs[i])
+                        if pos is not None:
+                            positions.append(pos[i])
+            if term in frozen.postings:
+                fdocids, ftfs, fpos = frozen.posting(term)
+                docids += fdocids
+                tfs += ftfs
+                positions += fpos or []
+
+            if not docids:
+                continue
+            order = sorted(range(len(docids)), key=docids.__getitem__)
+            docids = [docids[i] for i in order]
+            tfs = [tfs[i] for i in order]
+            positions = [positions[i] for i in order] if self.positional else None
+            max_score = max((1 + math.log10(tf)) / lengths[docid] for docid, tf in zip(docids, tfs))
+            yield term, docids, tfs, positions, max_score
@@ -1,15 +1,44 @@
+import os
 import nltk
-import json
+import math
+import heapq
+import pickle
+import tempfile
 from time import time
+from collections import deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 from preprocess import text2tokens
+from storage import DiskIndex, write_index, INDEX_DICT, INDEX_POSTINGS
+from docstore import DocStore, DocStoreWriter
 
+# directory where temporary runs of postings are flushed during index build
+RUNS_DIR = '../results'
+# default memory budget of in-memory runs in megabytes
+MEMORY_LIMIT = 256
+# estimated ratio of memory taken by an in-memory run to the length of the inverted text
+TEXT_EXPANSION = 16
 
-def build_index(docs, from_dump=False, positional=False):
+
+def build_index(docs, from_dump=False, positional=False, impacts=False, workers=1, memory_limit=MEMORY_LIMIT,
+                docstore=True, compress_docs=False, dictpath=INDEX_DICT, postpath=INDEX_POSTINGS, codec='vbyte'):
     """
-    Build inverted index from given documents
-    :param docs: dictionary of documents
-    :param from_dump: reading index from 'indexfile' or building from scratch
+    Build inverted index from given documents. Each document is tokenized once,
+    its tokens produce both postings and statistics of the document.
+    Documents are consumed as a stream: batches of them are inverted into sorted runs
+    flushed to disk, which are merged into the index at the end
+    :param docs: dictionary of documents or iterable of (docid, document) pairs
+    :param from_dump: reading index from index files or building from scratch
     :param positional: type of index
+    :param impacts: storing impact-ordered postings in addition to docid-ordered ones
+    :param workers: number of processes tokenizing documents in parallel
+    :param memory_limit: approximate memory budget of in-memory runs in megabytes
+    :param docstore: writing read documents into the document store along with the index
+    :param compress_docs: compressing documents in the document store
+    :param dictpath: path of the term dictionary file
+    :param postpath: path of the postings file
+    :param codec: name of the postings codec of a built index: 'vbyte' or 'bitpack',
+    an index read from files keeps its codec
     :return: built index
     """
 
@@ -17,67 +46,250 @@ def build_index(docs, from_dump=False, positional=False):
     nltk.data.path.append("../nltk_data")
     index = {}
 
-    # checking existence of 'indexfile'
-    try:
-        open('../results/indexfile', 'r')
-    except FileNotFoundError:
-        print("'indexfile' file is not found")
-        from_dump = False
-
     if from_dump:
-        with open('../results/indexfile', 'r') as indexfile:
-            index = json.loads(indexfile.read())
-    else:
+        try:
+            index = DiskIndex(dictpath, postpath)
+            if positional and not index.positional:
+                print("index files don't store positions")
+                index.close()
+                from_dump = False
+            elif impacts and not index.impact_ordered:
+                print("index files don't store impacts")
+                index.close()
+                from_dump = False
+        except FileNotFoundError:
+            print("index files are not found")
+            from_dump = False
+        except ValueError as e:
+            print("index files are outdated: %s" % e)
+            from_dump = False
+
+    if not from_dump:
         # building an index
         print('building an index...')
         starttime = time()
-        token_stats = []
-        for docid in docs:
-            doc = docs[docid]
-            text = doc['title'] + " " + doc['content']
-            tokens = text2tokens(text, stem=False)
-
-            if positional:
-                for pos in range(len(tokens)):
-                    token = tokens[pos]
-                    if token not in index:
-                        index[token] = {docid: [pos]}
-                    elif docid not in index[token]:
-                        index[token][docid] = [pos]
-                    else:
-                        index[token][docid].append(pos)
+        # documents read from the document store are not written back
+        writer = None
+        if docstore and not isinstance(docs, DocStore):
+            writer = DocStoreWriter(compress=compress_docs)
+        if isinstance(docs, Mapping):
+            docs = docs.items()
+
+        # each batch of documents is inverted into a sorted run
+        batch_size = memory_limit * 2 ** 20 // (TEXT_EXPANSION * workers)
+        batches = text_batches(docs, batch_size, writer)
+
+        os.makedirs(RUNS_DIR, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=RUNS_DIR) as rundir:
+            runs, doc_stats = [], []
+            if workers > 1:
+                with ProcessPoolExecutor(workers) as executor:
+                    pending = deque()
+                    for texts in batches:
+                        runs.append(os.path.join(rundir, 'run%d' % len(runs)))
+                        pending.append(executor.submit(index_documents, texts, runs[-1], positional))
+                        # limiting number of batches held in memory
+                        if len(pending) >= 2 * workers:
+                            doc_stats += pending.popleft().result()
+                    while pending:
+                        doc_stats += pending.popleft().result()
             else:
-                for token in tokens:
-                    token_stats.append((token, docid))
+                for texts in batches:
+                    runs.append(os.path.join(rundir, 'run%d' % len(runs)))
+                    doc_stats += index_documents(texts, runs[-1], positional)
 
-        if positional:
-            sorted_index = {}
-            for k, v in sorted(index.items()):
-                sorted_index[k] = v
+            doc_stats.sort()
+            lengths = {docid: length for docid, length, _ in doc_stats}
 
-            index = sorted_index
-        else:
-            token_stats.sort(key=lambda term: term[0])
-
-            lasttoken = ''
-            lastid = 0
-            for token in token_stats:
-                if token[0] != lasttoken:
-                    if lasttoken != '':
-                        index[lasttoken] = posting
-                    posting = {token[1]: 1}
-                    lasttoken = token[0]
-                    lastid = token[1]
-                elif token[1] != lastid:
-                    posting[token[1]] = 1
-                    lastid = token[1]
-                else:
-                    posting[token[1]] += 1
-
-        # dumping index
-        with open('../results/indexfile', 'w+') as indexfile:
-            indexfile.write(json.dumps(index))
-
-        print('index is successfully built in %.3f ms' % (time() - starttime))
+            # dumping index
+            postings = postings_stream(merge_runs([read_run(run) for run in runs]), lengths, positional)
+            write_index(postings, doc_stats, positional=positional, impacts=impacts,
+                        dictpath=dictpath, postpath=postpath, codec=codec)
+
+        if writer is not None:
+            writer.close()
+        print('index is successfully built in %.3f s' % (time() - starttime))
+        index = DiskIndex(dictpath, postpath)
 
     return index
+
+
+def text_batches(docs, batch_size, writer=None):
+    """
+    Groups stream of documents into batches of texts of limited total size.
+    Repeated document ids are skipped, the first read document is indexed
+    :param docs: iterable of (docid, document) pairs
+    :param batch_size: maximal total length of texts in a batch
+    :param writer: document store into which read documents are written
+    :return: generator of lists of (docid, text)
+    """
+    texts, size = [], 0
+    seen, skipped = set(), 0
+    for docid, doc in docs:
+        docid = int(docid)
+        if docid in seen:
+            skipped += 1
+            continue
+        seen.add(docid)
+        if writer is not None:
+            writer.add(docid, doc)
+
+        text = doc.get('title', '') + " " + doc.get('content', '')
+        texts.append((docid, text))
+        size += len(text)
+        if size >= batch_size:
+            yield texts
+            texts, size = [], 0
+    if texts:
+        yield texts
+
+    if skipped:
+        print('%d documents with repeated ids are skipped' % skipped)
+
+
+def index_documents(texts, runpath, positional=False):
+    """
+    Builds a run of postings sorted by term for the batch of documents and writes it to disk
+    :param texts: list of (docid, text)
+    :param runpath: path of the file for the run
+    :param positional: type of index
+    :return: statistics of the documents
+    """
+
+    # adding path of preloaded nltk data for worker processes
+    if "../nltk_data" not in nltk.data.path:
+        nltk.data.path.append("../nltk_data")
+
+    index = {}
+    doc_stats = []
+    for docid, text in texts:
+        terms, ntokens = document_terms(text, positional)
+
+        for token, value in terms.items():
+            if token not in index:
+                index[token] = ([docid], [value])
+            else:
+                index[token][0].append(docid)
+                index[token][1].append(value)
+
+        doc_stats.append(document_stats(docid, terms, ntokens, positional))
+
+    with open(runpath, 'wb') as run:
+        for term in sorted(index):
+            pickle.dump((term, ) + index[term], run, pickle.HIGHEST_PROTOCOL)
+
+    return doc_stats
+
+
+def document_terms(text, positional=False):
+    """
+    Tokenizes text of the document and groups its tokens by term
+    :param text: text of the document
+    :param positional: type of index
+    :return: dictionary of terms with their frequencies (or positions) and number of tokens
+    """
+    tokens = text2tokens(text, stem=False)
+
+    terms = {}
+    if positional:
+        for pos in range(len(tokens)):
+            token = tokens[pos]
+            if token not in terms:
+                terms[token] = [pos]
+            else:
+                terms[token].append(pos)
+    else:
+        for token in tokens:
+            if token not in terms:
+                terms[token] = 1
+            else:
+                terms[token] += 1
+
+    return terms, len(tokens)
+
+
+def read_run(runpath):
+    """
+    Reads run of postings from disk
+    :param runpath: path of the run file
+    :return: generator of (term, docids, values) sorted by term
+    """
+    with open(runpath, 'rb') as run:
+        while True:
+            try:
+                yield pickle.load(run)
+            except EOFError:
+                return
+
+
+def merge_runs(runs):
+    """
+    K-way merge of sorted runs
+    :param runs: list of runs of (term, docids, values) sorted by term
+    :return: generator of merged (term, docids, values) sorted by term and docid
+    """
+    lastterm, docids, values = None, [], []
+
+    # postings of runs with equal terms are appended in the order of runs
+    for term, run_docids, run_values in heapq.merge(*runs, key=lambda entry: entry[0]):
+        if term != lastterm:
+            if lastterm is not None:
+                yield sort_posting(lastterm, docids, values)
+            lastterm, docids, values = term, list(run_docids), list(run_values)
+        else:
+            docids += run_docids
+            values += run_values
+
+    if lastterm is not None:
+        yield sort_posting(lastterm, docids, values)
+
+
+def sort_posting(term, docids, values):
+    """
+    Sorts merged posting by document ids. Runs of consecutive document ranges
+    are already in order, so the posting is sorted only if it's needed
+    :param term: term of the posting
+    :param docids: document ids
+    :param values: term frequencies (or positions) aligned with the document ids
+    :return: tuple of term, sorted document ids and aligned values
+    """
+    if any(docids[i] > docids[i + 1] for i in range(len(docids) - 1)):
+        order = sorted(range(len(docids)), key=docids.__getitem__)
+        docids = [docids[i] for i in order]
+        values = [values[i] for i in order]
+    return term, docids, values
+
+
+def document_stats(docid, terms, ntokens, positional=False):
+    """
+    Computes statistics of the document stored in the index
+    :param docid: id of the document
+    :param terms: dictionary of document terms with their frequencies (or positions)
+    :param ntokens: number of tokens in the document
+    :param positional: type of index
+    :return: tuple of document id, vector length and number of tokens
+    """
+    length = 0.0
+    for value in terms.values():
+        tf = len(value) if positional else value
+        length += 1.0 + math.log10(tf)
+    return docid, math.sqrt(length), ntokens
+
+
+def postings_stream(postings, lengths, positional=False):
+    """
+    Converts merged postings into a stream accepted by 'write_index'
+    :param postings: iterable of (term, docids, values) sorted by term
+    :param lengths: vector lengths of documents
+    :param positional: type of index
+    :return: generator of (term, docids, tfs, positions, max_score) tuples
+    """
+    for term, docids, values in postings:
+        if positional:
+            positions = values
+            tfs = [len(p) for p in positions]
+        else:
+            positions = None
+            tfs = values
+        max_score = max((1 + math.log10(tf)) / lengths[docid] for docid, tf in zip(docids, tfs))
+        yield term, docids, tfs, positions, max_score
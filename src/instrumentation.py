@@ -0,0 +1,186 @@
+import io
+import pstats
+import cProfile
+import threading
+from time import perf_counter
+
+# statistics of the query being processed by the current thread
+local = threading.local()
+
+# functions called with statistics of each finished query
+HOOKS = []
+
+
+def percentile(values, p):
+    """
+    Percentile of the values with linear interpolation
+    :param values: sorted list of values
+    :param p: percentile from 0 to 100
+    :return: value of the percentile
+    """
+    if not values:
+        return 0.0
+    pos = (len(values) - 1) * p / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (pos - lo)
+
+
+class Stage:
+    """
+    Timer of a stage nested into another one, its time is excluded from the enclosing stage
+    """
+    __slots__ = ('stats', 'name', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = perf_counter() - self.start
+        stats = self.stats
+        stats.stages[self.name] = stats.stages.get(self.name, 0.0) + elapsed
+        stats.nested += elapsed
+        return False
+
+
+class NullStage:
+    """
+    Timer used when no query is instrumented
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class QueryStats:
+    """
+    Timings of stages and counters of a single query. Stages following each other are
+    recorded with 'lap', stages inside them (e.g. fetching of postings) with 'stage'
+    """
+
+    def __init__(self, query, profile=False):
+        self.query = query
+        self.stages = {}
+        self.counters = {}
+        self.total = 0.0
+        self.profile = None
+
+        self.profiler = cProfile.Profile() if profile else None
+        self.start = self.mark = perf_counter()
+        self.nested = 0.0
+
+    def lap(self, name):
+        """
+        Records time passed since the previous lap as the stage
+        :param name: name of the stage
+        """
+        now = perf_counter()
+        self.stages[name] = self.stages.get(name, 0.0) + now - self.mark - self.nested
+        self.mark = now
+        self.nested = 0.0
+
+    def stage(self, name):
+        return Stage(self, name)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self):
+        """
+        Statistics of the query as a dictionary with times in milliseconds
+        :return: dictionary of query, total time, stage times, counters and profile
+        """
+        return {
+            'query': self.query,
+            'total_ms': 1000 * self.total,
+            'stages_ms': {name: 1000 * time for name, time in self.stages.items()},
+            'counters': dict(self.counters),
+            'profile': self.profile,
+        }
+
+    def report(self):
+        """
+        Human-readable report of the statistics
+        :return: report string
+        """
+        lines = ['Query: "%s"' % self.query, 'Total: %.3f ms' % (1000 * self.total)]
+        for name, time in self.stages.items():
+            lines.append('  %-14s %9.3f ms' % (name, 1000 * time))
+        for name, value in self.counters.items():
+            lines.append('  %-14s %9d' % (name, value))
+        if self.profile:
+            lines.append(self.profile)
+        return '\n'.join(lines)
+
+    def __enter__(self):
+        local.stats = self
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler is not None:
+            self.profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(20)
+            self.profile = out.getvalue()
+            self.profiler = None
+        self.total = perf_counter() - self.start
+        local.stats = None
+        for hook in HOOKS:
+            hook(self)
+        return False
+
+
+def current():
+    """
+    Statistics of the query processed by the current thread
+    :return: instance of 'QueryStats' or None
+    """
+    return getattr(local, 'stats', None)
+
+
+def stage(name):
+    """
+    Timer of the nested stage of the current query
+    :param name: name of the stage
+    :return: context manager
+    """
+    stats = getattr(local, 'stats', None)
+    if stats is None:
+        return NULL_STAGE
+    return Stage(stats, name)
+
+
+def count(name, n=1):
+    """
+    Increments counter of the current query
+    :param name: name of the counter
+    :param n: increment
+    """
+    stats = getattr(local, 'stats', None)
+    if stats is not None:
+        stats.counters[name] = stats.counters.get(name, 0) + n
+
+
+def add_hook(hook):
+    """
+    Registers function called with 'QueryStats' of each finished query, e.g. for tracing
+    :param hook: function of one argument
+    """
+    HOOKS.append(hook)
+
+
+def remove_hook(hook):
+    HOOKS.remove(hook)
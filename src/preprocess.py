@@ -1,11 +1,79 @@
 import re
 import string
+import nltk
+from functools import lru_cache
 from nltk.tokenize import word_tokenize
 from nltk.stem.porter import PorterStemmer
+
+# adding path of preloaded nltk data before loading stopwords
+if "../nltk_data" not in nltk.data.path:
+    nltk.data.path.append("../nltk_data")
+
 from nltk.corpus import stopwords
 
 stemmer = PorterStemmer()
-STOP_WORDS = list(string.punctuation) + ["'a", "'s"] + list(stopwords.words('english'))
+STOP_WORDS = frozenset(list(string.punctuation) + ["'a", "'s"] + list(stopwords.words('english')))
+
+# tokenizer used for documents and queries: 'regex' or 'nltk'
+TOKENIZER = 'regex'
+
+# rules of 'nltk.tokenize.NLTKWordTokenizer' compiled for the whole text at once,
+# sentences are placed on separate lines, the text is expected to be lowercased
+TOKEN_RULES = [
+    # starting quotes
+    (re.compile(r"[«“‘„]|`+"), r" \g<0> "),
+    (re.compile(r'^"', re.M), r"``"),
+    (re.compile(r"``"), r" \g<0> "),
+    (re.compile(r"(?<=[ \(\[{<])(?:\"|'')"), r" `` "),
+    (re.compile(r"'(?!re|ve|ll|m|t|s|d|n)(?=\w\b)"), r"' "),
+    # final period of the sentence
+    (re.compile(r"(?<=[^.\n])\.(?=[\]\)}>\"'»”’ ]*[^\S\n]*$)", re.M), r" . "),
+    # punctuation
+    (re.compile(r"([:,])([^\d])"), r" \1 \2"),
+    (re.compile(r"[:,]$", re.M), r" \g<0> "),
+    (re.compile(r"\.{2,}"), r" \g<0> "),
+    (re.compile(r"[;@#$%&?!*\]\[\(\)\{\}\<\>]|--"), r" \g<0> "),
+    (re.compile(r"(?<=[^'\n])' "), r" ' "),
+    (re.compile(r"\n"), r" \n "),
+    # ending quotes
+    (re.compile(r"[»”’]"), r" \g<0> "),
+    (re.compile(r"''|\""), " '' "),
+    (re.compile(r"(?<=[^' ])('[smd]?|'ll|'re|'ve|n't) "), r" \1 "),
+    # contractions
+    (re.compile(r"\b(?:can(?=not\b)|d(?='ye\b)|gim(?=me\b)|gon(?=na\b)|got(?=ta\b)|lem(?=me\b)"
+                r"|more(?='n\b)|wan(?=na\s))"), r" \g<0> "),
+    (re.compile(r" 't(?=is\b|was\b)"), r" \g<0> "),
+]
+
+sentence_tokenizer = None
+
+
+def regex_tokenize(text):
+    """
+    Tokenizes lowercased text with compiled rules of 'nltk.tokenize.word_tokenize'
+    :param text: text to be tokenized
+    :return: list of tokens
+    """
+    global sentence_tokenizer
+    if sentence_tokenizer is None:
+        sentence_tokenizer = nltk.data.load('tokenizers/punkt/english.pickle')
+
+    # applying rules to all sentences at once instead of tokenizing each sentence
+    text = '\n'.join(sentence_tokenizer.tokenize(text))
+    for pattern, substitution in TOKEN_RULES:
+        text = pattern.sub(substitution, text)
+    return text.split()
+
+
+def tokenize(text):
+    """
+    Tokenizes lowercased text with the selected tokenizer
+    :param text: text to be tokenized
+    :return: list of tokens
+    """
+    if TOKENIZER == 'regex':
+        return regex_tokenize(text)
+    return word_tokenize(text)
 
 
 def preprocess_word(word, stem=False):
@@ -15,7 +83,19 @@ def preprocess_word(word, stem=False):
     :param stem: condition on applying the stemmer
     :return: preprocessed word
     """
-    word = word_tokenize(word.lower())[0]
+    return cached_preprocess_word(word, stem, TOKENIZER)
+
+
+@lru_cache(maxsize=65536)
+def cached_preprocess_word(word, stem, tokenizer):
+    """
+    Preprocesses word with the given tokenizer, words are memoized for each tokenizer
+    :param word: word to be preprocessed
+    :param stem: condition on applying the stemmer
+    :param tokenizer: selected tokenizer: 'regex' or 'nltk'
+    :return: preprocessed word
+    """
+    word = tokenize(word.lower())[0]
     if stem:
         return stemmer.stem(word)
     return word
@@ -23,13 +103,44 @@ def preprocess_word(word, stem=False):
 
 def text2tokens(text, stem=False):
     """
-    Transforms text into tokens using 'nltk.tokenize'
+    Transforms text into tokens using the selected tokenizer
     :param text: text to be tokenized
     :param stem: condition on applying the stemmer
     :return: list of tokens
     """
     text = re.sub(r" '(\w{2,})", r' "\1', text.replace('\n', ' ')).lower()
-    tokens = list(filter(lambda t: t not in STOP_WORDS, word_tokenize(text)))
+    tokens = [token for token in tokenize(text) if token not in STOP_WORDS]
     if stem:
         return [stemmer.stem(token) for token in tokens]
-    return tokens
\ No newline at end of file
+    return tokens
+
+
+def check_parity(docs):
+    """
+    Checks that the regex tokenizer reproduces tokens of 'nltk.tokenize.word_tokenize'
+    :param docs: dictionary of documents or iterable of (docid, document) pairs
+    :return: ids of documents with different tokens
+    """
+    if isinstance(docs, dict):
+        docs = docs.items()
+
+    mismatches = []
+    for docid, doc in docs:
+        text = doc.get('title', '') + " " + doc.get('content', '')
+        text = re.sub(r" '(\w{2,})", r' "\1', text.replace('\n', ' ')).lower()
+        if regex_tokenize(text) != word_tokenize(text):
+            mismatches.append(docid)
+    return mismatches
+
+
+if __name__ == '__main__':
+    import time
+    from datareader import read_data
+
+    start = time.time()
+    mismatches = check_parity(read_data())
+    if mismatches:
+        print('tokens differ in %d documents: %s' % (len(mismatches), ', '.join(map(str, mismatches[:20]))))
+    else:
+        print('regex tokenizer matches nltk on all documents')
+    print('parity is checked in %.3f s' % (time.time() - start))
@@ -0,0 +1,175 @@
+import math
+from array import array
+
+# number of term frequencies whose log tf weights are taken from a table
+LOG_TF_SIZE = 1024
+# cached log tf weights of term frequencies: LOG_TF[tf] = 1 + log10(tf)
+LOG_TF = [0.0] + [1 + math.log10(tf) for tf in range(1, LOG_TF_SIZE)]
+
+
+class Scorer:
+    """
+    Interface of scoring models. Score of a document is a sum of query term weights
+    multiplied by weights of the terms in the document, normalized per document.
+    Models use only statistics stored in the index: df, number of documents, vector lengths
+    and numbers of tokens of documents, upper bounds of term weights
+    """
+
+    def __init__(self):
+        self.index = None
+        self.generation = None
+
+    def prepare(self, index):
+        """
+        Prepares statistics of the index used by the model, recomputed only when the index changes
+        :param index: index built for the documents collection
+        """
+        generation = getattr(index, 'generation', 0)
+        if self.index is not index or self.generation != generation:
+            self.index = index
+            self.generation = generation
+            self.prepare_index(index)
+
+    def prepare_index(self, index):
+        pass
+
+    def __getstate__(self):
+        # statistics are bound to the index, a pickled model is prepared again where it is used
+        state = dict(self.__dict__)
+        state['index'] = state['generation'] = None
+        return state
+
+    def query_weights(self, index, query_terms):
+        """
+        Weights of the query terms
+        :param index: index built for the documents collection
+        :param query_terms: dictionary of query terms with their frequencies in the query
+        :return: dictionary of query terms with their weights
+        """
+        raise NotImplementedError
+
+    def tf_weight(self, tf, docid):
+        """
+        Weight of the term in the document
+        :param tf: frequency of the term in the document
+        :param docid: id of the document
+        :return: weight of the term
+        """
+        raise NotImplementedError
+
+    def upper_bound(self, index, term, weight):
+        """
+        Upper bound of the normalized score contribution of the term to any document
+        :param index: index built for the documents collection
+        :param term: term of the index
+        :param weight: weight of the term in the query
+        :return: maximal contribution of the term
+        """
+        raise NotImplementedError
+
+    def doc_norms(self):
+        """
+        Normalization factors by which scores of documents are divided
+        :return: array indexed by document id or None if scores are not normalized
+        """
+        return None
+
+    def normalize(self, score, docid):
+        """
+        Normalizes accumulated score of the document
+        :param score: sum of weighted term weights
+        :param docid: id of the document
+        :return: final score of the document
+        """
+        return score
+
+
+class Cosine(Scorer):
+    """
+    Cosine similarity of lnc.ltc weighted vectors: log tf of documents normalized by
+    the vector length of the document, log tf * idf of the query normalized by the query length
+    """
+
+    def prepare_index(self, index):
+        self.lengths = index.lengths
+
+    def query_weights(self, index, query_terms):
+        # computing tf-idf values for query terms and query length
+        query_weights = {}
+        query_length = 0.0
+        for term, tf in query_terms.items():
+            ltf = 1 + math.log10(tf)
+            query_weights[term] = ltf * index.idf(term)
+            query_length += math.pow(query_weights[term], 2)
+
+        query_length = math.sqrt(query_length)
+
+        # computing normalized term weights
+        for term, w in query_weights.items():
+            query_weights[term] = w / query_length
+        return query_weights
+
+    def tf_weight(self, tf, docid):
+        return LOG_TF[tf] if tf < LOG_TF_SIZE else 1 + math.log10(tf)
+
+    def upper_bound(self, index, term, weight):
+        return weight * index.max_score(term)
+
+    def doc_norms(self):
+        return self.lengths
+
+    def normalize(self, score, docid):
+        return score / self.lengths[docid]
+
+    def __repr__(self):
+        return 'Cosine()'
+
+
+class BM25(Scorer):
+    """
+    Okapi BM25: idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)) summed over query terms,
+    where dl is the number of tokens of the document and avgdl is its average over the collection
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        super().__init__()
+        self.k1 = k1
+        self.b = b
+
+    def prepare_index(self, index):
+        # length normalization of term frequencies precomputed for each document
+        avgdl = index.total_tokens / index.ndocs if index.ndocs else 1.0
+        self.norms = array('d', (self.k1 * (1 - self.b + self.b * dl / avgdl) for dl in index.ntokens))
+        self.avgdl = avgdl
+
+    def idf(self, index, term):
+        """
+        Inverse document frequency of BM25, always positive
+        :param index: index built for the documents collection
+        :param term: term of the index
+        :return: idf of the term
+        """
+        df = index.df(term)
+        return math.log(1 + (index.ndocs - df + 0.5) / (df + 0.5))
+
+    def query_weights(self, index, query_terms):
+        return {term: tf * self.idf(index, term) for term, tf in query_terms.items()}
+
+    def tf_weight(self, tf, docid):
+        return tf * (self.k1 + 1) / (tf + self.norms[docid])
+
+    def upper_bound(self, index, term, weight):
+        # weight grows with tf and decreases with the document length
+        tf = index.max_tf(term)
+        norm = self.k1 * (1 - self.b + self.b * index.min_dl(term) / self.avgdl)
+        return weight * tf * (self.k1 + 1) / (tf + norm)
+
+    def __repr__(self):
+        return 'BM25(k1=%s, b=%s)' % (self.k1, self.b)
+
+
+# scoring model used by default
+COSINE = Cosine()
+
+# scoring models selectable by name
+SCORERS = {'cosine': COSINE, 'bm25': BM25()}
@@ -1,93 +1,374 @@
-from preprocess import preprocess_word
-import math
+from preprocess import preprocess_word, text2tokens, STOP_WORDS
+from cache import ResultCache
+from vectorized import numpy_scorer
+from scoring import Cosine, COSINE
+from instrumentation import QueryStats, stage, count
+from storage import Posting
+from termdict import term_dictionary, WILDCARD
+from array import array
+from bisect import bisect_left
+from itertools import compress
+import heapq
+import re
 
 # operators used in search queries with their precedence
 OPERATORS = {'NOT': 3, 'AND': 2, 'OR': 1, '(': 0, ')': 0}
 
+# proximity operator 'NEAR/k' matching terms at most k positions apart, binds tighter than 'NOT'
+NEAR = re.compile(r'NEAR/(\d+)$')
+NEAR_PRECEDENCE = 4
+
+# tokens of the query: quoted phrases, brackets and words
+QUERY_TOKENS = re.compile(r'"[^"]*"?|[()]|[^\s()"]+')
+
+# files with results of the last query, written on demand
+LAST_QUERY_IDS = '../results/lastqueryids.txt'
+LAST_QUERY_DOCS = '../results/lastquery.txt'
+
+# cache of results shared by all searches
+RESULT_CACHE = ResultCache()
+
+# length ratio of postings starting from which intersection gallops through the longer posting
+GALLOP_RATIO = 8
+
+# number of the most frequent terms matching a wildcard pattern added to a ranked query
+MAX_EXPANSIONS = 64
+
+
+def gallop(p, docid, lo=0):
+    """
+    Galloping search: finds the first position in the sorted posting with document id not less than given
+    :param p: sorted array of document ids
+    :param docid: searched document id
+    :param lo: position from which search starts
+    :return: position of the first document id >= docid (or length of the posting)
+    """
+    n = len(p)
+    step, hi = 1, lo
+    while hi < n and p[hi] < docid:
+        lo = hi + 1
+        hi += step
+        step <<= 1
+    return bisect_left(p, docid, lo, min(hi, n))
+
+
+def intersect_and(p1, p2):
+    """
+    Intersects two sorted postings. Very unbalanced postings are merged by galloping
+    through the longer one, others by a linear merge of two cursors
+    :param p1: sorted array of document ids
+    :param p2: sorted array of document ids
+    :return: sorted array of document ids present in both postings
+    """
+    if len(p1) > len(p2):
+        p1, p2 = p2, p1
+    answer = array('I')
+    if not p1:
+        return answer
+
+    if len(p2) > GALLOP_RATIO * len(p1):
+        j, n2 = 0, len(p2)
+        for docid in p1:
+            j = gallop(p2, docid, j)
+            if j == n2:
+                break
+            if p2[j] == docid:
+                answer.append(docid)
+        return answer
+
+    i, j, n1, n2 = 0, 0, len(p1), len(p2)
+    while i < n1 and j < n2:
+        d1, d2 = p1[i], p2[j]
+        if d1 == d2:
+            answer.append(d1)
+            i += 1
+            j += 1
+        elif d1 < d2:
+            i += 1
+        else:
+            j += 1
+    return answer
+
+
+def intersect_or(p1, p2):
+    """
+    Unites two sorted postings by a linear merge
+    :param p1: sorted array of document ids
+    :param p2: sorted array of document ids
+    :return: sorted array of document ids present in any of the postings
+    """
+    answer = array('I')
+    i, j, n1, n2 = 0, 0, len(p1), len(p2)
+    while i < n1 and j < n2:
+        d1, d2 = p1[i], p2[j]
+        if d1 == d2:
+            answer.append(d1)
+            i += 1
+            j += 1
+        elif d1 < d2:
+            answer.append(d1)
+            i += 1
+        else:
+            answer.append(d2)
+            j += 1
+    answer.extend(p1[i:])
+    answer.extend(p2[j:])
+    return answer
+
+
+def intersect_and_not(p1, p2):
+    """
+    Subtracts the second sorted posting from the first one
+    :param p1: sorted array of document ids
+    :param p2: sorted array of excluded document ids
+    :return: sorted array of document ids present only in the first posting
+    """
+    answer = array('I')
+    i, j, n1, n2 = 0, 0, len(p1), len(p2)
+
+    if n1 * GALLOP_RATIO < n2:
+        for docid in p1:
+            j = gallop(p2, docid, j)
+            if j == n2 or p2[j] != docid:
+                answer.append(docid)
+        return answer
+
+    while i < n1 and j < n2:
+        d1, d2 = p1[i], p2[j]
+        if d1 == d2:
+            i += 1
+            j += 1
+        elif d1 < d2:
+            answer.append(d1)
+            i += 1
+        else:
+            j += 1
+    answer.extend(p1[i:])
+    return answer
+
+
+MERGES = {'AND': intersect_and, 'OR': intersect_or, 'AND NOT': intersect_and_not}
+
 
 def intersect(p1, p2, op='OR'):
     """
     Merges two postings according to the operation
     :param p1: posting of the first term
     :param p2: posting of the second term
-    :param op: applied operation (default 'OR')
+    :param op: applied operation: 'AND', 'OR' or 'AND NOT' (default 'OR')
     :return: resulting posting with document ids
     """
+    return MERGES[op](as_docids(p1), as_docids(p2))
+
+
+def as_docids(p):
+    """
+    Converts posting into a sorted array of document ids
+    :param p: posting of the term or result of a merge
+    :return: sorted array of document ids
+    """
+    if isinstance(p, array):
+        return p
+    if isinstance(p, (Posting, PositionalPosting)):
+        return p.docids
+    return array('I', p)
+
+
+class PositionalPosting:
+    """
+    Posting with positions: sorted document ids with sorted positions of matches in each document
+    """
+    __slots__ = ('docids', 'positions')
+
+    def __init__(self, docids, positions):
+        self.docids = docids
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.docids)
 
-    # list with docids for terms p1 and p2
-    # pi[0] - id of current processing doc
-    p1, p2 = list(p1), list(p2)
+    def __iter__(self):
+        return iter(self.docids)
+
+
+def match_positions(pp1, pp2, lo, hi):
+    """
+    Linear merge of two position lists: finds positions of the first list having
+    a position of the second list within the given distance range
+    :param pp1: sorted positions of the first term
+    :param pp2: sorted positions of the second term
+    :param lo: minimal distance from the position of the first term
+    :param hi: maximal distance from the position of the first term
+    :return: list of matched positions of the first list
+    """
     answer = []
-    while p1 and p2:
-        if int(p1[0]) == int(p2[0]):
-            answer.append(p1[0])
-            p1.pop(0)
-            p2.pop(0)
-        elif int(p1[0]) < int(p2[0]):
-            if op == 'OR':
-                answer.append(p1[0])
-            p1.pop(0)
-        else:
-            if op == 'OR':
-                answer.append(p2[0])
-            p2.pop(0)
-    if op == 'OR':
-        answer += p1
-        answer += p2
+    j, n = 0, len(pp2)
+    for p in pp1:
+        # skipping positions of the second term which are too far behind
+        while j < n and pp2[j] < p + lo:
+            j += 1
+        if j == n:
+            break
+        q = pp2[j]
+        # the same position can only be taken by the same term
+        if q == p and j + 1 < n:
+            q = pp2[j + 1]
+        if q != p and q <= p + hi:
+            answer.append(p)
     return answer
 
 
-def intersect_pos(p1, p2, k):
+def intersect_phrase(postings):
     """
-    Merges two postings according using positional index
-    (currently supports only 'AND' operation)
-    :param p1: posting of the first term
-    :param p2: posting of the second term
-    :param k: distance between terms
-    :return: resulting posting with document ids
+    Merges positional postings of the phrase terms
+    :param postings: positional postings of consecutive terms of the phrase
+    :return: positional posting with start positions of the phrase
     """
-    answer = []
-    p1, p2 = list(p1.items()), list(p2.items())
-    while p1 and p2:
-        if int(p1[0][0]) == int(p2[0][0]):
-            l = []
-            pp1, pp2 = p1[0][1], p2[0][1]
-            while pp1:
-                while pp2:
-                    if abs(pp1[0] - pp2[0]) <= k and pp1[0] != pp2[0]:
-                        l.append(pp2[0])
-                    elif pp2[0] > pp1[0]:
-                        break
-                    pp2.pop(0)
-                while l != [] and abs(l[0] - pp1[0]) > k:
-                    l.pop(0)
-                for ps in l:
-                    answer.append((p1[0][0], pp1[0], ps))
-                pp1.pop(0)
-            p1.pop(0)
-            p2.pop(0)
-        elif int(p1[0][0]) < int(p2[0][0]):
-            p1.pop(0)
+    docids = intersect_many(postings, 'AND')
+
+    # positions of each term are located by galloping through its posting
+    docids_out, positions_out = array('I'), []
+    cursors = [0] * len(postings)
+    for docid in docids:
+        starts = None
+        for i, p in enumerate(postings):
+            cursors[i] = gallop(p.docids, docid, cursors[i])
+            positions = p.positions[cursors[i]]
+            if starts is None:
+                starts = positions
+            else:
+                starts = match_positions(starts, positions, i, i)
+            if not starts:
+                break
+        if starts:
+            docids_out.append(docid)
+            positions_out.append(starts)
+    return PositionalPosting(docids_out, positions_out)
+
+
+def intersect_near(p1, p2, k):
+    """
+    Merges two positional postings keeping documents in which terms are at most k positions apart
+    :param p1: positional posting of the first term
+    :param p2: positional posting of the second term
+    :param k: maximal distance between terms
+    :return: positional posting with positions of both terms taking part in matches
+    """
+    docids_out, positions_out = array('I'), []
+    i, j = 0, 0
+    n1, n2 = len(p1.docids), len(p2.docids)
+    while i < n1 and j < n2:
+        d1, d2 = p1.docids[i], p2.docids[j]
+        if d1 == d2:
+            pp1, pp2 = p1.positions[i], p2.positions[j]
+            matches = match_positions(pp1, pp2, -k, k)
+            if matches:
+                docids_out.append(d1)
+                positions_out.append(sorted(set(matches).union(match_positions(pp2, pp1, -k, k))))
+            i += 1
+            j += 1
+        elif d1 < d2:
+            i = gallop(p1.docids, d2, i + 1)
         else:
-            p2.pop(0)
-    return answer
+            j = gallop(p2.docids, d1, j + 1)
+    return PositionalPosting(docids_out, positions_out)
 
 
-def intersect_many(terms, operators):
+def intersect_many(postings, op='AND'):
     """
-    Merges several terms in a row applying operations
-    :param terms: list of terms' postings
-    :param operators: operators applied for each pair of terms
+    Merges several postings with the same operation. 'AND' operands are intersected
+    in the order of increasing document frequency and merging stops as soon as
+    the intermediate result is empty. 'OR' operands are united at once
+    :param postings: list of postings
+    :param op: applied operation: 'AND' or 'OR' (default 'AND')
     :return: resulting posting with document ids
     """
-    # terms = sorted(terms, key=lambda t: len(t))
-    result = terms[0]
-    terms.pop(0)
-    while len(terms) > 0 and result != []:
-        result = intersect(result, terms[0], operators[0])
-        terms.pop(0)
-        operators.pop()
-    return result
+    postings = sorted((as_docids(p) for p in postings), key=len)
+    if not postings:
+        return array('I')
+
+    if op == 'AND':
+        result = postings[0]
+        for p in postings[1:]:
+            if not result:
+                break
+            result = intersect_and(result, p)
+        return result
+
+    if len(postings) > 2:
+        # many postings are united at once through a set of document ids
+        return array('I', sorted(set().union(*postings)))
+    return intersect_or(*postings) if len(postings) == 2 else postings[0]
+
+
+def is_operator(token):
+    """
+    Checks whether the query token is an operator or a bracket
+    :param token: token of the query
+    :return: True for operators and brackets
+    """
+    return isinstance(token, str) and (token in OPERATORS or NEAR.match(token) is not None)
+
+
+def is_wildcard(token):
+    """
+    Checks whether the query token is a pattern of terms with '*' standing for any characters
+    :param token: token of the query
+    :return: True for wildcard patterns
+    """
+    return isinstance(token, str) and WILDCARD in token and not token.startswith('"') and not is_operator(token)
+
+
+def expand_wildcards(index, query, rankedmode=True):
+    """
+    Replaces wildcard patterns of the query with matching terms of the index. Ranked queries get
+    MAX_EXPANSIONS most frequent terms, a pattern of the boolean query in RPN becomes the disjunction of all terms
+    :param index: index built for the documents collection
+    :param query: list of query tokens (ranked mode) or parsed query in RPN (boolean mode)
+    :return: query with expanded patterns
+    """
+    expanded = []
+    for token in query:
+        if not is_wildcard(token):
+            expanded.append(token)
+            continue
+        terms = term_dictionary(index).wildcard(token.lower())
+        if rankedmode:
+            # tokens of ranked queries are preprocessed again, terms changed by preprocessing are skipped
+            terms = [term for term in terms if preprocess_word(term, stem=False) == term]
+            expanded += sorted(terms, key=lambda term: (-index.df(term), term))[:MAX_EXPANSIONS]
+        else:
+            expanded += terms + ['OR'] * (len(terms) - 1)
+    return expanded
+
+
+def precedence(operator):
+    """
+    Precedence of the operator
+    :param operator: operator or bracket
+    :return: precedence value
+    """
+    if operator in OPERATORS:
+        return OPERATORS[operator]
+    return NEAR_PRECEDENCE
+
+
+def split_query(query):
+    """
+    Splits query into words, brackets and quoted phrases
+    :param query: string value of the query
+    :return: list of query tokens
+    """
+    return QUERY_TOKENS.findall(query)
+
+
+def phrase_terms(phrase):
+    """
+    Terms of the quoted phrase. Stop words are not indexed, so they are skipped in phrases too
+    :param phrase: phrase in quotes
+    :return: list of terms
+    """
+    return text2tokens(phrase.strip('"'), stem=False)
 
 
 def shunting_yard(query):
@@ -115,17 +396,30 @@ def shunting_yard(query):
                 except IndexError:
                     return {'error_message': "Missing opening bracket '('. Please, try again."}
 
-        elif token in OPERATORS:
+        elif is_operator(token):
             # popping operators from operator stack to result list if they are of higher precedence
             if operator_stack:
                 current_operator = operator_stack[-1]
-                while operator_stack and OPERATORS[current_operator] > OPERATORS[token]:
+                while operator_stack and precedence(current_operator) > precedence(token):
                     result.append(operator_stack.pop())
                     if operator_stack:
                         current_operator = operator_stack[-1]
 
             operator_stack.append(token)  # add token to stack
 
+        elif token.startswith('"'):
+            # adding phrases to the result list as tuples of their terms
+            terms = phrase_terms(token)
+            if not token.endswith('"') or len(token) == 1:
+                return {'error_message': "Missing closing quote '\"'. Please, try again."}
+            if not terms:
+                return {'error_message': "Phrase %s consists of stop words only. Please, try again." % token}
+            result.append(terms[0] if len(terms) == 1 else tuple(terms))
+
+        elif is_wildcard(token):
+            # patterns are expanded into terms of the index after parsing
+            result.append(token.lower())
+
         else:
             # adding operands to the result list
             result.append(preprocess_word(token, stem=False))
@@ -137,85 +431,262 @@ def shunting_yard(query):
     return result
 
 
-def boolean_retrieval(docs, index, query):
+def parse_boolean_query(query):
     """
-    Boolean Retrieval search.
-    :param docs: dictionary of documents on which search is being applied
-    :param index: index built for the documents collection
+    Transforms tokens of the boolean query into Reverse Polish Notation
     :param query: list of query tokens
-    :return: ids of found documents or an error message
+    :return: list of terms and operators in RPN or an error message
     """
 
     # filling query with 'OR' operation between terms without any operation
+    query = list(query)
     i, length = 0, len(query)
     while i < length - 1:
-        if query[i] not in OPERATORS and query[i + 1] not in OPERATORS:
+        if not is_operator(query[i]) and not is_operator(query[i + 1]):
             query.insert(i + 1, "OR")
             length += 1
         i += 1
 
     # changing notation of the query
-    query = shunting_yard(query)
+    return shunting_yard(query)
 
-    # checking if any errors have occurred
-    if 'error_message' in query:
-        error_message = query['error_message']
-        return {'error_message': error_message}
 
-    # print(query)
+def term_positions(index, term):
+    """
+    Positional posting of the term
+    :param index: positional index built for the documents collection
+    :param term: term of the index
+    :return: positional posting of the term
+    """
+    with stage('fetch'):
+        return PositionalPosting(index[term].docids, index.positions(term))
 
-    results_stack = []
-    while query:
-        token = query.pop(0)
-        result = []
 
-        # retrieving posting for the term
-        if token not in OPERATORS:
-            result = index[token]
+class QueryError(Exception):
+    """
+    Error of the query found while it is evaluated, reported to the user as an error message
+    """
 
-        try:
-            # applying 'AND'/'OR' operation for two terms
-            if token == 'AND' or token == 'OR':
-                result = intersect(results_stack.pop(), results_stack.pop(), token)
 
-            # applying 'NOT' operation for the term
-            if token == 'NOT':
-                term = results_stack.pop()
-                for docid in docs:
-                    if docid not in term:
-                        result.append(docid)
-        except IndexError:
-            error_message = "Query is not correct. Modify it by adding/removing operators 'AND'/'OR'/'NOT'"
-            return {'error_message': error_message}
+def plan_boolean_query(query):
+    """
+    Builds the plan of the boolean query: a tree of operations in which chains of 'AND' and 'OR'
+    are flattened into one node with all their operands. Nodes are ('term', term), ('phrase', terms),
+    ('near', k, left, right), ('and', operands), ('or', operands) and ('not', operand)
+    :param query: list of terms, phrases and operators in RPN
+    :return: root node of the plan
+    """
+    stack = []
+    try:
+        for token in query:
+            if isinstance(token, tuple):
+                stack.append(('phrase', token))
+            elif token == 'AND' or token == 'OR':
+                right, left = stack.pop(), stack.pop()
+                kind = token.lower()
+                # operands of the left node are extended in place, the node itself is consumed
+                operands = left[1] if left[0] == kind else [left]
+                operands += right[1] if right[0] == kind else [right]
+                stack.append((kind, operands))
+            elif token == 'NOT':
+                stack.append(('not', stack.pop()))
+            elif NEAR.match(token):
+                right, left = stack.pop(), stack.pop()
+                stack.append(('near', int(NEAR.match(token).group(1)), left, right))
+            else:
+                stack.append(('term', token))
+    except IndexError:
+        raise QueryError("Query is not correct. Modify it by adding/removing operators 'AND'/'OR'/'NOT'")
 
-        results_stack.append(result)
+    if len(stack) != 1:
+        raise QueryError("Query is not correct. Modify it by adding/removing operators 'AND'/'OR'/'NOT'")
+    return stack[0]
 
-    if len(results_stack) != 1:
-        error_message = "Query is not correct. Modify it by adding/removing operators 'AND'/'OR'/'NOT'"
-        return {'error_message': error_message}
 
-    results = []
-    for docid in results_stack.pop():
-        results.append((docid, 'N/A'))
+def term_df(index, term):
+    """
+    Document frequency of the term, terms absent from the index have zero frequency
+    :param index: index built for the documents collection
+    :param term: term of the query
+    :return: number of documents containing the term
+    """
+    return index.df(term) if term in index else 0
 
-    return results
+
+def estimate(index, node):
+    """
+    Upper bound of the number of documents matching the node, computed from document frequencies
+    without fetching postings
+    :param index: index built for the documents collection
+    :param node: node of the plan
+    :return: estimated number of documents
+    """
+    kind = node[0]
+    if kind == 'term':
+        return term_df(index, node[1])
+    if kind == 'phrase':
+        return min(term_df(index, term) for term in node[1])
+    if kind == 'near':
+        return min(estimate(index, node[2]), estimate(index, node[3]))
+    if kind == 'not':
+        # estimates of other nodes may exceed their sizes, so only the complement of a term is exact
+        if node[1][0] == 'term':
+            return len(index.docids) - term_df(index, node[1][1])
+        return len(index.docids)
+    estimates = [estimate(index, operand) for operand in node[1]]
+    if kind == 'and':
+        return min(estimates)
+    return min(len(index.docids), sum(estimates))
+
+
+# bitmap of the collection used by the last complement: sorted ids of all documents and their bitmap
+universe_bitmap = (None, None)
+
+
+def complement(universe, docids):
+    """
+    Documents of the collection absent from the given ones. The collection is kept as a bitmap
+    over document ids, excluded documents are cleared in its copy and the rest are collected at once
+    :param universe: sorted ids of all documents
+    :param docids: sorted array of excluded document ids
+    :return: sorted array of document ids
+    """
+    global universe_bitmap
+    source, bitmap = universe_bitmap
+    if source is not universe:
+        bitmap = bytearray(universe[-1] + 1 if universe else 0)
+        for docid in universe:
+            bitmap[docid] = 1
+        universe_bitmap = (universe, bitmap)
+
+    marks = bytearray(bitmap)
+    size = len(marks)
+    for docid in docids:
+        if docid < size:
+            marks[docid] = 0
+    return array('I', compress(range(size), marks))
+
+
+def evaluate_plan(index, node):
+    """
+    Evaluates the node of the plan. Operands of 'AND' are intersected in the order of increasing
+    estimated size, negated operands are then subtracted from the intersection ('AND NOT' merge).
+    Evaluation stops as soon as the intermediate result is empty, so postings of the remaining operands
+    are not fetched. Terms of much longer postings than the intermediate result are looked up
+    by the index, which may skip blocks of their postings. The collection is complemented only
+    by 'NOT' without positive operands
+    :param index: index built for the documents collection
+    :param node: node of the plan
+    :return: sorted array of document ids or positional posting for phrases and proximity operators
+    """
+    kind = node[0]
+    if kind == 'term':
+        if not term_df(index, node[1]):
+            return array('I')
+        with stage('fetch'):
+            return index[node[1]].docids
+
+    if kind == 'phrase':
+        if not index.positional:
+            raise QueryError("Phrase queries require a positional index")
+        if not estimate(index, node):
+            return PositionalPosting(array('I'), [])
+        count('merges')
+        return intersect_phrase([term_positions(index, term) for term in node[1]])
+
+    if kind == 'near':
+        if not index.positional:
+            raise QueryError("Proximity queries require a positional index")
+        operands = []
+        for operand in node[2:]:
+            if operand[0] not in ('term', 'phrase', 'near'):
+                raise QueryError("Operands of 'NEAR' must be terms, phrases or 'NEAR' expressions")
+            if operand[0] == 'term':
+                operands.append(term_positions(index, operand[1]) if term_df(index, operand[1])
+                                else PositionalPosting(array('I'), []))
+            else:
+                operands.append(evaluate_plan(index, operand))
+        count('merges')
+        return intersect_near(operands[0], operands[1], node[1])
+
+    if kind == 'not':
+        result = as_docids(evaluate_plan(index, node[1]))
+        count('merges')
+        return complement(index.docids, result)
+
+    if kind == 'or':
+        results = [as_docids(evaluate_plan(index, operand)) for operand in node[1]]
+        count('merges', len(results) - 1)
+        return intersect_many(results, 'OR')
+
+    # 'AND' of positive operands followed by subtraction of negated ones
+    positive = sorted((operand for operand in node[1] if operand[0] != 'not'), key=lambda n: estimate(index, n))
+    # the largest excluded postings are subtracted first to shrink the result early
+    negative = sorted((operand[1] for operand in node[1] if operand[0] == 'not'),
+                      key=lambda n: estimate(index, n), reverse=True)
+    if not positive:
+        # 'NOT a AND NOT b' is 'NOT (a OR b)'
+        return evaluate_plan(index, ('not', ('or', negative) if len(negative) > 1 else negative[0]))
+    if not estimate(index, positive[0]):
+        return array('I')
+
+    result = as_docids(evaluate_plan(index, positive[0]))
+    for operand in positive[1:]:
+        if not result:
+            return result
+        count('merges')
+        if operand[0] == 'term' and hasattr(index, 'intersect') and \
+                len(result) * GALLOP_RATIO < term_df(index, operand[1]):
+            # documents of a small intermediate result are looked up in blocks of the posting
+            with stage('fetch'):
+                result = index.intersect(operand[1], result)
+        else:
+            result = intersect_and(result, as_docids(evaluate_plan(index, operand)))
+    for operand in negative:
+        if not result:
+            return result
+        count('merges')
+        result = intersect_and_not(result, as_docids(evaluate_plan(index, operand)))
+    return result
 
 
-def ranked_retrieval(docs, index, query):
+def evaluate_boolean_query(index, query):
     """
-    Ranked Retrieval search.
+    Evaluates boolean query over postings of the index according to its optimized plan
+    :param index: index built for the documents collection
+    :param query: list of terms, phrases and operators in RPN
+    :return: ids of found documents or an error message
+    """
+    try:
+        docids = as_docids(evaluate_plan(index, plan_boolean_query(query)))
+    except QueryError as e:
+        return {'error_message': str(e)}
+    return [(str(docid), 'N/A') for docid in docids]
+
+
+def boolean_retrieval(docs, index, query):
+    """
+    Boolean Retrieval search.
     :param docs: dictionary of documents on which search is being applied
     :param index: index built for the documents collection
     :param query: list of query tokens
-    :return: ids of found documents with scores or an error message
+    :return: ids of found documents or an error message
     """
+    query = parse_boolean_query(query)
+
+    # checking if any errors have occurred
+    if 'error_message' in query:
+        return {'error_message': query['error_message']}
 
-    query.sort()
+    return evaluate_boolean_query(index, query)
 
-    ndocs = len(docs)
-    scores = {}
 
-    # preprocessing query terms and computing tf values
+def query_term_frequencies(query):
+    """
+    Preprocesses terms of the ranked query and computes their frequencies
+    :param query: list of query tokens
+    :return: dictionary of query terms with their frequencies in the query, ordered by term
+    """
     query_terms = {}
     for token in query:
         token = preprocess_word(token, stem=False)
@@ -224,97 +695,415 @@ def ranked_retrieval(docs, index, query):
         else:
             query_terms[token] += 1.0
 
-    # computing tf-idf values for query terms and query length
-    query_weights = {}
-    query_length = 0.0
-    for term, tf in query_terms.items():
-        ltf = 1 + math.log10(tf)
-        df = len(index[term])
-        idf = math.log(ndocs / df)
+    # scores are accumulated in the order of terms, so that all scoring paths sum them identically
+    return dict(sorted(query_terms.items()))
 
-        query_weights[term] = ltf * idf
-        query_length += math.pow(query_weights[term], 2)
 
-    query_length = math.sqrt(query_length)
+def ranked_retrieval(docs, index, query, k=None, pruning=True, impacts=False, backend='python', scorer=COSINE):
+    """
+    Ranked Retrieval search.
+    :param docs: dictionary of documents on which search is being applied
+    :param index: index built for the documents collection
+    :param query: list of query tokens
+    :param k: number of top documents to retrieve (all matching documents if None)
+    :param pruning: skipping documents that cannot enter the top k (MaxScore)
+    :param impacts: approximate scoring over quantized impact-ordered postings
+    :param backend: scoring backend: 'python' or 'numpy' (vectorized accumulation, same ranking)
+    :param scorer: scoring model, cosine similarity by default
+    :return: ids of found documents with scores or an error message
+    """
 
-    # computing normalized term weights
-    for term, w in query_weights.items():
-        query_weights[term] = w / query_length
+    scores = {}
+    query_terms = query_term_frequencies(query)
+
+    # computing weights of query terms
+    scorer.prepare(index)
+    query_weights = scorer.query_weights(index, query_terms)
+
+    if impacts:
+        # impacts store quantized weights of the cosine model
+        if not isinstance(scorer, Cosine):
+            raise ValueError("impacts are stored only for the cosine model")
+        scores = score_at_a_time(index, query_weights, k)
+        return [(str(docid), score) for docid, score in scores]
 
-    # print(query_weights, query_length)
+    if backend == 'numpy':
+        scores = numpy_scorer(index).score(query_weights, k, scorer)
+        return [(str(docid), score) for docid, score in scores]
 
-    # computing cosine scores for each document that contains at least one term from the query
+    if k is not None and pruning:
+        scores = maxscore(index, query_weights, k, scorer)
+        return [(str(docid), score) for docid, score in scores]
+
+    # computing scores for each document that contains at least one term from the query
+    tf_weight = scorer.tf_weight
     for term, w in query_weights.items():
-        posting = index[term]
+        with stage('fetch'):
+            posting = index[term]
         for docid, tf in posting.items():
-            ltf = 1 + math.log10(int(tf))
             if docid not in scores:
-                scores[docid] = w * ltf
+                scores[docid] = w * tf_weight(tf, docid)
             else:
-                scores[docid] += w * ltf
+                scores[docid] += w * tf_weight(tf, docid)
 
     scores = list(scores.items())
+    count('documents_scored', len(scores))
 
-    # scores.sort(key=lambda score: score[1], reverse=True)
-    # print(scores)
-
-    # normalizing cosine scores by document length
+    # normalizing scores of documents (by document length for cosine scores)
+    normalize = scorer.normalize
     for i in range(len(scores)):
-        scores[i] = (scores[i][0], scores[i][1] / docs[scores[i][0]]['length'])
+        docid = scores[i][0]
+        scores[i] = (docid, normalize(scores[i][1], docid))
+
+    # ranking by score, ties are broken by document id
+    with stage('sort'):
+        if k is None:
+            scores.sort(key=lambda score: (-score[1], score[0]))
+        else:
+            scores = heapq.nsmallest(k, scores, key=lambda score: (-score[1], score[0]))
+
+    return [(str(docid), score) for docid, score in scores]
+
+
+def maxscore(index, query_weights, k, scorer=COSINE):
+    """
+    Top k scores computed document-at-a-time with MaxScore dynamic pruning.
+    Query terms are ordered by upper bounds of their score contributions. Terms whose bounds
+    together cannot lift a document above the current k-th score become non-essential:
+    their postings are only probed for documents found in the essential ones
+    :param index: index built for the documents collection
+    :param query_weights: normalized weights of the query terms
+    :param k: number of top documents to retrieve
+    :param scorer: prepared scoring model
+    :return: list of (docid, score) sorted by score
+    """
+    if k <= 0 or not query_weights:
+        return []
+
+    # upper bounds are slightly inflated to absorb floating point rounding
+    terms = []
+    for term, w in query_weights.items():
+        with stage('fetch'):
+            posting = index[term]
+        terms.append((scorer.upper_bound(index, term, w) * (1 + 1e-9), w, posting.docids, posting.tfs))
+    terms.sort(key=lambda t: t[0])
+
+    n = len(terms)
+    bounds = [t[0] for t in terms]
+    weights = [t[1] for t in terms]
+    docids = [t[2] for t in terms]
+    tfs = [t[3] for t in terms]
+    sizes = [len(p) for p in docids]
+
+    # cumulative[i] - maximal total score of a document present only in the postings 0..i
+    cumulative = []
+    total = 0.0
+    for bound in bounds:
+        total += bound
+        cumulative.append(total)
+
+    tf_weight = scorer.tf_weight
+    normalize = scorer.normalize
+    cursors = [0] * n
+    heap = []
+    threshold = 0.0
+    essential = 0
+    scored = 0
+
+    while essential < n:
+        # next candidate is the smallest current document id of essential postings
+        candidate = -1
+        for i in range(essential, n):
+            if cursors[i] < sizes[i]:
+                docid = docids[i][cursors[i]]
+                if candidate < 0 or docid < candidate:
+                    candidate = docid
+        if candidate < 0:
+            break
+
+        score = 0.0
+        for i in range(essential, n):
+            c = cursors[i]
+            if c < sizes[i] and docids[i][c] == candidate:
+                score += weights[i] * tf_weight(tfs[i][c], candidate)
+                cursors[i] = c + 1
+
+        # probing non-essential postings while the document still can enter the top k
+        for i in range(essential - 1, -1, -1):
+            if normalize(score, candidate) + cumulative[i] <= threshold:
+                break
+            c = gallop(docids[i], candidate, cursors[i])
+            cursors[i] = c
+            if c < sizes[i] and docids[i][c] == candidate:
+                score += weights[i] * tf_weight(tfs[i][c], candidate)
+        score = normalize(score, candidate)
+        scored += 1
+
+        if len(heap) < k:
+            heapq.heappush(heap, (score, -candidate))
+        elif score > threshold:
+            heapq.heapreplace(heap, (score, -candidate))
+        else:
+            continue
 
-    scores.sort(key=lambda score: score[1], reverse=True)
-    # print(scores)
+        if len(heap) == k:
+            threshold = heap[0][0]
+            while essential < n and cumulative[essential] <= threshold:
+                essential += 1
 
-    # results = []
-    # for i in range(min(20, len(scores))):
-    #     results.append(scores[i])
+    count('documents_scored', scored)
+    heap.sort(reverse=True)
+    return [(-docid, score) for score, docid in heap]
 
+
+def score_at_a_time(index, query_weights, k=None):
+    """
+    Approximate cosine scores computed score-at-a-time over impact-ordered postings.
+    Groups of documents sharing the same quantized impact are processed in the order of
+    decreasing contribution to the score. Processing stops as soon as the remaining groups
+    cannot change the set of top k documents
+    :param index: index built with impacts for the documents collection
+    :param query_weights: normalized weights of the query terms
+    :param k: number of top documents to retrieve (all matching documents if None)
+    :return: list of (docid, score) sorted by score
+    """
+    if k is not None and k <= 0:
+        return []
+
+    # groups of all terms ordered by contribution, ties keep groups of each term in order
+    groups = []
+    nexts = []
+    for i, (term, w) in enumerate(query_weights.items()):
+        with stage('fetch'):
+            term_groups = index.impacts(term)
+        for impact, docids in term_groups:
+            groups.append((w * impact, i, docids))
+        nexts.append([w * impact for impact, _ in term_groups[1:]] + [0.0])
+    groups.sort(key=lambda g: -g[0])
+
+    # remaining[i] - contribution of the next unprocessed group of the term i
+    remaining = [0.0] * len(nexts)
+    for contribution, i, _ in groups:
+        remaining[i] = max(remaining[i], contribution)
+    positions = [0] * len(nexts)
+
+    scores = {}
+    checked = sum(remaining)
+    for contribution, i, docids in groups:
+        for docid in docids:
+            if docid not in scores:
+                scores[docid] = contribution
+            else:
+                scores[docid] += contribution
+        remaining[i] = nexts[i][positions[i]]
+        positions[i] += 1
+
+        # early exit: no document outside the top k can reach the k-th score,
+        # checked each time the bound of remaining contributions drops by a tenth
+        bound = sum(remaining)
+        if k is not None and len(scores) >= k and bound <= 0.9 * checked:
+            checked = bound
+            if bound == 0.0:
+                break
+            top = heapq.nlargest(k + 1, scores.values())
+            kth = top[k - 1]
+            rest = top[k] if len(top) > k else 0.0
+            if rest + bound <= kth:
+                break
+
+    count('documents_scored', len(scores))
+    scores = [(docid, score / index.impact_scale) for docid, score in scores.items()]
+    with stage('sort'):
+        if k is None:
+            scores.sort(key=lambda score: (-score[1], score[0]))
+        else:
+            scores = heapq.nsmallest(k, scores, key=lambda score: (-score[1], score[0]))
     return scores
 
 
-def search(docs, index, query, rankedmode=True):
+def search(docs, index, query, rankedmode=True, k=None, cache=RESULT_CACHE, scorer=COSINE, profile=False):
     """
     Main function of search engine. Searches documents according to the query
     :param docs: dictionary of documents on which search is being applied
     :param index: index built for the documents collection
     :param query: string value on which search is being applied
-    :return:
+    :param rankedmode: ranked or boolean retrieval
+    :param k: number of top documents retrieved in ranked mode (all matching documents if None)
+    :param cache: cache of query results ('None' disables caching)
+    :param scorer: scoring model of ranked retrieval
+    :param profile: running the search under 'cProfile'
+    :return: dictionary with results or an error message, suggested terms for unknown words,
+    and statistics of the query ('QueryStats')
+    """
+    stats = QueryStats(query, profile=profile)
+    with stats:
+        result = process_query(docs, index, query, rankedmode, k, cache, scorer, stats)
+    result['stats'] = stats
+    return result
+
+
+def tokenize_query(query, rankedmode=True):
+    """
+    Splits the query into tokens, phrases are treated as bags of their words in ranked mode
+    :param query: string value of the query
+    :param rankedmode: ranked or boolean retrieval
+    :return: list of query tokens
+    """
+    query = split_query(query)
+    if rankedmode:
+        query = [word for token in query
+                 for word in (token.strip('"').split() if token.startswith('"') else [token])]
+    return query
+
+
+def find_unknown_terms(index, query):
+    """
+    Searches for words and phrases of the query with terms absent from the index
+    :param index: index built for the documents collection
+    :param query: list of query tokens
+    :return: list of unknown tokens
+    """
+    unknown_terms = []
+    for word in query:
+        if is_operator(word):
+            continue
+        if word.startswith('"'):
+            if any(term not in index for term in phrase_terms(word)):
+                unknown_terms.append(word)
+        elif is_wildcard(word):
+            if not term_dictionary(index).wildcard(word.lower()):
+                unknown_terms.append(word)
+        elif preprocess_word(word, stem=False) not in index:
+            unknown_terms.append(word)
+    return unknown_terms
+
+
+def suggest_terms(index, unknown_terms):
+    """
+    Suggests terms of the index for unknown words of the query, stop words are never indexed
+    and get no suggestions
+    :param index: index built for the documents collection
+    :param unknown_terms: list of unknown tokens
+    :return: dictionary of unknown words with lists of suggested terms
+    """
+    suggestions = {}
+    for word in unknown_terms:
+        if word.startswith('"') or is_wildcard(word):
+            continue
+        term = preprocess_word(word, stem=False)
+        if term in STOP_WORDS:
+            continue
+        terms = term_dictionary(index).suggest(term, df=index.df)
+        if terms:
+            suggestions[word] = terms
+    return suggestions
+
+
+def unknown_terms_error(unknown_terms, suggestions):
+    """
+    Error of the boolean query with unknown terms
+    :param unknown_terms: list of unknown tokens
+    :param suggestions: dictionary of unknown words with lists of suggested terms
+    :return: dictionary with an error message and suggestions
+    """
+    error_message = "Query contains unknown term(s): {}.".format('and '.join(unknown_terms))
+    if suggestions:
+        error_message += " Did you mean: {}?".format(', '.join(terms[0] for terms in suggestions.values()))
+    return {'error_message': error_message + " Please, try again", 'suggestions': suggestions}
+
+
+def process_query(docs, index, query, rankedmode, k, cache, scorer, stats):
+    """
+    Searches documents according to the query recording timings of its stages
+    :param docs: dictionary of documents on which search is being applied
+    :param index: index built for the documents collection
+    :param query: string value on which search is being applied
+    :param rankedmode: ranked or boolean retrieval
+    :param k: number of top documents retrieved in ranked mode (all matching documents if None)
+    :param cache: cache of query results ('None' disables caching)
+    :param scorer: scoring model of ranked retrieval
+    :param stats: statistics of the query
+    :return: dictionary with results or an error message, and suggested terms for unknown words
     """
 
-    # query modification
-    init_query = query
-    query = query.replace('(', '( ').replace(')', ' )').split()
+    query = tokenize_query(query, rankedmode)
+    stats.lap('tokenize')
 
     # empty query
     if not query:
         return {}
 
-    # searching for unknown terms in the query
-    unknown_terms = []
-    for word in list(query):
-        if preprocess_word(word, stem=False) not in index and word not in OPERATORS:
-            unknown_terms.append(word)
+    unknown_terms = find_unknown_terms(index, query)
+    stats.lap('unknown_terms')
 
     if unknown_terms and not rankedmode:
-        error_message = "Query contains unknown term(s): {}. Please, try again".format('and '.join(unknown_terms))
-        return {'error_message': error_message}
+        suggestions = suggest_terms(index, unknown_terms)
+        stats.lap('suggest')
+        return unknown_terms_error(unknown_terms, suggestions)
 
     if rankedmode:
-        query = [token for token in query if token not in unknown_terms and token not in OPERATORS]
-        results = ranked_retrieval(docs, index, query)
+        query = [token for token in query if token not in unknown_terms and not is_operator(token)]
+        query = expand_wildcards(index, query)
+        # ranking depends only on the bag of query terms, suggestions for dropped unknown words
+        # are cached along with the results
+        key = ('ranked', repr(scorer), k, tuple(sorted(preprocess_word(token, stem=False) for token in query)),
+               tuple(unknown_terms))
+    else:
+        query = parse_boolean_query(query)
+        if 'error_message' in query:
+            return {'error_message': query['error_message']}
+        query = expand_wildcards(index, query, rankedmode=False)
+        key = ('boolean', tuple(query))
+    stats.lap('parse')
+
+    cached = cache.get(index, key) if cache is not None else None
+    stats.lap('cache')
+    if cached is None:
+        if rankedmode:
+            results = ranked_retrieval(docs, index, query, k=k, scorer=scorer)
+            stats.lap('score')
+        else:
+            results = evaluate_boolean_query(index, query)
+            stats.lap('merge')
+
+        if 'error_message' in results:
+            return results
+
+        # suggestions are computed only for results that are not cached
+        suggestions = suggest_terms(index, unknown_terms) if unknown_terms else {}
+        stats.lap('suggest')
+        if cache is not None:
+            cache.put(index, key, (results, suggestions))
     else:
-        results = boolean_retrieval(docs, index, query)
+        results, suggestions = cached
+        stats.count('cache_hits')
 
-    if 'error_message' in results:
-        return results
+    stats.count('results', len(results))
+    if suggestions:
+        # dropped unknown words of the ranked query
+        return {'results': results, 'suggestions': suggestions}
+    return {'results': results}
 
-    with open('../results/lastqueryids.txt', 'w+') as f:
-        f.write('Query: "%s"\n' % init_query)
+
+def write_docids(query, results, rankedmode=True, k=None, path=LAST_QUERY_IDS, stats=None):
+    """
+    Writes ids of the documents found for the query into a file
+    :param query: string value on which search has been applied
+    :param results: results of the search
+    :param rankedmode: ranked or boolean retrieval
+    :param k: number of top documents retrieved in ranked mode (all matching documents if None)
+    :param path: path of the file
+    :param stats: statistics of the query to which time of the export is added
+    :return: path of the written file
+    """
+    with (stats.stage('export') if stats is not None else stage('export')), open(path, 'w+') as f:
+        f.write('Query: "%s"\n' % query)
 
         if rankedmode:
             outresults = results[:20]
             f.write("Mode: Ranked Retrieval\n")
-            f.write("Found: %d documents\n" % len(results))
+            if k is None:
+                f.write("Found: %d documents\n" % len(results))
             f.write("Top %d documents with scores: \n\n" % len(outresults))
         else:
             outresults = results
@@ -329,14 +1118,29 @@ def search(docs, index, query, rankedmode=True):
                 rank += 1
             else:
                 f.write('%s ' % doc[0])
+    return path
+
 
-    with open('../results/lastquery.txt', 'w+') as f:
-        f.write('Query: "%s"\n' % init_query)
+def write_documents(docs, query, results, rankedmode=True, k=None, path=LAST_QUERY_DOCS, stats=None):
+    """
+    Writes documents found for the query into a file
+    :param docs: dictionary of documents on which search has been applied
+    :param query: string value on which search has been applied
+    :param results: results of the search
+    :param rankedmode: ranked or boolean retrieval
+    :param k: number of top documents retrieved in ranked mode (all matching documents if None)
+    :param path: path of the file
+    :param stats: statistics of the query to which time of the export is added
+    :return: path of the written file
+    """
+    with (stats.stage('export') if stats is not None else stage('export')), open(path, 'w+') as f:
+        f.write('Query: "%s"\n' % query)
 
         if rankedmode:
             outresults = results[:20]
             f.write("Mode: Ranked Retrieval\n")
-            f.write("Found: %d documents\n" % len(results))
+            if k is None:
+                f.write("Found: %d documents\n" % len(results))
             f.write("Top %d documents with scores: \n\n" % len(outresults))
         else:
             outresults = results
@@ -354,5 +1158,4 @@ def search(docs, index, query, rankedmode=True):
             f.write("\n")
             f.write(docs[doc[0]]['title'] + "\n" + docs[doc[0]]['content'])
             f.write("********************************************\n")
-
-    return {'results': results}
+    return path
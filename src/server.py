@@ -0,0 +1,321 @@
+import json
+import asyncio
+import batch
+from time import time, perf_counter
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from search import search
+from scoring import SCORERS
+from storage import DiskIndex
+from instrumentation import percentile
+
+HOST = '127.0.0.1'
+PORT = 8080
+
+# seconds given to a search and to reading a request
+TIMEOUT = 10.0
+# maximal size of request headers and body in bytes
+MAX_REQUEST_SIZE = 64 * 2 ** 10
+
+# results per page by default and at most, maximal rank reachable by pagination in ranked mode
+PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+MAX_DEPTH = 1000
+
+# number of searches queued per worker before requests are rejected as overloaded
+QUEUE_PER_WORKER = 8
+# number of last requests whose latencies are reported
+LATENCY_WINDOW = 1024
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable',
+           504: 'Gateway Timeout'}
+
+
+class RequestError(Exception):
+    """
+    Error of the request reported to the client with the HTTP status
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def search_worker(query, rankedmode, k, scorer):
+    """
+    Searches documents in a worker process with the index opened by 'batch.init_worker'
+    :param query: string value of the query
+    :param rankedmode: ranked or boolean retrieval
+    :param k: number of top documents retrieved in ranked mode
+    :param scorer: name of the scoring model
+    :return: dictionary with results or an error message, and statistics of the query
+    """
+    return run_search(batch.worker_index, query, rankedmode, k, scorer)
+
+
+def run_search(index, query, rankedmode, k, scorer):
+    result = search(None, index, query, rankedmode=rankedmode, k=k, scorer=SCORERS[scorer])
+    # statistics are sent back as a dictionary
+    result['stats'] = result['stats'].as_dict()
+    return result
+
+
+class SearchServer:
+    """
+    HTTP server answering search requests with JSON. Requests are handled by an asyncio event loop,
+    searches run in a pool of worker processes, each opening the index files. An index kept only
+    in memory (e.g. with incremental updates) is searched by a thread of this process instead.
+    Endpoints:
+    GET /search?q=...&mode=ranked|boolean&page=1&size=10&scorer=cosine|bm25 (or POST with a JSON body)
+    GET /health - status of the server and the index
+    GET /metrics - counters of requests and latency percentiles
+    """
+
+    def __init__(self, docs, index, workers=1, timeout=TIMEOUT):
+        self.docs = docs
+        self.index = index
+        self.timeout = timeout
+
+        if workers > 0 and isinstance(index, DiskIndex):
+            self.executor = ProcessPoolExecutor(workers, initializer=batch.init_worker,
+                                                initargs=(index.dictpath, index.postpath))
+            self.processes = True
+        else:
+            workers = 1
+            self.executor = ThreadPoolExecutor(workers)
+            self.processes = False
+        self.workers = workers
+        self.max_pending = QUEUE_PER_WORKER * workers
+
+        # metrics
+        self.started = time()
+        self.requests = 0
+        self.statuses = {}
+        self.pending = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serves requests of a client connection, the connection is kept alive unless the client closes it
+        :param reader: stream of the connection
+        :param writer: stream of the connection
+        """
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.timeout)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                        ConnectionError):
+                    break
+
+                start = perf_counter()
+                keep_alive = False
+                try:
+                    method, target, headers, keep_alive = self.parse_head(head)
+                    size = headers.get('content-length', '0')
+                    if not size.isdigit():
+                        raise RequestError(400, "Malformed Content-Length header")
+                    size = int(size)
+                    if size > MAX_REQUEST_SIZE:
+                        raise RequestError(413, "Request body is too large")
+                    body = await asyncio.wait_for(reader.readexactly(size), self.timeout) if size else b''
+                    status, payload = 200, await self.dispatch(method, target, body)
+                except RequestError as e:
+                    status, payload = e.status, {'error_message': e.message}
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except Exception as e:
+                    status, payload = 500, {'error_message': "Internal error: %s" % e}
+
+                self.requests += 1
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+                self.latencies.append(perf_counter() - start)
+
+                writer.write(self.response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def parse_head(self, head):
+        """
+        Parses request line and headers
+        :param head: bytes of the request up to the empty line
+        :return: method, target, dictionary of headers with lowercase names, keeping connection alive
+        """
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise RequestError(400, "Malformed request line")
+
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get('connection', '').lower()
+        keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+        return method, target, headers, keep_alive
+
+    def response(self, status, payload, keep_alive):
+        body = json.dumps(payload).encode('utf-8')
+        head = 'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n' \
+               % (status, REASONS.get(status, ''), len(body), 'keep-alive' if keep_alive else 'close')
+        return head.encode('latin-1') + body
+
+    async def dispatch(self, method, target, body):
+        """
+        Routes the request to its endpoint
+        :param method: HTTP method
+        :param target: path with query string
+        :param body: body of the request
+        :return: JSON payload of the response
+        """
+        url = urlsplit(target)
+        if url.path == '/search':
+            if method == 'GET':
+                params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            elif method == 'POST':
+                try:
+                    params = json.loads(body.decode('utf-8') or '{}')
+                except ValueError:
+                    raise RequestError(400, "Body is not valid JSON")
+                if not isinstance(params, dict):
+                    raise RequestError(400, "Body must be a JSON object")
+            else:
+                raise RequestError(405, "Use GET or POST")
+            return await self.search(params)
+
+        if method != 'GET':
+            raise RequestError(405, "Use GET")
+        if url.path == '/health':
+            return self.health()
+        if url.path == '/metrics':
+            return self.metrics()
+        raise RequestError(404, "Unknown endpoint %s" % url.path)
+
+    async def search(self, params):
+        """
+        Searches documents and returns the requested page of results
+        :param params: parameters of the request: q, mode, page, size, scorer
+        :return: JSON payload with the page of results
+        """
+        query = str(params.get('q', '')).strip()
+        if not query:
+            raise RequestError(400, "Parameter 'q' is required")
+
+        mode = params.get('mode', 'ranked')
+        if mode not in ('ranked', 'boolean'):
+            raise RequestError(400, "Parameter 'mode' must be 'ranked' or 'boolean'")
+        scorer = params.get('scorer', 'cosine')
+        if scorer not in SCORERS:
+            raise RequestError(400, "Parameter 'scorer' must be one of: %s" % ', '.join(sorted(SCORERS)))
+        try:
+            page = int(params.get('page', 1))
+            size = int(params.get('size', PAGE_SIZE))
+        except (TypeError, ValueError):
+            raise RequestError(400, "Parameters 'page' and 'size' must be integers")
+        if page < 1 or not 1 <= size <= MAX_PAGE_SIZE:
+            raise RequestError(400, "Parameter 'page' must be positive and 'size' between 1 and %d" % MAX_PAGE_SIZE)
+
+        rankedmode = mode == 'ranked'
+        end = page * size
+        if rankedmode and end > MAX_DEPTH:
+            raise RequestError(400, "Ranked results are available up to rank %d" % MAX_DEPTH)
+        # one document more than the page shows whether there is a next page
+        k = end + 1 if rankedmode else None
+
+        if self.pending >= self.max_pending:
+            raise RequestError(503, "Server is overloaded, try again later")
+
+        loop = asyncio.get_running_loop()
+        if self.processes:
+            job = self.executor.submit(search_worker, query, rankedmode, k, scorer)
+        else:
+            job = self.executor.submit(run_search, self.index, query, rankedmode, k, scorer)
+        # a search is pending until the executor finishes it, a timed out search keeps running in the executor
+        self.pending += 1
+        job.add_done_callback(lambda _: loop.is_closed() or loop.call_soon_threadsafe(self.finish_search))
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+        except asyncio.TimeoutError:
+            raise RequestError(504, "Search took longer than %g s" % self.timeout)
+
+        if 'error_message' in result:
+            raise RequestError(400, result['error_message'])
+
+        results = result.get('results', [])
+        payload = {
+            'query': query,
+            'mode': mode,
+            'page': page,
+            'size': size,
+            'has_more': len(results) > end,
+            'took_ms': result['stats']['total_ms'],
+            'results': [self.describe(docid, score) for docid, score in results[end - size:end]],
+        }
+        if not rankedmode:
+            payload['total'] = len(results)
+        if 'suggestions' in result:
+            payload['suggestions'] = result['suggestions']
+        return payload
+
+    def finish_search(self):
+        self.pending -= 1
+
+    def describe(self, docid, score):
+        doc = self.docs.get(docid) if self.docs else None
+        return {'docid': docid, 'score': score if score != 'N/A' else None,
+                'title': ' '.join(doc['title'].split()) if doc else None}
+
+    def health(self):
+        return {'status': 'ok', 'documents': self.index.ndocs, 'terms': len(self.index),
+                'positional': self.index.positional}
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+        return {
+            'uptime_s': time() - self.started,
+            'requests': self.requests,
+            'statuses': {str(status): n for status, n in sorted(self.statuses.items())},
+            'pending_searches': self.pending,
+            'workers': self.workers,
+            'latency_ms': {'p50': 1000 * percentile(latencies, 50), 'p95': 1000 * percentile(latencies, 95),
+                           'p99': 1000 * percentile(latencies, 99)},
+        }
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_REQUEST_SIZE)
+        print('serving on http://%s:%d' % (host, port))
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+
+
+def serve(docs, index, host=HOST, port=PORT, workers=1, timeout=TIMEOUT):
+    """
+    Runs the search server until it is interrupted
+    :param docs: dictionary of documents on which search is being applied
+    :param index: index built for the documents collection
+    :param host: address to listen on
+    :param port: port to listen on
+    :param workers: number of worker processes running searches
+    :param timeout: seconds given to a search and to reading a request
+    """
+    server = SearchServer(docs, index, workers=workers, timeout=timeout)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
@@ -0,0 +1,332 @@
+import os
+import sys
+import glob
+import math
+import heapq
+import multiprocessing
+from array import array
+from multiprocessing.connection import Listener, Client
+from indexer import build_index
+from scoring import COSINE
+from storage import DiskIndex, Posting
+from search import tokenize_query, find_unknown_terms, is_operator, parse_boolean_query, \
+    query_term_frequencies, evaluate_boolean_query, maxscore, expand_wildcards, suggest_terms, unknown_terms_error
+
+# directory with files of shards: 'shard<i>.dict' and 'shard<i>.postings'
+SHARDS_DIR = '../results/shards'
+# key authenticating connections between the coordinator and shard servers
+AUTHKEY = b'search-engine'
+
+
+def shard_paths(directory, i):
+    """
+    Paths of the files of the shard
+    :param directory: directory with shards
+    :param i: number of the shard
+    :return: paths of the term dictionary and postings files
+    """
+    return os.path.join(directory, 'shard%d.dict' % i), os.path.join(directory, 'shard%d.postings' % i)
+
+
+def count_shards(directory=SHARDS_DIR):
+    return len(glob.glob(os.path.join(directory, 'shard*.dict')))
+
+
+def build_shards(docs, nshards, directory=SHARDS_DIR, positional=True, workers=1):
+    """
+    Builds a document-partitioned index: documents are split into ranges of consecutive ids
+    of equal size, each range is indexed into its own shard files
+    :param docs: dictionary of documents (or document store)
+    :param nshards: number of shards
+    :param directory: directory for files of shards
+    :param positional: type of index
+    :param workers: number of processes tokenizing documents of a shard
+    :return: number of built shards
+    """
+    docids = sorted(docs, key=int)
+    nshards = max(1, min(nshards, len(docids)))
+    size = math.ceil(len(docids) / nshards)
+
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, 'shard*')):
+        os.remove(path)
+
+    for i in range(nshards):
+        print('building shard %d of %d...' % (i + 1, nshards))
+        dictpath, postpath = shard_paths(directory, i)
+        shard = ((docid, docs[docid]) for docid in docids[i * size:(i + 1) * size])
+        index = build_index(shard, positional=positional, workers=workers, docstore=False,
+                            dictpath=dictpath, postpath=postpath)
+        index.close()
+    return nshards
+
+
+class ShardView:
+    """
+    Shard of the index seen with statistics of the whole collection. Scores of documents
+    in the shard then match scores in the unsharded index. Terms absent from the shard
+    have empty postings
+    """
+
+    def __init__(self, index, ndocs, total_tokens):
+        self.index = index
+        self.ndocs = ndocs
+        self.total_tokens = total_tokens
+        self.generation = 0
+
+    def __getattr__(self, name):
+        # statistics of documents, term bounds and flags are those of the shard
+        return getattr(self.index, name)
+
+    def __contains__(self, term):
+        return term in self.index
+
+    def __getitem__(self, term):
+        if term not in self.index:
+            return Posting(array('I'), array('I'))
+        return self.index[term]
+
+    def positions(self, term):
+        if term not in self.index:
+            return []
+        return self.index.positions(term)
+
+
+def handle_requests(conn, dictpath, postpath):
+    """
+    Answers requests of the coordinator over the connection until it is closed.
+    Requests are tuples (operation, arguments...), answers are ('ok', value) or ('error', message)
+    :param conn: connection with the coordinator
+    :param dictpath: path of the term dictionary file of the shard
+    :param postpath: path of the postings file of the shard
+    """
+    index = DiskIndex(dictpath, postpath)
+    view = None
+    # scoring models are kept prepared for the shard between queries
+    scorers = {}
+    try:
+        while True:
+            try:
+                request = conn.recv()
+            except EOFError:
+                break
+            operation = request[0]
+            if operation == 'close':
+                conn.send(('ok', None))
+                break
+
+            try:
+                if operation == 'stats':
+                    # document frequencies of terms are sent once to build global statistics
+                    value = (index.ndocs, index.total_tokens, index.positional,
+                             {term: entry[0] for term, entry in index.terms.items()})
+                elif operation == 'collection':
+                    view = ShardView(index, *request[1:])
+                    value = None
+                elif operation == 'ranked':
+                    query_weights, k, scorer = request[1:]
+                    scorer = scorers.setdefault(repr(scorer), scorer)
+                    value = shard_ranked(view, query_weights, k, scorer)
+                elif operation == 'boolean':
+                    value = evaluate_boolean_query(view, request[1])
+                    if 'error_message' not in value:
+                        value = [int(docid) for docid, _ in value]
+                else:
+                    raise ValueError("unknown operation '%s'" % operation)
+                conn.send(('ok', value))
+            except Exception as e:
+                conn.send(('error', '%s: %s' % (type(e).__name__, e)))
+    finally:
+        index.close()
+        conn.close()
+
+
+def shard_ranked(view, query_weights, k, scorer):
+    """
+    Top k documents of the shard for the query weighted with global statistics
+    :param view: shard with global statistics
+    :param query_weights: weights of the query terms
+    :param k: number of top documents to retrieve (all matching documents if None)
+    :param scorer: scoring model
+    :return: list of (docid, score) sorted by score
+    """
+    scorer.prepare(view)
+    query_weights = {term: w for term, w in query_weights.items() if term in view}
+    if k is not None:
+        return maxscore(view, query_weights, k, scorer)
+
+    scores = {}
+    tf_weight = scorer.tf_weight
+    for term, w in query_weights.items():
+        for docid, tf in view[term].items():
+            scores[docid] = scores.get(docid, 0.0) + w * tf_weight(tf, docid)
+    return [(docid, scorer.normalize(score, docid)) for docid, score in scores.items()]
+
+
+def serve_shard(dictpath, postpath, address, authkey=AUTHKEY):
+    """
+    Serves the shard over a socket, a stand-in for a remote node. Coordinators are served one at a time
+    :param dictpath: path of the term dictionary file of the shard
+    :param postpath: path of the postings file of the shard
+    :param address: (host, port) to listen on
+    :param authkey: key authenticating the coordinator
+    """
+    with Listener(address, authkey=authkey) as listener:
+        print('serving shard %s on %s:%d' % (dictpath, *address))
+        while True:
+            handle_requests(listener.accept(), dictpath, postpath)
+
+
+class ShardedIndex:
+    """
+    Coordinator of the sharded index. Each query is sent to all shards at once (scatter),
+    answers are merged (gather): top k lists in ranked mode, sorted document ids in boolean mode.
+    Query terms are weighted with document frequencies and the number of documents of the whole
+    collection, so scores match the unsharded index. Shards are served by local worker processes
+    ('start') or by shard servers reached over sockets ('connect')
+    """
+
+    def __init__(self, connections, processes=()):
+        self.connections = connections
+        self.processes = list(processes)
+
+        # global statistics of the collection
+        self.ndocs, self.total_tokens, self.positional = 0, 0, True
+        self.dfs = {}
+        for ndocs, total_tokens, positional, dfs in self.gather([('stats',)] * len(connections)):
+            self.ndocs += ndocs
+            self.total_tokens += total_tokens
+            self.positional = self.positional and positional
+            for term, df in dfs.items():
+                self.dfs[term] = self.dfs.get(term, 0) + df
+        self.gather([('collection', self.ndocs, self.total_tokens)] * len(connections))
+
+    @classmethod
+    def start(cls, directory=SHARDS_DIR):
+        """
+        Starts a worker process for each shard in the directory
+        :param directory: directory with shards
+        :return: coordinator of the shards
+        """
+        nshards = count_shards(directory)
+        if not nshards:
+            raise FileNotFoundError("no shards are found in '%s'" % directory)
+        connections, processes = [], []
+        for i in range(nshards):
+            conn, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=handle_requests, args=(child, *shard_paths(directory, i)),
+                                              daemon=True)
+            process.start()
+            child.close()
+            connections.append(conn)
+            processes.append(process)
+        return cls(connections, processes)
+
+    @classmethod
+    def connect(cls, addresses, authkey=AUTHKEY):
+        """
+        Connects to shard servers
+        :param addresses: list of (host, port) of servers, one per shard
+        :param authkey: key authenticating the coordinator
+        :return: coordinator of the shards
+        """
+        return cls([Client(address, authkey=authkey) for address in addresses])
+
+    def gather(self, requests):
+        """
+        Sends requests to all shards and collects their answers
+        :param requests: list of requests, one per shard
+        :return: list of answers aligned with shards
+        """
+        for conn, request in zip(self.connections, requests):
+            conn.send(request)
+        answers = [conn.recv() for conn in self.connections]
+        for status, value in answers:
+            if status != 'ok':
+                raise RuntimeError("shard failed: %s" % value)
+        return [value for _, value in answers]
+
+    # statistics of the whole collection used by scoring models to weight query terms
+    def __contains__(self, term):
+        return term in self.dfs
+
+    def __len__(self):
+        return len(self.dfs)
+
+    def __iter__(self):
+        return iter(self.dfs)
+
+    def df(self, term):
+        return self.dfs[term]
+
+    def idf(self, term):
+        return math.log(self.ndocs / self.dfs[term])
+
+    def search(self, query, rankedmode=True, k=None, scorer=COSINE):
+        """
+        Searches documents in all shards according to the query
+        :param query: string value on which search is being applied
+        :param rankedmode: ranked or boolean retrieval
+        :param k: number of top documents retrieved in ranked mode (all matching documents if None)
+        :param scorer: scoring model of ranked retrieval
+        :return: dictionary with results or an error message
+        """
+        query = tokenize_query(query, rankedmode)
+        if not query:
+            return {}
+
+        unknown_terms = find_unknown_terms(self, query)
+        if rankedmode:
+            query = [token for token in query if token not in unknown_terms and not is_operator(token)]
+            query = expand_wildcards(self, query)
+            query_weights = scorer.query_weights(self, query_term_frequencies(query))
+            answers = self.gather([('ranked', query_weights, k, scorer)] * len(self.connections))
+            scores = [score for answer in answers for score in answer]
+            if k is None:
+                scores.sort(key=lambda score: (-score[1], score[0]))
+            else:
+                scores = heapq.nsmallest(k, scores, key=lambda score: (-score[1], score[0]))
+            result = {'results': [(str(docid), score) for docid, score in scores]}
+            suggestions = suggest_terms(self, unknown_terms)
+            if suggestions:
+                result['suggestions'] = suggestions
+            return result
+
+        if unknown_terms:
+            return unknown_terms_error(unknown_terms, suggest_terms(self, unknown_terms))
+        query = parse_boolean_query(query)
+        if 'error_message' in query:
+            return {'error_message': query['error_message']}
+        query = expand_wildcards(self, query, rankedmode=False)
+
+        answers = self.gather([('boolean', query)] * len(self.connections))
+        for answer in answers:
+            if 'error_message' in answer:
+                return {'error_message': answer['error_message']}
+        # shards hold consecutive ranges of document ids, but their order is not assumed
+        docids = sorted(docid for answer in answers for docid in answer)
+        return {'results': [(str(docid), 'N/A') for docid in docids]}
+
+    def close(self):
+        for conn in self.connections:
+            try:
+                conn.send(('close',))
+                conn.recv()
+            except (EOFError, OSError):
+                pass
+            conn.close()
+        for process in self.processes:
+            process.join()
+
+
+if __name__ == '__main__':
+    # 'sharding.py build N' builds N shards from the document store,
+    # 'sharding.py serve I PORT' serves shard I over a socket
+    if len(sys.argv) == 3 and sys.argv[1] == 'build' and sys.argv[2].isdigit():
+        from docstore import load_documents
+        build_shards(load_documents(), int(sys.argv[2]))
+    elif len(sys.argv) == 4 and sys.argv[1] == 'serve' and sys.argv[2].isdigit() and sys.argv[3].isdigit():
+        serve_shard(*shard_paths(SHARDS_DIR, int(sys.argv[2])), ('localhost', int(sys.argv[3])))
+    else:
+        print("Run either 'sharding.py build N' or 'sharding.py serve I PORT'")
+        sys.exit(2)
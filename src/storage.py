@@ -0,0 +1,424 @@
+import os
+import math
+import mmap
+import struct
+import threading
+from array import array
+from collections import OrderedDict
+from instrumentation import count
+from compression import encode_varint, decode_varints, intersect_sorted, CODECS, CODEC_IDS
+
+INDEX_DICT = '../results/indexdict'
+INDEX_POSTINGS = '../results/indexpostings'
+
+# binary index format: magic bytes and current version of the layout
+MAGIC = b'SEIX'
+VERSION = 5
+
+# header of both files: magic, version, flags, number of terms
+HEADER = struct.Struct('<4sHHI')
+# term dictionary entry: df, postings offset, postings size, positions size, impacts size,
+# upper bound of the document-length normalized log tf weight of the term, idf of the term,
+# maximal term frequency and minimal number of tokens of documents containing the term
+ENTRY = struct.Struct('<IQIIIddII')
+TERM_LENGTH = struct.Struct('<H')
+# collection statistics: number of documents, total number of tokens
+COLLECTION = struct.Struct('<IQ')
+# scale of quantized impacts: number of impact levels per unit of term weight
+SCALE = struct.Struct('<d')
+
+FLAG_POSITIONAL = 1
+FLAG_IMPACTS = 2
+# id of the postings codec is stored in two bits of flags, 0 is variable-byte codes
+FLAG_CODEC_SHIFT = 2
+FLAG_CODEC_MASK = 3 << FLAG_CODEC_SHIFT
+
+# number of posting entries kept decoded by the index, recently used postings are kept
+POSTING_CACHE_SIZE = 2 ** 20
+
+# number of levels of quantized impacts, the largest term weight in the collection gets the top level
+IMPACT_LEVELS = 255
+
+
+def encode_positions(positions):
+    """
+    Encodes positions of the term in each document of the posting as gaps
+    :param positions: list of sorted position lists, one per document
+    :return: encoded positions
+    """
+    out = bytearray()
+    for doc_positions in positions:
+        last = 0
+        for pos in doc_positions:
+            encode_varint(pos - last, out)
+            last = pos
+    return out
+
+
+def quantize_impact(weight, scale):
+    """
+    Quantizes document-length normalized weight of the term in the document
+    :param weight: log tf weight of the term divided by the document length
+    :param scale: number of impact levels per unit of weight
+    :return: positive integer impact
+    """
+    return max(1, int(weight * scale + 0.5))
+
+
+def impact_scale(documents):
+    """
+    Computes scale of impacts from the upper bound of term weights in the collection:
+    weight of a term is at most min(sqrt(1 + log10(n)), (1 + log10(n)) / length)
+    for a document of length 'length' with 'n' tokens
+    :param documents: list of (docid, vector length, number of tokens)
+    :return: number of impact levels per unit of weight
+    """
+    max_weight = 0.0
+    for _, length, ntokens in documents:
+        if ntokens:
+            ltf = 1 + math.log10(ntokens)
+            max_weight = max(max_weight, min(math.sqrt(ltf), ltf / length))
+    return IMPACT_LEVELS / max_weight if max_weight else 1.0
+
+
+def encode_impacts(docids, tfs, lengths, scale):
+    """
+    Encodes impact-ordered posting: groups of documents with the same quantized impact in
+    the order of decreasing impact, each group is its impact, size and gaps of sorted document ids
+    :param docids: sorted document ids
+    :param tfs: term frequencies of the documents
+    :param lengths: vector lengths of documents indexed by document id
+    :param scale: number of impact levels per unit of weight
+    :return: encoded impacts
+    """
+    groups = {}
+    for docid, tf in zip(docids, tfs):
+        impact = quantize_impact((1 + math.log10(tf)) / lengths[docid], scale)
+        if impact not in groups:
+            groups[impact] = [docid]
+        else:
+            groups[impact].append(docid)
+
+    out = bytearray()
+    for impact in sorted(groups, reverse=True):
+        group = groups[impact]
+        encode_varint(impact, out)
+        encode_varint(len(group), out)
+        last = 0
+        for docid in group:
+            encode_varint(docid - last, out)
+            last = docid
+    return out
+
+
+def write_index(postings, documents, positional=False, impacts=False,
+                dictpath=INDEX_DICT, postpath=INDEX_POSTINGS, codec='vbyte'):
+    """
+    Writes index in the binary format: term dictionary with collection statistics
+    and flat postings file
+    :param postings: iterable of (term, docids, tfs, positions, max_score) sorted by term
+    :param documents: list of (docid, vector length, number of tokens) sorted by docid
+    :param positional: whether positions of terms are stored
+    :param impacts: whether impact-ordered copies of postings are stored
+    :param dictpath: path of the term dictionary file
+    :param postpath: path of the postings file
+    :param codec: name of the postings codec: 'vbyte' or 'bitpack'
+    """
+    if codec not in CODECS:
+        raise ValueError("unknown postings codec '%s'" % codec)
+    codec = CODECS[codec]
+    os.makedirs(os.path.dirname(dictpath), exist_ok=True)
+    flags = (FLAG_POSITIONAL if positional else 0) | (FLAG_IMPACTS if impacts else 0) | \
+        (codec.id << FLAG_CODEC_SHIFT)
+
+    ndocs = len(documents)
+    scale = impact_scale(documents)
+    ntokens = {doc[0]: doc[2] for doc in documents}
+    lengths = {}
+    if impacts:
+        lengths = {doc[0]: doc[1] for doc in documents}
+
+    entries = bytearray()
+    nterms = 0
+    with open(postpath, 'wb') as postfile:
+        postfile.write(HEADER.pack(MAGIC, VERSION, flags, 0))
+        offset = HEADER.size
+        for term, docids, tfs, positions, max_score in postings:
+            block = codec.encode(docids, tfs)
+            posblock = encode_positions(positions) if positional else b''
+            impblock = encode_impacts(docids, tfs, lengths, scale) if impacts else b''
+            postfile.write(block)
+            postfile.write(posblock)
+            postfile.write(impblock)
+
+            term = term.encode('utf-8')
+            entries += TERM_LENGTH.pack(len(term)) + term
+            entries += ENTRY.pack(len(docids), offset, len(block), len(posblock), len(impblock),
+                                  max_score, math.log(ndocs / len(docids)),
+                                  max(tfs), min(ntokens[docid] for docid in docids))
+            offset += len(block) + len(posblock) + len(impblock)
+            nterms += 1
+
+    docids = array('I', (doc[0] for doc in documents))
+    lengths = array('d', (doc[1] for doc in documents))
+    ntokens = array('I', (doc[2] for doc in documents))
+
+    with open(dictpath, 'wb') as dictfile:
+        dictfile.write(HEADER.pack(MAGIC, VERSION, flags, nterms))
+        dictfile.write(COLLECTION.pack(len(docids), sum(ntokens)))
+        dictfile.write(SCALE.pack(scale))
+        dictfile.write(docids.tobytes())
+        dictfile.write(lengths.tobytes())
+        dictfile.write(ntokens.tobytes())
+        dictfile.write(entries)
+
+
+def read_header(buf, path):
+    """
+    Reads and validates header of the index file
+    :param buf: content of the file
+    :param path: path of the file used in error messages
+    :return: flags and number of terms
+    """
+    if len(buf) < HEADER.size:
+        raise ValueError("'%s' is not an index file" % path)
+    magic, version, flags, nterms = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError("'%s' is not an index file" % path)
+    if version != VERSION:
+        raise ValueError("'%s' has index format version %d, expected %d" % (path, version, VERSION))
+    return flags, nterms
+
+
+def read_array(buf, pos, typecode, count):
+    """
+    Reads an array of fixed-size values from the buffer
+    :param buf: content of the file
+    :param pos: offset of the array
+    :param typecode: type of array values
+    :param count: number of values
+    :return: read array and offset right after it
+    """
+    values = array(typecode)
+    end = pos + values.itemsize * count
+    values.frombytes(buf[pos:end])
+    return values, end
+
+
+class Posting:
+    """
+    Decoded posting of a term: sorted document ids with term frequencies
+    """
+    __slots__ = ('docids', 'tfs')
+
+    def __init__(self, docids, tfs):
+        self.docids = docids
+        self.tfs = tfs
+
+    def __len__(self):
+        return len(self.docids)
+
+    def __iter__(self):
+        return iter(self.docids)
+
+    def items(self):
+        return zip(self.docids, self.tfs)
+
+
+class DiskIndex:
+    """
+    Inverted index stored in the binary format. Term dictionary and statistics of documents
+    are read eagerly, postings are accessed through 'mmap' and decoded only when requested.
+    Decoded postings are kept in a cache bounded by the number of their entries
+    """
+
+    def __init__(self, dictpath=INDEX_DICT, postpath=INDEX_POSTINGS, cache_size=POSTING_CACHE_SIZE):
+        self.dictpath = dictpath
+        self.postpath = postpath
+        with open(dictpath, 'rb') as dictfile:
+            buf = dictfile.read()
+        flags, nterms = read_header(buf, dictpath)
+        self.positional = bool(flags & FLAG_POSITIONAL)
+        self.impact_ordered = bool(flags & FLAG_IMPACTS)
+        codec_id = (flags & FLAG_CODEC_MASK) >> FLAG_CODEC_SHIFT
+        if codec_id not in CODEC_IDS:
+            raise ValueError("'%s' uses unknown postings codec %d" % (dictpath, codec_id))
+        self.codec = CODEC_IDS[codec_id]
+
+        # collection statistics, scale of impacts and sorted ids of all documents
+        self.ndocs, self.total_tokens = COLLECTION.unpack_from(buf, HEADER.size)
+        self.impact_scale, = SCALE.unpack_from(buf, HEADER.size + COLLECTION.size)
+        pos = HEADER.size + COLLECTION.size + SCALE.size
+        self.docids, pos = read_array(buf, pos, 'I', self.ndocs)
+        lengths, pos = read_array(buf, pos, 'd', self.ndocs)
+        ntokens, pos = read_array(buf, pos, 'I', self.ndocs)
+
+        # vector lengths and numbers of tokens of documents indexed by document id
+        size = self.docids[-1] + 1 if self.docids else 0
+        self.lengths = array('d', bytes(size * 8))
+        self.ntokens = array('I', bytes(size * 4))
+        for docid, length, n in zip(self.docids, lengths, ntokens):
+            self.lengths[docid] = length
+            self.ntokens[docid] = n
+
+        # term -> (df, offset, postings size, positions size, impacts size, max score, idf, max tf, min dl)
+        self.terms = {}
+        for _ in range(nterms):
+            length, = TERM_LENGTH.unpack_from(buf, pos)
+            pos += TERM_LENGTH.size
+            term = buf[pos:pos + length].decode('utf-8')
+            pos += length
+            self.terms[term] = ENTRY.unpack_from(buf, pos)
+            pos += ENTRY.size
+
+        # number of changes applied to the index, the index is immutable
+        self.generation = 0
+
+        self.postfile = open(postpath, 'rb')
+        self.postings = mmap.mmap(self.postfile.fileno(), 0, access=mmap.ACCESS_READ)
+        read_header(self.postings, postpath)
+
+        # recently used postings and the number of their entries
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_entries = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, term):
+        return term in self.terms
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def __getitem__(self, term):
+        df, offset, size = self.terms[term][:3]
+        count('postings')
+        with self.lock:
+            posting = self.cache.get(term)
+            if posting is not None:
+                self.cache.move_to_end(term)
+        if posting is not None:
+            count('posting_cache_hits')
+            return posting
+
+        count('posting_entries', df)
+        posting = Posting(*self.codec.decode(self.postings[offset:offset + size], df))
+        if df <= self.cache_size:
+            with self.lock:
+                if term not in self.cache:
+                    self.cache[term] = posting
+                    self.cache_entries += df
+                while self.cache_entries > self.cache_size:
+                    _, evicted = self.cache.popitem(last=False)
+                    self.cache_entries -= len(evicted)
+        return posting
+
+    def intersect(self, term, docids):
+        """
+        Documents of the given ones containing the term. A posting that is not decoded yet is searched
+        through the skip table of its codec, blocks of the posting without the documents are not decoded
+        :param term: term of the index
+        :param docids: sorted document ids
+        :return: sorted array of document ids containing the term
+        """
+        df, offset, size = self.terms[term][:3]
+        with self.lock:
+            cached = term in self.cache
+        if cached or not self.codec.skips:
+            return intersect_sorted(docids, self[term].docids)
+        count('posting_skips')
+        return self.codec.intersect(self.postings[offset:offset + size], df, docids)
+
+    def df(self, term):
+        """
+        Document frequency of the term
+        :param term: term of the index
+        :return: number of documents containing the term
+        """
+        return self.terms[term][0]
+
+    def max_score(self, term):
+        """
+        Upper bound of the term weight in documents: maximum of log tf divided by document length
+        :param term: term of the index
+        :return: maximal normalized weight of the term over its posting
+        """
+        return self.terms[term][5]
+
+    def idf(self, term):
+        """
+        Inverse document frequency of the term: natural logarithm of N / df
+        :param term: term of the index
+        :return: idf of the term
+        """
+        return self.terms[term][6]
+
+    def max_tf(self, term):
+        """
+        Maximal frequency of the term in documents
+        :param term: term of the index
+        :return: maximal term frequency over the posting
+        """
+        return self.terms[term][7]
+
+    def min_dl(self, term):
+        """
+        Minimal length of documents containing the term
+        :param term: term of the index
+        :return: minimal number of tokens of documents over the posting
+        """
+        return self.terms[term][8]
+
+    def positions(self, term):
+        """
+        Positions of the term in each document of its posting
+        :param term: term of the index
+        :return: list of sorted position lists aligned with the posting
+        """
+        if not self.positional:
+            raise ValueError("index is built without positions")
+        posting = self[term]
+        _, offset, size, possize = self.terms[term][:4]
+        buf = self.postings[offset + size:offset + size + possize]
+        count('positions', sum(posting.tfs))
+        positions, pos = [], 0
+        for tf in posting.tfs:
+            gaps, pos = decode_varints(buf, pos, tf)
+            last = 0
+            for i in range(tf):
+                last += gaps[i]
+                gaps[i] = last
+            positions.append(gaps)
+        return positions
+
+    def impacts(self, term):
+        """
+        Impact-ordered posting of the term
+        :param term: term of the index
+        :return: list of (impact, sorted document ids) in the order of decreasing impact
+        """
+        if not self.impact_ordered:
+            raise ValueError("index is built without impacts")
+        _, offset, size, possize, impsize = self.terms[term][:5]
+        start = offset + size + possize
+        buf = self.postings[start:start + impsize]
+
+        groups, pos = [], 0
+        while pos < impsize:
+            (impact, count), pos = decode_varints(buf, pos, 2)
+            docids, pos = decode_varints(buf, pos, count)
+            last = 0
+            for i in range(count):
+                last += docids[i]
+                docids[i] = last
+            groups.append((impact, docids))
+        return groups
+
+    def close(self):
+        self.cache.clear()
+        self.cache_entries = 0
+        self.postings.close()
+        self.postfile.close()
@@ -0,0 +1,280 @@
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+# number of terms in a front-coded block, the first term of each block is stored in full
+BLOCK_SIZE = 16
+# length of k-grams of terms in the k-gram index
+K = 2
+# marker of the beginning and the end of a term in its k-grams
+BOUNDARY = '$'
+# wildcard matching any sequence of characters in query terms
+WILDCARD = '*'
+
+# maximal edit distance of suggested terms and number of suggestions for an unknown term
+MAX_DISTANCE = 2
+SUGGESTIONS = 3
+
+
+def kgrams(term):
+    """
+    K-grams of the term with marked beginning and end
+    :param term: term of the dictionary
+    :return: set of k-grams
+    """
+    term = BOUNDARY + term + BOUNDARY
+    return {term[i:i + K] for i in range(len(term) - K + 1)}
+
+
+def edit_distance(a, b):
+    """
+    Damerau-Levenshtein distance (optimal string alignment): insertions, deletions, substitutions
+    and transpositions of adjacent characters. Columns of the distance matrix are computed at once
+    as bit vectors of vertical differences (bit-parallel algorithm of Myers extended by Hyyrö)
+    :param a: first string
+    :param b: second string
+    :return: distance
+    """
+    m = len(a)
+    if not m:
+        return len(b)
+    # bit masks of positions of characters in the first string
+    matches = {}
+    for i, char in enumerate(a):
+        matches[char] = matches.get(char, 0) | (1 << i)
+
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    vp, vn, d0, previous, distance = mask, 0, 0, 0, m
+    for char in b:
+        eq = matches.get(char, 0)
+        x = eq | vn
+        transposed = ((~d0 & eq) << 1) & previous
+        d0 = ((((x & vp) + vp) ^ vp) | x | transposed) & mask
+        hp = (vn | ~(d0 | vp)) & mask
+        hn = d0 & vp
+        if hp & last:
+            distance += 1
+        elif hn & last:
+            distance -= 1
+        x = (hp << 1) | 1
+        vn = x & d0
+        vp = ((hn << 1) | ~(x | d0)) & mask
+        previous = eq
+    return distance
+
+
+def contains(values, value):
+    """
+    Checks whether the sorted array contains the value
+    :param values: sorted array
+    :param value: value to be found
+    :return: True if the value is found
+    """
+    i = bisect_left(values, value)
+    return i < len(values) and values[i] == value
+
+
+class TermDictionary:
+    """
+    Sorted vocabulary of the index compressed with front coding: terms are grouped into blocks,
+    each term of a block stores only the suffix that differs from the previous term. Terms are found
+    by binary search over first terms of blocks. A k-gram index maps k-grams to sorted ordinals
+    of terms containing them, it gives candidates of wildcard patterns and of spelling corrections
+    """
+
+    def __init__(self, terms):
+        terms = sorted(terms)
+        self.nterms = len(terms)
+        # first terms of blocks and offsets of blocks in the front-coded data
+        self.heads = []
+        self.offsets = array('I')
+        self.data = bytearray()
+        # term lengths in characters used to prefilter spelling candidates
+        self.lengths = array('H')
+        grams = {}
+
+        # block: lengths of prefixes shared with previous terms, lengths of suffixes, suffixes
+        for start in range(0, len(terms), BLOCK_SIZE):
+            block = [term.encode('utf-8') for term in terms[start:start + BLOCK_SIZE]]
+            self.heads.append(terms[start])
+            self.offsets.append(len(self.data))
+            shared, suffixes, last = array('H'), [], b''
+            for encoded in block:
+                n, limit = 0, min(len(last), len(encoded))
+                while n < limit and last[n] == encoded[n]:
+                    n += 1
+                shared.append(n)
+                suffixes.append(encoded[n:])
+                last = encoded
+            self.data += shared.tobytes()
+            self.data += array('H', (len(suffix) for suffix in suffixes)).tobytes()
+            self.data += b''.join(suffixes)
+
+        for ordinal, term in enumerate(terms):
+            self.lengths.append(min(len(term), 0xffff))
+            for gram in kgrams(term):
+                grams.setdefault(gram, array('I')).append(ordinal)
+        self.data = bytes(self.data)
+        self.grams = grams
+
+    def __len__(self):
+        return self.nterms
+
+    def __iter__(self):
+        for block in range(len(self.heads)):
+            yield from self.block(block)
+
+    def __contains__(self, term):
+        block = bisect_right(self.heads, term) - 1
+        return block >= 0 and term in self.block(block)
+
+    def block(self, block):
+        """
+        Decodes terms of the block
+        :param block: number of the block
+        :return: list of terms
+        """
+        count = min(BLOCK_SIZE, self.nterms - block * BLOCK_SIZE)
+        pos = self.offsets[block]
+        lengths = array('H')
+        lengths.frombytes(self.data[pos:pos + 4 * count])
+        pos += 4 * count
+        terms, last = [], b''
+        for i in range(count):
+            end = pos + lengths[count + i]
+            last = last[:lengths[i]] + self.data[pos:end]
+            pos = end
+            terms.append(last.decode('utf-8'))
+        return terms
+
+    def terms(self, ordinals):
+        """
+        Terms with the given ordinals, each block is decoded once
+        :param ordinals: sorted ordinals of terms
+        :return: list of terms
+        """
+        terms = []
+        block, decoded = -1, None
+        for ordinal in ordinals:
+            if ordinal // BLOCK_SIZE != block:
+                block = ordinal // BLOCK_SIZE
+                decoded = self.block(block)
+            terms.append(decoded[ordinal % BLOCK_SIZE])
+        return terms
+
+    def rank(self, term):
+        """
+        Ordinal of the first term not less than given
+        :param term: string value
+        :return: ordinal in the sorted vocabulary
+        """
+        block = bisect_right(self.heads, term) - 1
+        if block < 0:
+            return 0
+        return block * BLOCK_SIZE + bisect_left(self.block(block), term)
+
+    def prefix_range(self, prefix):
+        """
+        Range of ordinals of terms starting with the prefix
+        :param prefix: prefix of terms
+        :return: first ordinal and ordinal after the last one
+        """
+        if not prefix:
+            return 0, self.nterms
+        # the smallest string greater than all strings with the prefix
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1) if ord(prefix[-1]) < 0x10ffff else None
+        return self.rank(prefix), self.rank(upper) if upper is not None else self.nterms
+
+    def prefix(self, prefix):
+        """
+        Terms starting with the prefix
+        :param prefix: prefix of terms
+        :return: sorted list of terms
+        """
+        return self.terms(range(*self.prefix_range(prefix)))
+
+    def wildcard(self, pattern):
+        """
+        Terms matching the pattern in which '*' stands for any sequence of characters.
+        Candidates are ordinals in the prefix range of the pattern sharing all its k-grams,
+        they are checked against the pattern
+        :param pattern: pattern of terms
+        :return: sorted list of terms
+        """
+        if WILDCARD not in pattern:
+            return [pattern] if pattern in self else []
+        pieces = pattern.split(WILDCARD)
+        lo, hi = self.prefix_range(pieces[0])
+        if len(pieces) == 2 and not pieces[1]:
+            return self.terms(range(lo, hi))
+
+        # k-grams of the pattern pieces, the first and the last pieces are anchored with boundaries
+        bounded = (BOUNDARY + pattern + BOUNDARY).split(WILDCARD)
+        grams = {piece[i:i + K] for piece in bounded for i in range(len(piece) - K + 1)}
+        candidates = None
+        for gram in sorted(grams, key=lambda gram: len(self.grams.get(gram, ()))):
+            ordinals = self.grams.get(gram)
+            if ordinals is None:
+                return []
+            if candidates is None:
+                candidates = ordinals[bisect_left(ordinals, lo):bisect_left(ordinals, hi)]
+            else:
+                candidates = [ordinal for ordinal in candidates if contains(ordinals, ordinal)]
+            if not candidates:
+                return []
+        if candidates is None:
+            candidates = range(lo, hi)
+
+        regex = re.compile('.*'.join(re.escape(piece) for piece in pieces), re.DOTALL)
+        return [term for term in self.terms(candidates) if regex.fullmatch(term)]
+
+    def suggest(self, word, n=SUGGESTIONS, max_distance=MAX_DISTANCE, df=None):
+        """
+        Terms at the smallest edit distance from the word. Each edit changes at most K + 1 k-grams
+        of a term, so only terms of similar length sharing enough k-grams with the word are compared
+        with it. Distances are increased one by one until some terms are found
+        :param word: unknown word
+        :param n: maximal number of suggestions
+        :param max_distance: maximal edit distance of suggested terms
+        :param df: function giving document frequency of a term, more frequent terms are suggested first
+        :return: list of terms sorted by frequency
+        """
+        grams = kgrams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.grams.get(gram, ()))
+
+        # distances of compared terms
+        distances = {}
+        for distance in range(1, max_distance + 1):
+            threshold = max(1, len(grams) - (K + 1) * distance)
+            candidates = sorted(ordinal for ordinal, common in shared.items()
+                                if common >= threshold and abs(self.lengths[ordinal] - len(word)) <= distance
+                                and ordinal not in distances)
+            for ordinal, term in zip(candidates, self.terms(candidates)):
+                distances[ordinal] = (edit_distance(word, term), term)
+            found = [term for d, term in distances.values() if 0 < d <= distance]
+            if found:
+                return sorted(found, key=lambda term: (-df(term) if df is not None else 0, term))[:n]
+        return []
+
+
+dictionary = None
+dictionary_lock = threading.Lock()
+
+
+def term_dictionary(index):
+    """
+    Term dictionary of the index, created once and recreated when the index changes
+    :param index: index built for the documents collection
+    :return: instance of 'TermDictionary'
+    """
+    global dictionary
+    with dictionary_lock:
+        generation = getattr(index, 'generation', 0)
+        if dictionary is None or dictionary[0] is not index or dictionary[1] != generation:
+            dictionary = (index, generation, TermDictionary(term for term in index if term in index))
+        return dictionary[2]
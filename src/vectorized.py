@@ -0,0 +1,180 @@
+import threading
+from scoring import COSINE
+from instrumentation import stage, count
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# maximal number of terms whose postings are kept as arrays
+TERMS_CACHE_SIZE = 4096
+# maximal number of cells of the score matrix of a batch of queries
+MATRIX_SIZE = 2 ** 22
+
+
+class NumpyScorer:
+    """
+    Scoring backend holding postings as NumPy arrays of document ordinals and term weights.
+    Scores are accumulated in a dense array over document ordinals, so a query term costs
+    a single vectorized update instead of a dictionary update per posting entry
+    """
+
+    def __init__(self, index):
+        if np is None:
+            raise ImportError("numpy is required for the vectorized scoring backend")
+
+        self.index = index
+        self.generation = getattr(index, 'generation', 0)
+
+        # ordinals of documents are their positions in the sorted array of document ids
+        self.docids = np.array(index.docids, dtype=np.int64)
+
+        # (model, term) -> (ordinals, weights of the term), model -> normalization factors
+        self.terms = {}
+        self.norms = {}
+        self.lock = threading.Lock()
+
+    def posting(self, term, scorer):
+        """
+        Posting of the term as arrays
+        :param term: term of the index
+        :param scorer: prepared scoring model
+        :return: ordinals of documents containing the term and weights of the term in them
+        """
+        key = (repr(scorer), term)
+        arrays = self.terms.get(key)
+        if arrays is None:
+            with stage('fetch'):
+                posting = self.index[term]
+            ordinals = np.searchsorted(self.docids, np.array(posting.docids, dtype=np.int64))
+
+            # weights are computed by the model itself to match its scores exactly
+            tf_weight = scorer.tf_weight
+            weights = np.array([tf_weight(tf, docid) for docid, tf in posting.items()], dtype=np.float64)
+
+            arrays = (ordinals, weights)
+            with self.lock:
+                if len(self.terms) >= TERMS_CACHE_SIZE:
+                    self.terms.clear()
+                self.terms[key] = arrays
+        return arrays
+
+    def doc_norms(self, scorer):
+        """
+        Normalization factors of documents ordered by ordinals
+        :param scorer: prepared scoring model
+        :return: array of factors or None if scores of the model are not normalized
+        """
+        key = repr(scorer)
+        if key not in self.norms:
+            norms = scorer.doc_norms()
+            if norms is not None:
+                norms = np.array(norms, dtype=np.float64)[self.docids]
+            self.norms[key] = norms
+        return self.norms[key]
+
+    def score(self, query_weights, k=None, scorer=COSINE):
+        """
+        Scores of documents containing at least one query term
+        :param query_weights: weights of the query terms
+        :param k: number of top documents to retrieve (all matching documents if None)
+        :param scorer: prepared scoring model
+        :return: list of (docid, score) sorted by score, ties are broken by document id
+        """
+        scores = np.zeros(len(self.docids))
+        matched = np.zeros(len(self.docids), dtype=bool)
+        for term, w in query_weights.items():
+            ordinals, weights = self.posting(term, scorer)
+            # ordinals are unique within a posting, so fancy indexing accumulates like 'np.add.at'
+            scores[ordinals] += w * weights
+            matched[ordinals] = True
+
+        return self.top(scores, matched, k, scorer)
+
+    def score_batch(self, queries_weights, k=None, scorer=COSINE):
+        """
+        Scores of documents for many queries at once. Scores are accumulated in a dense matrix
+        with a row per query, each term updates rows of all queries containing it in one step.
+        Terms are processed in sorted order, as in queries, so the scores equal those of 'score'
+        :param queries_weights: list of dictionaries with weights of the query terms
+        :param k: number of top documents to retrieve (all matching documents if None)
+        :param scorer: prepared scoring model
+        :return: list of lists of (docid, score) aligned with queries
+        """
+        ndocs = len(self.docids)
+        rows = max(1, MATRIX_SIZE // max(ndocs, 1))
+
+        answers = []
+        for start in range(0, len(queries_weights), rows):
+            chunk = queries_weights[start:start + rows]
+
+            # term -> rows of queries containing the term and weights of the term in them
+            terms = {}
+            for row, query_weights in enumerate(chunk):
+                for term, w in query_weights.items():
+                    terms.setdefault(term, ([], []))
+                    terms[term][0].append(row)
+                    terms[term][1].append(w)
+
+            scores = np.zeros((len(chunk), ndocs))
+            matched = np.zeros((len(chunk), ndocs), dtype=bool)
+            for term in sorted(terms):
+                ordinals, weights = self.posting(term, scorer)
+                term_rows, ws = terms[term]
+                cells = np.ix_(term_rows, ordinals)
+                scores[cells] += np.array(ws)[:, None] * weights
+                matched[cells] = True
+
+            for row in range(len(chunk)):
+                answers.append(self.top(scores[row], matched[row], k, scorer))
+        return answers
+
+    def top(self, scores, matched, k, scorer):
+        """
+        Normalized top k scores of matched documents
+        :param scores: accumulated scores of documents ordered by ordinals
+        :param matched: mask of documents containing at least one query term
+        :param k: number of top documents to retrieve (all matching documents if None)
+        :param scorer: prepared scoring model
+        :return: list of (docid, score) sorted by score, ties are broken by document id
+        """
+        ordinals = np.flatnonzero(matched)
+        count('documents_scored', len(ordinals))
+        scores = scores[ordinals]
+        norms = self.doc_norms(scorer)
+        if norms is not None:
+            scores /= norms[ordinals]
+
+        if k is not None and k < len(ordinals):
+            if k <= 0:
+                return []
+            # documents tied with the k-th score are kept to break ties by document id
+            kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+            candidates = np.flatnonzero(scores >= kth)
+            ordinals, scores = ordinals[candidates], scores[candidates]
+
+        # ordinals follow document ids, so ties are broken by document id
+        with stage('sort'):
+            order = np.lexsort((ordinals, -scores))
+            if k is not None:
+                order = order[:k]
+        return [(int(self.docids[o]), float(scores[i])) for o, i in zip(ordinals[order], order)]
+
+
+scorer = None
+scorer_lock = threading.Lock()
+
+
+def numpy_scorer(index):
+    """
+    Scorer for the index, created once and recreated when the index changes
+    :param index: index built for the documents collection
+    :return: instance of 'NumpyScorer'
+    """
+    global scorer
+    with scorer_lock:
+        if scorer is None or scorer.index is not index \
+                or scorer.generation != getattr(index, 'generation', 0):
+            scorer = NumpyScorer(index)
+        return scorer
@@ -0,0 +1,23 @@
+import os
+import sys
+import pytest
+
+# modules of the search engine are run from 'src', they refer to data and results by relative paths
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC)
+os.chdir(SRC)
+
+from datareader import iter_documents
+from indexer import build_index
+
+
+@pytest.fixture(scope='session')
+def lisa_index(tmp_path_factory):
+    """
+    Positional index of the LISA collection built into a temporary directory
+    """
+    directory = tmp_path_factory.mktemp('index')
+    index = build_index(iter_documents(), positional=True, docstore=False,
+                        dictpath=str(directory / 'indexdict'), postpath=str(directory / 'indexpostings'))
+    yield index
+    index.close()
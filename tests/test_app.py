@@ -0,0 +1,45 @@
+import queue
+import threading
+from unittest.mock import MagicMock
+import app
+from app import GUI
+
+WIDGETS = ('root', 'status', 'search_input', 'tools_label', 'rankedmode', 'rankedmode_che', 'show_docids_btn',
+           'prev_res_btn', 'next_res_btn', 'show_docs_btn', 'prev_doc_btn', 'next_doc_btn', 'tip', 'document')
+
+
+def test_export_uses_query_of_shown_results(monkeypatch):
+    gui = GUI.__new__(GUI)
+    for name in WIDGETS:
+        setattr(gui, name, MagicMock())
+    gui.link_labels, gui.links = [], {}
+    gui.search_results, gui.search_id, gui.polling = queue.Queue(), 0, False
+    gui.show_results = lambda event, page: None
+
+    release = threading.Event()
+
+    def search(docs, index, query, rankedmode, k):
+        if query == 'information retrieval':
+            release.wait(5)
+        return {'results': [('1', 0.5)] if query == 'public libraries' else [('2', 0.5)]}
+
+    exported = []
+    monkeypatch.setattr(app, 'search', search)
+    monkeypatch.setattr(app, 'docs', None, raising=False)
+    monkeypatch.setattr(app, 'index', None, raising=False)
+    monkeypatch.setattr(app, 'write_docids',
+                        lambda query, results, *args, **kwargs: exported.append((query, results)) or 'docids.txt')
+    monkeypatch.setattr(app.os, 'system', lambda command: 0)
+
+    gui.search_input.get.return_value = 'public libraries'
+    gui.rankedmode.get.return_value = True
+    gui.process_input(None)
+    while gui.polling:
+        gui.poll_results()
+
+    # the next search is still running when results are exported
+    gui.search_input.get.return_value = 'information retrieval'
+    gui.process_input(None)
+    gui.open_docidsfile()
+    release.set()
+    assert exported == [('public libraries', [('1', 0.5)])]
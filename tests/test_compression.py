@@ -0,0 +1,16 @@
+import random
+from compression import CODECS, intersect_sorted
+
+
+def test_intersect_matches_decoded_postings():
+    rng = random.Random(0)
+    docids = sorted(rng.sample(range(100000), 1000))
+    tfs = [rng.randint(1, 20) for _ in docids]
+    candidates = sorted(rng.sample(range(100000), 300) + rng.sample(docids, 100))
+    expected = [docid for docid in candidates if docid in set(docids)]
+
+    for codec in CODECS.values():
+        buf = codec.encode(docids, tfs)
+        assert list(codec.decode(buf, len(docids))[0]) == docids
+        assert list(codec.intersect(buf, len(docids), candidates)) == expected
+        assert list(intersect_sorted(candidates, docids)) == expected
@@ -0,0 +1,13 @@
+from docstore import DocStore, write_docstore
+
+
+def test_write_docstore_creates_missing_directory(tmp_path):
+    path = tmp_path / 'missing' / 'results' / 'docstore'
+    write_docstore({2: {'title': 'Public libraries', 'content': 'History of public libraries.'}}, str(path))
+
+    store = DocStore(str(path))
+    try:
+        assert list(store) == ['2']
+        assert store['2']['title'] == 'Public libraries'
+    finally:
+        store.close()
@@ -0,0 +1,52 @@
+import os
+import math
+import incremental
+from incremental import IncrementalIndex
+from indexer import build_index
+
+DOCS = {
+    1: {'title': 'Public libraries', 'content': 'History of public libraries and their services.'},
+    2: {'title': 'Information retrieval', 'content': 'Retrieval of information from library catalogues.'},
+}
+
+
+def open_index(directory):
+    return build_index(DOCS, docstore=False, dictpath=str(directory / 'indexdict'),
+                       postpath=str(directory / 'indexpostings'))
+
+
+def test_merge_rewrites_files_of_the_main_index(tmp_path):
+    index = IncrementalIndex(open_index(tmp_path))
+    index.add_documents({3: {'title': 'Catalogues', 'content': 'Union catalogues of academic libraries.'}})
+    index.merge()
+    try:
+        assert index.main.dictpath == str(tmp_path / 'indexdict')
+        assert list(index.main['catalogues']) == [2, 3]
+        assert sorted(os.listdir(tmp_path)) == ['indexdict', 'indexpostings']
+    finally:
+        index.main.close()
+
+
+def test_merge_keeps_statistics_of_documents_reindexed_during_it(tmp_path, monkeypatch):
+    index = IncrementalIndex(open_index(tmp_path))
+    index.add_documents({3: {'title': 'Catalogues', 'content': 'Union catalogues of academic libraries.'}})
+    lengths = {docid: index.lengths[docid] for docid in (1, 2, 3)}
+    write_index = incremental.write_index
+
+    def reindex_and_write(*args, **kwargs):
+        # documents of the main and frozen segments change while the merged index is written
+        index.add_documents({1: {'title': 'Libraries', 'content': 'Libraries libraries libraries.'},
+                             3: {'title': 'Catalogues', 'content': 'Catalogues.'}})
+        write_index(*args, **kwargs)
+
+    monkeypatch.setattr(incremental, 'write_index', reindex_and_write)
+    index.merge()
+    try:
+        for docid in (1, 2, 3):
+            assert index.main.lengths[docid] == lengths[docid]
+        # bounds of merged postings match lengths of the merged documents
+        assert index.main.max_score('catalogues') == max(1 / lengths[2], (1 + math.log10(2)) / lengths[3])
+        assert index.main_tombstones == {1, 3}
+        assert list(index['catalogues']) == [2, 3]
+    finally:
+        index.main.close()
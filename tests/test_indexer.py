@@ -0,0 +1,39 @@
+import os
+import indexer
+import preprocess
+from datareader import iter_documents
+from indexer import build_index
+from preprocess import check_parity, preprocess_word
+
+DOCS = {
+    1: {'title': 'Public libraries', 'content': 'History of public libraries and their services.'},
+    2: {'title': 'Information retrieval', 'content': 'Retrieval of information from library catalogues.'},
+}
+
+
+def test_build_index_creates_missing_directories(tmp_path, monkeypatch):
+    results = tmp_path / 'missing' / 'results'
+    monkeypatch.setattr(indexer, 'RUNS_DIR', str(results))
+
+    index = build_index(DOCS, docstore=False, dictpath=str(results / 'indexdict'),
+                        postpath=str(results / 'indexpostings'))
+    try:
+        assert os.path.isdir(results)
+        assert list(index['public']) == [1]
+        assert list(index['retrieval']) == [2]
+    finally:
+        index.close()
+
+
+def test_regex_tokenizer_matches_nltk():
+    # every tenth document of the collection
+    docs = [(docid, doc) for i, (docid, doc) in enumerate(iter_documents()) if i % 10 == 0]
+    assert docs
+    assert check_parity(docs) == []
+
+
+def test_preprocessed_words_follow_selected_tokenizer(monkeypatch):
+    assert preprocess_word('Libraries') == 'libraries'
+    monkeypatch.setattr(preprocess, 'TOKENIZER', 'nltk')
+    monkeypatch.setattr(preprocess, 'word_tokenize', lambda text: ['nltk-' + text])
+    assert preprocess_word('Libraries') == 'nltk-libraries'
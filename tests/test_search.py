@@ -0,0 +1,152 @@
+import random
+import pytest
+from array import array
+from cache import ResultCache
+from scoring import SCORERS
+from search import search, intersect, tokenize_query, ranked_retrieval, parse_boolean_query, plan_boolean_query, \
+    evaluate_plan, estimate, as_docids
+
+COMMON_TERMS = ['library', 'libraries', 'information', 'public', 'services', 'system', 'research', 'data',
+                'university', 'computer', 'science', 'india']
+RANKED_QUERIES = ['library science', 'information retrieval systems evaluation', 'public libraries history',
+                  'computer programming languages', 'indian library conference', 'libraries libraries services']
+
+
+def random_posting(rng, size):
+    return array('I', sorted(rng.sample(range(2000), size)))
+
+
+def random_boolean_query(rng, depth=0, phrases=False):
+    """
+    Random boolean query over common terms with nested 'AND', 'OR' and 'NOT'
+    """
+    r = rng.random()
+    if depth > 3 or r < 0.3:
+        return rng.choice(COMMON_TERMS)
+    if phrases and r < 0.4:
+        return '"%s %s"' % (rng.choice(COMMON_TERMS), rng.choice(COMMON_TERMS))
+    if r < 0.5:
+        return 'NOT (%s)' % random_boolean_query(rng, depth + 1, phrases)
+    op = rng.choice(['AND', 'OR', 'AND NOT'])
+    return '(%s %s %s)' % (random_boolean_query(rng, depth + 1, phrases), op,
+                           random_boolean_query(rng, depth + 1, phrases))
+
+
+def naive_boolean_query(index, query):
+    """
+    Evaluates boolean query over sets of document ids
+    """
+    universe = set(index.docids)
+    stack = []
+    for token in parse_boolean_query(tokenize_query(query, False)):
+        if token == 'NOT':
+            stack.append(universe - stack.pop())
+        elif token in ('AND', 'OR'):
+            right, left = stack.pop(), stack.pop()
+            stack.append(left & right if token == 'AND' else left | right)
+        else:
+            stack.append(set(index[token].docids) if token in index else set())
+    return stack.pop()
+
+
+def plan_nodes(node):
+    yield node
+    if node[0] in ('and', 'or'):
+        for operand in node[1]:
+            yield from plan_nodes(operand)
+    elif node[0] == 'not':
+        yield from plan_nodes(node[1])
+
+
+def term_positions(index, term):
+    """
+    Positions of the term in each document as a dictionary
+    """
+    return dict(zip(index[term].docids, index.positions(term)))
+
+
+def test_stop_words_get_no_suggestions(lisa_index):
+    result = search(None, lisa_index, 'history of the public libraries', rankedmode=True, cache=None)
+    assert result['results']
+    assert 'suggestions' not in result
+
+    result = search(None, lisa_index, 'libary AND the', rankedmode=False, cache=None)
+    assert result['suggestions'] == {'libary': ['library']}
+
+
+def test_suggestions_are_cached_with_results(lisa_index):
+    cache = ResultCache()
+    first = search(None, lisa_index, 'libary of congress', rankedmode=True, cache=cache)
+    second = search(None, lisa_index, 'libary of congress', rankedmode=True, cache=cache)
+    assert first['suggestions'] == second['suggestions'] == {'libary': ['library']}
+    assert first['results'] == second['results']
+    assert second['stats'].counters.get('cache_hits') == 1
+    assert 'suggest' not in second['stats'].stages
+
+
+def test_and_with_complement_of_or(lisa_index):
+    # document frequencies of the excluded terms add up to more than the size of the collection
+    excluded = '(library OR information OR libraries)'
+    query = 'public AND (NOT %s OR NOT %s)' % (excluded, excluded)
+    assert len(search(None, lisa_index, query, rankedmode=False, cache=None)['results']) == 54
+
+    query = 'services AND ((public AND NOT %s) OR (system AND NOT %s))' % (excluded, excluded)
+    assert len(search(None, lisa_index, query, rankedmode=False, cache=None)['results']) == 24
+
+
+def test_merges_match_set_operations():
+    rng = random.Random(0)
+    for _ in range(200):
+        # balanced postings are merged linearly, unbalanced ones by galloping
+        p1, p2 = random_posting(rng, rng.randint(0, 40)), random_posting(rng, rng.randint(0, 1000))
+        for first, second in ((p1, p2), (p2, p1)):
+            assert list(intersect(first, second, 'AND')) == sorted(set(first) & set(second))
+            assert list(intersect(first, second, 'OR')) == sorted(set(first) | set(second))
+            assert list(intersect(first, second, 'AND NOT')) == sorted(set(first) - set(second))
+
+
+def test_maxscore_matches_exhaustive_scoring(lisa_index):
+    for scorer in SCORERS.values():
+        for query in RANKED_QUERIES:
+            tokens = tokenize_query(query, True)
+            for k in (1, 10, 50):
+                pruned = ranked_retrieval(None, lisa_index, tokens, k=k, scorer=scorer)
+                exhaustive = ranked_retrieval(None, lisa_index, tokens, k=k, pruning=False, scorer=scorer)
+                # scores are summed in the same order, normalization may differ in the last bit
+                assert [docid for docid, _ in pruned] == [docid for docid, _ in exhaustive], (repr(scorer), query, k)
+                assert [score for _, score in pruned] == pytest.approx([score for _, score in exhaustive], rel=1e-12)
+
+
+def test_phrase_and_near_match_positions(lisa_index):
+    rng = random.Random(3)
+    for _ in range(30):
+        first, second = rng.sample(COMMON_TERMS, 2)
+        pos1, pos2 = term_positions(lisa_index, first), term_positions(lisa_index, second)
+        common = set(pos1) & set(pos2)
+
+        result = search(None, lisa_index, '"%s %s"' % (first, second), rankedmode=False, cache=None)
+        expected = {docid for docid in common if set(pos1[docid]) & {p - 1 for p in pos2[docid]}}
+        assert {int(docid) for docid, _ in result['results']} == expected, (first, second)
+
+        k = rng.randint(1, 5)
+        result = search(None, lisa_index, '%s NEAR/%d %s' % (first, k, second), rankedmode=False, cache=None)
+        expected = {docid for docid in common if any(abs(p - q) <= k for p in pos1[docid] for q in pos2[docid])}
+        assert {int(docid) for docid, _ in result['results']} == expected, (first, second, k)
+
+
+def test_boolean_plan_matches_naive_evaluation(lisa_index):
+    rng = random.Random(1)
+    queries = [random_boolean_query(rng) for _ in range(300)]
+    queries += ['NOT library AND NOT information', 'library AND NOT library', 'NOT (library OR NOT library)']
+    for query in queries:
+        result = search(None, lisa_index, query, rankedmode=False, cache=None)
+        assert {int(docid) for docid, _ in result['results']} == naive_boolean_query(lisa_index, query), query
+
+
+def test_estimates_are_upper_bounds(lisa_index):
+    rng = random.Random(2)
+    for _ in range(300):
+        query = random_boolean_query(rng, phrases=True)
+        plan = plan_boolean_query(parse_boolean_query(tokenize_query(query, False)))
+        for node in plan_nodes(plan):
+            assert estimate(lisa_index, node) >= len(as_docids(evaluate_plan(lisa_index, node))), (query, node)
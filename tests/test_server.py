@@ -0,0 +1,29 @@
+import time
+import asyncio
+import pytest
+import server
+from server import SearchServer, RequestError
+
+
+def slow_search(index, query, rankedmode, k, scorer):
+    time.sleep(0.3)
+    return {'results': [], 'stats': {'total_ms': 300.0}}
+
+
+def test_timed_out_search_stays_pending(monkeypatch):
+    monkeypatch.setattr(server, 'run_search', slow_search)
+
+    async def scenario():
+        app = SearchServer(None, {}, workers=0, timeout=0.05)
+        try:
+            with pytest.raises(RequestError) as error:
+                await app.search({'q': 'library'})
+            assert error.value.status == 504
+            # the search still runs in the executor after the request has timed out
+            assert app.pending == 1
+            await asyncio.sleep(0.5)
+            assert app.pending == 0
+        finally:
+            app.executor.shutdown()
+
+    asyncio.run(scenario())
@@ -0,0 +1,12 @@
+from sharding import build_shards, count_shards
+
+DOCS = {
+    '1': {'title': 'Public libraries', 'content': 'History of public libraries and their services.'},
+    '2': {'title': 'Information retrieval', 'content': 'Retrieval of information from library catalogues.'},
+}
+
+
+def test_build_shards_creates_missing_directory(tmp_path):
+    directory = str(tmp_path / 'missing' / 'shards')
+    assert build_shards(DOCS, 2, directory) == 2
+    assert count_shards(directory) == 2